@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark dell'estrazione AnimeUnity: parsing completo con BeautifulSoup (vecchio
+get_stream/extract_mp4_from_vixcloud) contro la lettura in streaming con uscita
+anticipata, su pagina episodio e pagina embed VixCloud salvate.
+Riporta tempo mediano e picco di memoria (tracemalloc) per ciascun percorso.
+
+Uso: python3 benchmarks/bench_animeunity_extract.py [--episode-page ep.html] [--embed-page embed.html] [--runs 20]
+Senza file usa pagine sintetiche con la stessa struttura (tag seguito da molto altro markup).
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'providers'))
+import animeunity_scraper as au  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+
+def synthetic_episode_page():
+    block = '<div class="episode-item"><a href="/anime/1-x/{0}">Episodio {0}</a></div>'
+    scripts = "".join(f'<script src="/js/chunk-{i}.js"></script>' for i in range(60))
+    return ("<html><head>" + scripts + "</head><body>" +
+            "".join(block.format(i) for i in range(1500)) +
+            '<video-player anime="{&quot;id&quot;:1}" episodes_count="1500" '
+            'embed_url="https://vixcloud.co/embed/123456?token=abc&amp;expires=1893456000&amp;canPlayFHD=1">'
+            "</video-player>" + "".join(block.format(i) for i in range(1500, 6000)) + "</body></html>")
+
+def synthetic_embed_page():
+    return ("<html><head>" + "".join(f"<script>var v{i} = {i};</script>" for i in range(300)) + "</head><body>"
+            "<script>window.masterPlaylist = {params: {'token': 'T', 'expires': '1893456000'}, "
+            "url: 'https://vixcloud.co/playlist/123456?b=1'};</script>"
+            "<script>var player = {src_mp4: 'https://au-d1-01.scws-content.net/download/1/x.mp4?token=T&expires=1893456000'};</script>"
+            "<script>window.downloadUrl = 'https://au-d1-01.scws-content.net/download/1/x.mp4?token=T&expires=1893456000';</script>"
+            + "<p>pad</p>" * 20000 + "</body></html>")
+
+class SavedResponse:
+    """Risposta finta che restituisce la pagina salvata a blocchi, come requests con stream=True."""
+    encoding = "utf-8"
+
+    def __init__(self, data):
+        self.data = data
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+def legacy_embed_url(page_content):
+    """Copia del vecchio get_stream: soup completo della pagina episodio."""
+    soup = BeautifulSoup(page_content, "html.parser")
+    video_player = soup.select_one("video-player")
+    if video_player and video_player.get("embed_url"):
+        return video_player["embed_url"]
+    iframe_match = re.search(r'<iframe[^>]+src="([^"]*vixcloud[^"]+)"', page_content)
+    return iframe_match.group(1) if iframe_match else None
+
+def legacy_mp4(data):
+    """Vecchio extract_mp4_from_vixcloud: response.text decodificato e parsing completo."""
+    return au.extract_mp4_from_html(data.decode("utf-8"))
+
+def streaming_embed_url(data):
+    import html
+
+    match, content = au.scan_response(SavedResponse(data), au.VIDEO_PLAYER_EMBED_RE)
+    if match:
+        return html.unescape(match.group(1).decode("utf-8"))
+    return au.find_embed_url(content.decode("utf-8"))
+
+def streaming_mp4(data):
+    match, content = au.scan_response(SavedResponse(data), au.MP4_URL_RE, au._is_direct_mp4)
+    if match:
+        return au._mp4_from_match(match)
+    return au.extract_mp4_from_html(content.decode("utf-8"))
+
+def measure(function, data, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function(data)
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    function(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, statistics.median(timings), peak / 1024 / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark estrazione embed/MP4 AnimeUnity")
+    parser.add_argument("--episode-page", help="Pagina episodio salvata (HTML)")
+    parser.add_argument("--embed-page", help="Pagina embed VixCloud salvata (HTML)")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    def load(path, fallback):
+        if path:
+            with open(path, "rb") as f:
+                return f.read()
+        return fallback().encode("utf-8")
+
+    episode = load(args.episode_page, synthetic_episode_page)
+    embed = load(args.embed_page, synthetic_embed_page)
+    # Vecchio percorso pagina episodio: response.text e poi soup
+    cases = [
+        ("pagina episodio", episode, lambda d: legacy_embed_url(d.decode("utf-8")), streaming_embed_url),
+        ("pagina embed", embed, legacy_mp4, streaming_mp4),
+    ]
+    for label, data, old, new in cases:
+        old_result, old_ms, old_mb = measure(old, data, args.runs)
+        new_result, new_ms, new_mb = measure(new, data, args.runs)
+        print(f"{label} ({len(data) / 1024:.0f} KiB)")
+        print(f"  parsing completo  {old_ms:8.2f} ms  picco {old_mb:6.2f} MiB")
+        print(f"  streaming         {new_ms:8.2f} ms  picco {new_mb:6.2f} MiB  ({old_ms / new_ms:.0f}x)")
+        if old_result != new_result:
+            print(f"  ATTENZIONE risultati diversi: {old_result!r} != {new_result!r}")
+
+if __name__ == "__main__":
+    main()
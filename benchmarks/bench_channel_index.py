@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del matcher dei canali Vavoo: scansione lineare (vecchio __main__)
+contro ChannelIndex, su un catalogo sintetico.
+Uso: python3 benchmarks/bench_channel_index.py [--channels 10000] [--queries 500]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import contextlib
+import io
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import vavoo_resolver  # noqa: E402
+
+PREFIXES = ["RAI", "SKY", "CANALE", "ITALIA", "RETE", "DAZN", "EUROSPORT", "DISCOVERY", "NOVE", "CINE", "SPORT", "NEWS"]
+SUFFIXES = ["", " HD", " FHD", " 4K", " .a", " .b", " .c", " HD .b", " (BACKUP)"]
+
+def linear_find(channels, wanted):
+    """Copia del matcher originale: tre passaggi lineari con regex per canale."""
+    for ch in channels:
+        if vavoo_resolver.normalize_vavoo_name(ch.get('name', '')) == wanted:
+            return ch
+    for ch in channels:
+        original_name = ch.get('name', '').strip().upper()
+        clean_name = re.sub(r'\s+\.[a-zA-Z]$', '', original_name)
+        clean_name = re.sub(r'\s+(HD|FHD|4K)$', '', clean_name)
+        if wanted in clean_name or clean_name in wanted:
+            return ch
+    for ch in channels:
+        original_name = ch.get('name', '').strip().upper()
+        name_simple = re.sub(r'[^A-Z0-9]', '', original_name)
+        wanted_simple = re.sub(r'[^A-Z0-9]', '', wanted)
+        if wanted_simple in name_simple or name_simple in wanted_simple:
+            return ch
+    return None
+
+def synthetic_catalog(size, rng):
+    channels = []
+    for i in range(size):
+        name = f"{rng.choice(PREFIXES)} {rng.choice(PREFIXES)} {i}{rng.choice(SUFFIXES)}"
+        channels.append({"name": name, "url": f"https://vavoo.to/play/{i}/index.m3u8"})
+    return channels
+
+def synthetic_queries(channels, count, rng):
+    queries = []
+    for _ in range(count):
+        kind = rng.random()
+        name = rng.choice(channels)["name"]
+        if kind < 0.4:
+            queries.append(name)  # esatto
+        elif kind < 0.6:
+            queries.append(re.sub(r'\s+(HD|FHD|4K|\.[a-z])+$', '', name))  # senza qualità
+        elif kind < 0.8:
+            queries.append(name.replace(" ", "-"))  # solo flessibile
+        else:
+            queries.append(f"MISSING CHANNEL {rng.randint(0, 10 ** 6)}")  # miss: caso peggiore
+    return [vavoo_resolver.normalize_vavoo_name(q) for q in queries]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ChannelIndex vs scansione lineare")
+    parser.add_argument("--channels", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    channels = synthetic_catalog(args.channels, rng)
+    queries = synthetic_queries(channels, args.queries, rng)
+
+    # I messaggi [DEBUG] del matcher non fanno parte della misura
+    with contextlib.redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        expected = [linear_find(channels, q) for q in queries]
+        linear_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = vavoo_resolver.ChannelIndex(channels)
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = [index.find(q) for q in queries]
+        indexed_time = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(expected, actual) if a is not b)
+    print(f"Catalogo: {len(channels)} canali, {len(queries)} ricerche")
+    print(f"Lineare:  {linear_time * 1000:9.1f} ms totali, {linear_time / len(queries) * 1000:8.3f} ms/ricerca")
+    print(f"Indice:   {build_time * 1000:9.1f} ms costruzione, {indexed_time / len(queries) * 1000:8.3f} ms/ricerca")
+    print(f"Speedup ricerca: {linear_time / max(indexed_time, 1e-9):.0f}x")
+    print(f"Risultati diversi dal matcher lineare: {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
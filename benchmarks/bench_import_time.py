@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Budget sui tempi di avvio di vavoo_resolver.py, per intercettare regressioni:
+- import del modulo misurato con -X importtime (cumulativo, in microsecondi)
+- requests non deve essere importato dall'import del modulo
+- avvio completo del processo CLI (python3 vavoo_resolver.py senza argomenti)
+Uso: python3 benchmarks/bench_import_time.py [--import-budget-ms 15] [--spawn-budget-ms 150]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SCRIPT = os.path.join(ROOT, 'vavoo_resolver.py')
+# Il bytecode in cache fa parte dell'avvio reale di un import
+ENV = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+
+def import_time_us():
+    """Tempo cumulativo di import di vavoo_resolver e moduli importati."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import sys, vavoo_resolver; print('requests' in sys.modules)"],
+        cwd=ROOT, env=ENV, capture_output=True, text=True, check=True
+    )
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)", line)
+        if match and match.group(3) == "vavoo_resolver" and not match.group(2):
+            cumulative = int(match.group(1))
+    return cumulative, proc.stdout.strip() == "True"
+
+def spawn_time_ms():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, SCRIPT], cwd=ROOT, env=ENV, capture_output=True)
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Budget di avvio per vavoo_resolver.py")
+    parser.add_argument("--import-budget-ms", type=float, default=15.0)
+    parser.add_argument("--spawn-budget-ms", type=float, default=150.0)
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args()
+
+    # Il primo import compila e salva il bytecode: non conta
+    import_time_us()
+    imports = []
+    for _ in range(args.runs):
+        cumulative, loads_requests = import_time_us()
+        imports.append(cumulative / 1000)
+    spawns = [spawn_time_ms() for _ in range(args.runs)]
+
+    import_ms = statistics.median(imports)
+    spawn_ms = statistics.median(spawns)
+    print(f"import vavoo_resolver: {import_ms:7.1f} ms (mediana, budget {args.import_budget_ms} ms)")
+    print(f"avvio CLI:             {spawn_ms:7.1f} ms (mediana, budget {args.spawn_budget_ms} ms)")
+    print(f"requests importato all'import: {'sì' if loads_requests else 'no'}")
+
+    failed = loads_requests or import_ms > args.import_budget_ms or spawn_ms > args.spawn_budget_ms
+    if failed:
+        print("REGRESSIONE: budget di avvio superato", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
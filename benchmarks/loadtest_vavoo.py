@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test di carico del resolver Vavoo contro il server finto (mock_vavoo_server.py).
+Scenari:
+- catalog: get_channels() in-process
+- resolve: resolve_vavoo_link() in-process (cache stream disattivata salvo --stream-cache)
+- cli:     processo "python3 vavoo_resolver.py <nome>" come lo lancia addon.ts
+Per ciascuno riporta latenza p50/p95/p99, richieste al secondo e chiamate upstream per operazione.
+
+Uso: python3 benchmarks/loadtest_vavoo.py [--clients 8] [--requests 200] [--scenarios catalog,resolve,cli]
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from mock_vavoo_server import MockConfig, start_server  # noqa: E402
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank
+    rank = min(len(sorted_values), max(1, math.ceil(pct / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+def upstream_stats(server):
+    with urllib.request.urlopen(f"{server.base_url}/stats") as resp:
+        return json.load(resp)
+
+def reset_stats(server):
+    req = urllib.request.Request(f"{server.base_url}/stats/reset", data=b"{}", method="POST")
+    urllib.request.urlopen(req).close()
+
+def run_scenario(name, operation, inputs, clients, server):
+    """Esegue operation(input) con `clients` worker; operation restituisce True se riuscita."""
+    reset_stats(server)
+    latencies = []
+    errors = 0
+
+    def timed(item):
+        start = time.perf_counter()
+        try:
+            ok = operation(item)
+        except Exception:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for latency, ok in pool.map(timed, inputs):
+            latencies.append(latency)
+            errors += 0 if ok else 1
+    elapsed = time.perf_counter() - start
+
+    stats = upstream_stats(server)
+    latencies.sort()
+    ops = len(inputs)
+    calls = {k: v for k, v in stats.items() if ":" not in k}
+    print(f"\n== {name}: {ops} operazioni, {clients} client concorrenti")
+    print(f"   latenza ms  p50 {percentile(latencies, 50):8.1f}  p95 {percentile(latencies, 95):8.1f}  p99 {percentile(latencies, 99):8.1f}")
+    print(f"   throughput  {ops / elapsed:8.1f} op/s   errori {errors}")
+    print(f"   upstream    {sum(calls.values()) / ops:8.2f} chiamate/op  " +
+          "  ".join(f"{k}={v / ops:.2f}" for k, v in sorted(calls.items())))
+    injected = {k: v for k, v in stats.items() if ":" in k}
+    if injected:
+        print(f"   errori iniettati: {injected}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Test di carico del resolver Vavoo su server finto")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="Operazioni per scenario (cli: /10)")
+    parser.add_argument("--scenarios", default="catalog,resolve,cli")
+    parser.add_argument("--channels", type=int, default=500, help="Canali per gruppo nel catalogo finto")
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--auth-error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Frazione di risoluzioni lente (coda lunga)")
+    parser.add_argument("--slow-ms", type=float, default=8000.0)
+    parser.add_argument("--stream-cache", action="store_true", help="Lascia attiva la cache dei link risolti")
+    args = parser.parse_args()
+
+    server = start_server(MockConfig(args.channels, 100, args.latency_ms, args.jitter_ms,
+                                     args.error_rate, args.auth_error_rate,
+                                     slow_rate=args.slow_rate, slow_ms=args.slow_ms))
+    env = {
+        "VAVOO_BASE_URL": server.base_url,
+        "VAVOO_PING_URL": f"{server.base_url}/api/app/ping",
+        "VAVOO_CACHE_DIR": tempfile.mkdtemp(prefix="vavoo-loadtest-"),
+        "VAVOO_STREAM_CACHE_DISK": "1" if args.stream_cache else "0",
+    }
+    os.environ.update(env)
+    import vavoo_resolver
+    if not args.stream_cache:
+        vavoo_resolver.stream_cache = vavoo_resolver.StreamCache(max_size=0, disk_path=None)
+    print(f"Mock Vavoo su {server.base_url}, cache in {env['VAVOO_CACHE_DIR']}")
+
+    # I messaggi [DEBUG] del resolver non interessano qui
+    devnull = open(os.devnull, "w")
+    real_stderr, sys.stderr = sys.stderr, devnull
+    try:
+        scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+        if "catalog" in scenarios:
+            ops = max(1, args.requests // 10)
+            run_scenario("catalog (get_channels)", lambda _: bool(vavoo_resolver.get_channels()),
+                         list(range(ops)), args.clients, server)
+        if "resolve" in scenarios:
+            links = [f"https://vavoo.to/play/italy{i % args.channels}/index.m3u8" for i in range(args.requests)]
+            run_scenario("resolve (resolve_vavoo_link)", lambda link: bool(vavoo_resolver.resolve_vavoo_link(link)),
+                         links, args.clients, server)
+        if "cli" in scenarios:
+            script = os.path.join(ROOT, "vavoo_resolver.py")
+            names = ["RAI 1", "CANALE 5", "SKY SPORT UNO", "ITALY CHANNEL 42"]
+            ops = max(1, args.requests // 10)
+
+            def cli_lookup(name):
+                proc = subprocess.run([sys.executable, script, name], env={**os.environ, **env},
+                                      capture_output=True, timeout=60)
+                return proc.returncode == 0
+
+            run_scenario("cli (python3 vavoo_resolver.py <nome>)", cli_lookup,
+                         [names[i % len(names)] for i in range(ops)], args.clients, server)
+    finally:
+        sys.stderr = real_stderr
+        devnull.close()
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server Vavoo finto per misurare il resolver senza toccare vavoo.to.
+Implementa /api/app/ping, /mediahubmx-catalog.json (con cursori) e
+/mediahubmx-resolve.json, con latenza e iniezione di errori configurabili.
+GET /live/<token>.m3u8 serve la playlist risolta (404 per i token "dead").
+GET /stats restituisce i contatori per endpoint, POST /stats/reset li azzera.
+
+Uso: python3 benchmarks/mock_vavoo_server.py [--port 8765] [--channels 500] [--latency-ms 50]
+Poi: VAVOO_BASE_URL=http://127.0.0.1:8765 VAVOO_PING_URL=http://127.0.0.1:8765/api/app/ping python3 vavoo_resolver.py "RAI 1"
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GROUPS = ["Italy", "Germany", "France"]
+
+class MockConfig:
+    def __init__(self, channels=500, page_size=100, latency_ms=50.0, jitter_ms=10.0,
+                 error_rate=0.0, auth_error_rate=0.0, stream_ttl=600, slow_rate=0.0, slow_ms=8000.0):
+        self.channels = channels
+        self.page_size = page_size
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.auth_error_rate = auth_error_rate
+        self.stream_ttl = stream_ttl
+        # Coda lunga: una frazione delle risoluzioni risponde dopo slow_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+
+class MockVavooServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, MockVavooHandler)
+        self.config = config
+        self.random = random.Random(1234)
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+        self.signatures = 0
+        self.catalog = {
+            group: [{"name": f"{group.upper()} CHANNEL {i}{' HD' if i % 3 == 0 else ''}",
+                     "url": f"https://vavoo.to/play/{group.lower()}{i}/index.m3u8",
+                     "group": group}
+                    for i in range(config.channels)]
+            for group in GROUPS
+        }
+        # Nomi reali per i test manuali
+        self.catalog["Italy"][:5] = [
+            {"name": "RAI 1 .a", "url": "https://vavoo.to/play/rai1dead/index.m3u8", "group": "Italy"},
+            {"name": "RAI 1 .b", "url": "https://vavoo.to/play/rai1/index.m3u8", "group": "Italy"},
+            {"name": "RAI 1 HD", "url": "https://vavoo.to/play/rai1hd/index.m3u8", "group": "Italy"},
+            {"name": "CANALE 5 HD", "url": "https://vavoo.to/play/canale5/index.m3u8", "group": "Italy"},
+            {"name": "SKY SPORT UNO", "url": "https://vavoo.to/play/skysport1/index.m3u8", "group": "Italy"},
+        ]
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def snapshot(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def reset(self):
+        with self.stats_lock:
+            self.stats = {}
+
+class MockVavooHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _delay(self, endpoint=None):
+        config = self.server.config
+        delay = config.latency_ms + self.server.random.uniform(-config.jitter_ms, config.jitter_ms)
+        if endpoint == "resolve" and self.server.random.random() < config.slow_rate:
+            self.server.count("resolve:slow")
+            delay = config.slow_ms
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _inject_error(self, endpoint):
+        config = self.server.config
+        roll = self.server.random.random()
+        if roll < config.error_rate:
+            self.server.count(f"{endpoint}:500")
+            self._send(500, {"error": "injected"})
+            return True
+        if endpoint != "ping" and roll < config.error_rate + config.auth_error_rate:
+            self.server.count(f"{endpoint}:403")
+            self._send(403, {"error": "invalid signature"})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._send(200, self.server.snapshot())
+        if self.path.startswith("/live/"):
+            self.server.count("live")
+            self._delay()
+            if "dead" in self.path:
+                return self._send(404, {"error": "stream offline"})
+            payload = b"#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:6\n"
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.apple.mpegurl")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send(400, {"error": "invalid json"})
+        if self.path == "/stats/reset":
+            self.server.reset()
+            return self._send(200, {})
+        endpoint = {
+            "/api/app/ping": "ping",
+            "/mediahubmx-catalog.json": "catalog",
+            "/mediahubmx-resolve.json": "resolve",
+        }.get(self.path)
+        if not endpoint:
+            return self._send(404, {"error": "not found"})
+        self.server.count(endpoint)
+        self._delay(endpoint)
+        if self._inject_error(endpoint):
+            return
+        if endpoint == "ping":
+            with self.server.stats_lock:
+                self.server.signatures += 1
+                signature = f"mock-sig-{self.server.signatures}"
+            return self._send(200, {"addonSig": signature})
+        if not self.headers.get("mediahubmx-signature"):
+            self.server.count(f"{endpoint}:403")
+            return self._send(403, {"error": "missing signature"})
+        if endpoint == "catalog":
+            group = (data.get("filter") or {}).get("group", "Italy")
+            items = self.server.catalog.get(group, [])
+            cursor = int(data.get("cursor") or 0)
+            page = items[cursor:cursor + self.server.config.page_size]
+            next_cursor = cursor + len(page)
+            return self._send(200, {"items": page, "nextCursor": next_cursor if next_cursor < len(items) else None})
+        link = data.get("url", "")
+        expires = int(time.time()) + self.server.config.stream_ttl
+        token = link.rstrip("/").split("/")[-2] if "/play/" in link else "unknown"
+        return self._send(200, [{"url": f"{self.server.base_url}/live/{token}.m3u8?e={expires}"}])
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """Avvia il server su un thread daemon e lo restituisce (port=0: porta libera)."""
+    server = MockVavooServer((host, port), config or MockConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Server Vavoo finto per test di carico")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--channels", type=int, default=500, help="Canali per gruppo")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Frazione di risposte 500")
+    parser.add_argument("--auth-error-rate", type=float, default=0.0, help="Frazione di risposte 403")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Frazione di risoluzioni lente")
+    parser.add_argument("--slow-ms", type=float, default=8000.0)
+    args = parser.parse_args()
+
+    config = MockConfig(args.channels, args.page_size, args.latency_ms, args.jitter_ms,
+                        args.error_rate, args.auth_error_rate, slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+    server = MockVavooServer((args.host, args.port), config)
+    print(f"Mock Vavoo in ascolto su {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
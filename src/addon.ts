@@ -9,12 +9,9 @@ import { KitsuProvider } from './providers/kitsu';
 import { formatMediaFlowUrl } from './utils/mediaflow';
 import { AnimeUnityConfig } from "./types/animeunity";
 import { EPGManager } from './utils/epg';
-import { execFile } from 'child_process';
+import { execFile, spawn } from 'child_process';
 import * as crypto from 'crypto';
-import * as util from 'util';
-
-// Promisify execFile
-const execFilePromise = util.promisify(execFile);
+import * as readline from 'readline';
 
 // Interfaccia per la configurazione URL
 interface AddonConfig {
@@ -323,7 +320,8 @@ function loadVavooCache(): void {
             const rawCache = fs.readFileSync(vavaoCachePath, 'utf-8');
             // RIMOSSO: console.log('🔧 [VAVOO] RAW vavoo_cache.json:', rawCache);
             const cacheData = JSON.parse(rawCache);
-            vavooCache.timestamp = cacheData.timestamp || 0;
+            // vavoo_resolver.py non riscrive il file se il catalogo non cambia: ne aggiorna la mtime
+            vavooCache.timestamp = Math.max(cacheData.timestamp || 0, fs.statSync(vavaoCachePath).mtimeMs);
             vavooCache.links = new Map(Object.entries(cacheData.links || {}));
             console.log(`📺 Vavoo cache caricata con ${vavooCache.links.size} canali, aggiornata il: ${new Date(vavooCache.timestamp).toLocaleString()}`);
             console.log('🔧 [VAVOO] DEBUG - Cache caricata all\'avvio:', vavooCache.links.size, 'canali');
@@ -337,31 +335,46 @@ function loadVavooCache(): void {
     }
 }
 
-// Funzione per salvare la cache Vavoo su file
-function saveVavooCache(): void {
-    try {
-        // Assicurati che la directory cache esista
-        const cacheDir = path.dirname(vavaoCachePath);
-        if (!fs.existsSync(cacheDir)) {
-            fs.mkdirSync(cacheDir, { recursive: true });
-        }
+// Legge i canali Vavoo in streaming (NDJSON, un canale per riga) man mano che arrivano le pagine del catalogo
+function dumpVavooChannels(timeoutMs: number = 30000): Promise<Map<string, string>> {
+    return new Promise((resolve, reject) => {
+        const links = new Map<string, string>();
+        const pythonProcess = spawn('python3', [
+            path.join(__dirname, '../vavoo_resolver.py'),
+            '--dump-channels',
+            '--ndjson'
+        ]);
+        const timer = setTimeout(() => {
+            pythonProcess.kill();
+            reject(new Error(`Timeout dump canali Vavoo dopo ${timeoutMs}ms`));
+        }, timeoutMs);
 
-        const cacheData = {
-            timestamp: vavooCache.timestamp,
-            links: Object.fromEntries(vavooCache.links)
-        };
-        
-        // Salva prima in un file temporaneo e poi rinomina per evitare file danneggiati
-        const tempPath = `${vavaoCachePath}.tmp`;
-        fs.writeFileSync(tempPath, JSON.stringify(cacheData, null, 2), 'utf-8');
-        
-        // Rinomina il file temporaneo nel file finale
-        fs.renameSync(tempPath, vavaoCachePath);
-        
-        console.log(`📺 Vavoo cache salvata con ${vavooCache.links.size} canali, timestamp: ${new Date(vavooCache.timestamp).toLocaleString()}`);
-    } catch (error) {
-        console.error('❌ Errore nel salvataggio della cache Vavoo:', error);
-    }
+        const lines = readline.createInterface({ input: pythonProcess.stdout });
+        lines.on('line', (line: string) => {
+            if (!line.trim()) return;
+            try {
+                const ch = JSON.parse(line);
+                if (ch.name && ch.url) {
+                    links.set(ch.name, ch.url);
+                }
+            } catch (jsonError) {
+                console.error('❌ Errore nel parsing di una riga JSON di Vavoo:', jsonError);
+            }
+        });
+        pythonProcess.stderr.on('data', () => { /* log di debug dello script */ });
+        pythonProcess.on('error', (err: Error) => {
+            clearTimeout(timer);
+            reject(err);
+        });
+        // 'close' arriva dopo che stdout è stato consumato: tutte le righe sono già state lette
+        pythonProcess.on('close', (code: number) => {
+            clearTimeout(timer);
+            if (code !== 0) {
+                return reject(new Error(`Dump canali Vavoo terminato con codice ${code}`));
+            }
+            resolve(links);
+        });
+    });
 }
 
 // Funzione per aggiornare la cache Vavoo
@@ -375,30 +388,17 @@ async function updateVavooCache(): Promise<boolean> {
     console.log(`📺 Avvio aggiornamento cache Vavoo...`);
     try {
         // PATCH: Prendi TUTTI i canali da Vavoo, senza filtri su tv_channels.json
-        const result = await execFilePromise('python3', [
-            path.join(__dirname, '../vavoo_resolver.py'),
-            '--dump-channels'
-        ], { timeout: 30000 });
-
-        if (result.stdout) {
-            try {
-                const channels = JSON.parse(result.stdout);
-                console.log(`📺 Recuperati ${channels.length} canali da Vavoo (nessun filtro)`);
-                const updatedLinks = new Map<string, string>();
-                for (const ch of channels) {
-                    if (ch.name && ch.url) {
-                        updatedLinks.set(ch.name, ch.url);
-                    }
-                }
+        const updatedLinks = await dumpVavooChannels();
+        console.log(`📺 Recuperati ${updatedLinks.size} canali da Vavoo (nessun filtro)`);
+        if (updatedLinks.size > 0) {
+            // vavoo_cache.json la scrive solo vavoo_resolver.py (con version e hash): qui si ricarica
+            loadVavooCache();
+            if (vavooCache.links.size === 0) {
                 vavooCache.links = updatedLinks;
                 vavooCache.timestamp = Date.now();
-                saveVavooCache();
-                console.log(`✅ Cache Vavoo aggiornata: ${updatedLinks.size} canali in cache (tutti)`);
-                return true;
-            } catch (jsonError) {
-                console.error('❌ Errore nel parsing del risultato JSON di Vavoo:', jsonError);
-                throw jsonError;
             }
+            console.log(`✅ Cache Vavoo aggiornata: ${vavooCache.links.size} canali in cache (tutti)`);
+            return true;
         }
     } catch (error) {
         console.error('❌ Errore durante l\'aggiornamento della cache Vavoo:', error);
@@ -14,12 +14,62 @@ import json
 import urllib.parse
 import argparse
 import os
+import queue
+import threading
+import time
+from cache_utils import FileLock, write_json_atomic
 with open(os.path.join(os.path.dirname(__file__), '../../config/domains.json'), encoding='utf-8') as f:
     DOMAINS = json.load(f)
 BASE_URL = f"https://{DOMAINS['animesaturn']}"
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
 HEADERS = {"User-Agent": USER_AGENT}
 TIMEOUT = 20
+HTTP_POOL_SIZE = int(os.environ.get("ANIMESATURN_HTTP_POOL_SIZE", "16"))
+# Verifica MAL: pagine anime visitate in parallelo, con un limite di richieste contemporanee per host
+PAGE_WORKERS = int(os.environ.get("ANIMESATURN_PAGE_WORKERS", "8"))
+HOST_CONCURRENCY = int(os.environ.get("ANIMESATURN_HOST_CONCURRENCY", "4"))
+# Primo link <a> verso la scheda MyAnimeList (come soup.find nella versione precedente)
+# L'id vale solo se seguito da un altro carattere: un blocco che finisce a metà id non lo tronca
+MAL_LINK_RE = re.compile(rb'<a\b[^>]*?\bhref\s*=\s*["\']?[^"\'\s>]*myanimelist\.net/anime/(\d+)(?=\D)', re.I)
+SCAN_OVERLAP = 4096
+SCAN_CHUNK_SIZE = 16384
+CACHE_DIR = os.environ.get("ANIMESATURN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../cache'))
+# Indice persistente MAL id -> versioni (normale/ITA/CR), comprese le ricerche senza match
+MAL_INDEX_PATH = os.path.join(CACHE_DIR, "animesaturn_mal_index.json")
+MAL_INDEX_TTL = int(os.environ.get("ANIMESATURN_MAL_INDEX_TTL", str(7 * 24 * 3600)))
+MAL_INDEX_MISS_TTL = int(os.environ.get("ANIMESATURN_MAL_INDEX_MISS_TTL", str(24 * 3600)))
+# Crawl di /animelist in background: oltre questa età l'indice viene riaggiornato
+MAL_INDEX_CRAWL_MAX_AGE = int(os.environ.get("ANIMESATURN_MAL_INDEX_CRAWL_MAX_AGE", str(24 * 3600)))
+MAL_INDEX_AUTO_REFRESH = os.environ.get("ANIMESATURN_MAL_INDEX_AUTO_REFRESH", "1") != "0"
+CRAWL_WORKERS = int(os.environ.get("ANIMESATURN_CRAWL_WORKERS", "4"))
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+def get_http_session():
+    """Sessione requests condivisa: keep-alive e pool di connessioni per tutte le chiamate"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(HTTP_POOL_SIZE, HOST_CONCURRENCY))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def _host_slot(url):
+    """Semaforo per host: al massimo HOST_CONCURRENCY richieste in volo verso lo stesso dominio"""
+    host = urllib.parse.urlparse(url).netloc
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(max(1, HOST_CONCURRENCY))
+        return slot
 
 def safe_ascii_header(value):
     # Remove or replace non-latin-1 characters (e.g., typographic apostrophes)
@@ -38,7 +88,7 @@ def search_anime(query):
             "X-Requested-With": "XMLHttpRequest",
             "Accept": "application/json, text/javascript, */*; q=0.01"
         }
-        resp = requests.get(search_url, headers=headers, timeout=TIMEOUT)
+        resp = get_http_session().get(search_url, headers=headers, timeout=TIMEOUT)
         resp.raise_for_status()
         page_results = resp.json()
         if not page_results:
@@ -248,67 +298,423 @@ def download_mp4(mp4_url, referer_url, filename=None):
                 f.write(chunk)
     print(f"✅ Download completato: {filename}\n")
 
+def fetch_animelist_page(page, query=None):
+    """
+    Scarica una pagina di /animelist (filtrata per query se indicata).
+    Restituisce (risultati, c'è una pagina successiva, numero dell'ultima pagina se leggibile).
+    """
+    url = f'{BASE_URL}/animelist?page={page}'
+    if query is not None:
+        url = f'{BASE_URL}/animelist?search={urllib.parse.quote_plus(query)}&page={page}'
+    resp = get_http_session().get(url, headers=HEADERS, timeout=TIMEOUT)
+    resp.raise_for_status()
+    soup = BeautifulSoup(resp.text, 'html.parser')
+    results = []
+    # Seleziona solo i link principali ai dettagli anime
+    for a in soup.select('div.item-archivio h3 a[href^="/anime/"], div.item-archivio h3 a[href^="https://www.animesaturn.cx/anime/"]'):
+        href = a['href']
+        if not href.startswith('http'):
+            href = BASE_URL + href
+        results.append({'title': a.get_text(strip=True), 'url': href, 'page': page})
+    pagination = soup.select_one('ul.pagination')
+    next_btn = soup.select_one('li.page-item.next:not(.disabled)')
+    last_page = None
+    if pagination:
+        pages = [int(m.group(1)) for a in pagination.find_all("a", href=True)
+                 for m in [re.search(r"[?&]page=(\d+)", a["href"])] if m]
+        last_page = max(pages) if pages else None
+    return results, bool(pagination and next_btn), last_page
+
 def search_anime_html(query, max_pages=3):
     """Ricerca anime tramite la pagina HTML di AnimeSaturn, con paginazione solo se necessario"""
     results = []
     page = 1
     while page <= max_pages:
-        url = f'{BASE_URL}/animelist?search={urllib.parse.quote_plus(query)}&page={page}'
-        resp = requests.get(url, headers=HEADERS, timeout=TIMEOUT)
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        # Seleziona solo i link principali ai dettagli anime
-        for a in soup.select('div.item-archivio h3 a[href^="/anime/"], div.item-archivio h3 a[href^="https://www.animesaturn.cx/anime/"]'):
-            title = a.get_text(strip=True)
-            href = a['href']
-            if not href.startswith('http'):
-                href = BASE_URL + href
-            if not any(r['url'] == href for r in results):
-                results.append({'title': title, 'url': href, 'page': page})
-                print(f"[DEBUG] Trovato titolo: {title} (url: {href})", file=sys.stderr)
-        pagination = soup.select_one('ul.pagination')
-        next_btn = soup.select_one('li.page-item.next:not(.disabled)')
-        if not (pagination and next_btn):
+        try:
+            page_results, has_next, _ = fetch_animelist_page(page, query)
+        except requests.HTTPError as e:
+            print(f"[DEBUG] Pagina {page} della ricerca HTML non disponibile: {e}", file=sys.stderr)
+            break
+        for item in page_results:
+            if not any(r['url'] == item['url'] for r in results):
+                results.append(item)
+                print(f"[DEBUG] Trovato titolo: {item['title']} (url: {item['url']})", file=sys.stderr)
+        if not has_next:
             break
         page += 1
     return results
 
-def search_anime_by_title_or_malid(title, mal_id):
-    print(f"[DEBUG] INIZIO: title={title}, mal_id={mal_id}", file=sys.stderr)
-
-    # Helper function to check a list of results for a MAL ID match
-    def check_results_for_mal_id(results_list, target_mal_id, search_step_name):
-        if not results_list:
-            print(f"[DEBUG] {search_step_name}: Nessun risultato da controllare.", file=sys.stderr)
+def read_mal_id(url, cancel=None):
+    """
+    Legge la pagina anime a blocchi e si ferma al primo link MyAnimeList: restituisce l'id
+    come stringa, None se la pagina non lo contiene o se la verifica è stata annullata.
+    """
+    buffer = bytearray()
+    with _host_slot(url):
+        if cancel is not None and cancel.is_set():
             return None
-        
-        print(f"[DEBUG] {search_step_name}: Controllo {len(results_list)} risultati...", file=sys.stderr)
-        matched_items = []
-        for item in results_list:
+        resp = get_http_session().get(url, headers=HEADERS, timeout=TIMEOUT, stream=True)
+        try:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(SCAN_CHUNK_SIZE):
+                if cancel is not None and cancel.is_set():
+                    return None
+                start = max(0, len(buffer) - SCAN_OVERLAP)
+                buffer += chunk
+                match = MAL_LINK_RE.search(buffer, start)
+                if match:
+                    return match.group(1).decode("ascii")
+        finally:
+            resp.close()
+    # Markup inatteso: il link c'è ma la regex non lo riconosce, si torna al parsing completo
+    if b"myanimelist.net/anime/" not in buffer:
+        return None
+    soup = BeautifulSoup(buffer.decode(resp.encoding or "utf-8", errors="replace"), "html.parser")
+    mal_btn = soup.find("a", href=re.compile(r"myanimelist\.net/anime/(\d+)"))
+    if mal_btn:
+        return re.search(r"myanimelist\.net/anime/(\d+)", mal_btn["href"]).group(1)
+    return None
+
+def _variant(title):
+    """Versione dell'anime su AnimeSaturn: normale, doppiata (ITA) o Crunchyroll (CR)"""
+    t_upper = title.upper()
+    if '(ITA' in t_upper:
+        return "ita"
+    if '(CR' in t_upper:
+        return "cr"
+    return "normal"
+
+def _variants_settled(items, found, target_mal_id):
+    """
+    True se ogni versione presente tra i risultati è decisa: ha il suo primo match
+    senza pagine precedenti della stessa versione ancora in attesa, oppure tutte le
+    sue pagine sono state lette senza match. Le versioni assenti (spesso CR) non contano.
+    """
+    settled = {}
+    for index, item in enumerate(items):
+        variant = _variant(item['title'])
+        if variant in settled:
+            continue
+        if index not in found:
+            settled[variant] = False
+        elif found[index] == target_mal_id:
+            settled[variant] = True
+    return all(settled.values())
+
+def iter_mal_ids(items, cancel):
+    """
+    Legge in parallelo l'id MAL delle pagine di items (PAGE_WORKERS thread, HOST_CONCURRENCY
+    per host) e genera (indice, id o None, errore) in ordine di completamento.
+    Impostare cancel ferma il lavoro ancora da fare.
+    """
+    todo = queue.Queue()
+    for index in range(len(items)):
+        todo.put(index)
+    done = queue.Queue()
+
+    def worker():
+        while not cancel.is_set():
             try:
-                resp = requests.get(item["url"], headers=HEADERS, timeout=TIMEOUT)
-                resp.raise_for_status()
-                soup = BeautifulSoup(resp.text, "html.parser")
-                mal_btn = soup.find("a", href=re.compile(r"myanimelist\.net/anime/(\d+)"))
-                if mal_btn:
-                    found_id_match = re.search(r"myanimelist\.net/anime/(\d+)", mal_btn["href"])
-                    if found_id_match:
-                        found_id = found_id_match.group(1)
-                        print(f"[DEBUG] -> Controllo '{item['title']}': trovato MAL ID {found_id} (cerco {target_mal_id})", file=sys.stderr)
-                        if found_id == str(target_mal_id):
-                            print(f"[DEBUG] MATCH TROVATO!", file=sys.stderr)
-                            matched_items.append(item)
+                index = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                done.put((index, read_mal_id(items[index]["url"], cancel), None))
             except Exception as e:
-                print(f"[DEBUG] Errore visitando '{item['title']}': {e}", file=sys.stderr)
-        if matched_items:
-            return matched_items
-        print(f"[DEBUG] {search_step_name}: Nessun match trovato.", file=sys.stderr)
-        return None  # No match in this batch
+                done.put((index, None, e))
+
+    # Non più thread di quanti slot per host: le pagine partono nell'ordine dei risultati invece di
+    # contendersi il semaforo. Thread daemon: una richiesta ancora in volo dopo l'annullamento
+    # non blocca l'uscita del processo
+    hosts = {urllib.parse.urlparse(item["url"]).netloc for item in items}
+    for _ in range(min(PAGE_WORKERS, max(1, HOST_CONCURRENCY) * len(hosts), len(items))):
+        threading.Thread(target=worker, daemon=True).start()
+    try:
+        for _ in range(len(items)):
+            yield done.get()
+    finally:
+        cancel.set()
+
+def find_mal_matches(items, target_mal_id, step_name, index=None, first_per_variant=False):
+    """
+    Visita le pagine dei risultati in parallelo e restituisce, nell'ordine dei risultati,
+    tutti quelli il cui link MAL corrisponde. Con first_per_variant (ricerca fuzzy) serve
+    solo il primo match per versione: appena ogni versione presente (normale, ITA, CR)
+    è decisa il lavoro rimanente viene annullato. Con index le pagine già note non
+    vengono riscaricate e quelle lette vengono registrate.
+    """
+    if not items:
+        print(f"[DEBUG] {step_name}: Nessun risultato da controllare.", file=sys.stderr)
+        return []
+    print(f"[DEBUG] {step_name}: Controllo {len(items)} risultati...", file=sys.stderr)
+    target_mal_id = str(target_mal_id)
+    known = index.page_ids([item["url"] for item in items]) if index else {}
+    found = {i: known[item["url"]] for i, item in enumerate(items) if item["url"] in known}
+    todo = [i for i in range(len(items)) if i not in found]
+    learned = {}
+    if found:
+        print(f"[DEBUG] {step_name}: {len(found)} pagine già nell'indice MAL", file=sys.stderr)
+    if todo and not (first_per_variant and _variants_settled(items, found, target_mal_id)):
+        for position, found_id, error in iter_mal_ids([items[i] for i in todo], threading.Event()):
+            i = todo[position]
+            item = items[i]
+            found[i] = found_id
+            if error is not None:
+                print(f"[DEBUG] Errore visitando '{item['title']}': {error}", file=sys.stderr)
+                if index:
+                    index.failures += 1
+            else:
+                learned[item["url"]] = (item["title"], found_id)
+                if found_id:
+                    print(f"[DEBUG] -> Controllo '{item['title']}': trovato MAL ID {found_id} (cerco {target_mal_id})", file=sys.stderr)
+                    if found_id == target_mal_id:
+                        print(f"[DEBUG] MATCH TROVATO!", file=sys.stderr)
+            if first_per_variant and _variants_settled(items, found, target_mal_id):
+                print(f"[DEBUG] {step_name}: versioni decise, annullo {len(items) - len(found)} pagine", file=sys.stderr)
+                break
+    if index and learned:
+        index.learn_pages(learned)
+    matched = [item for i, item in enumerate(items) if found.get(i) == target_mal_id]
+    if not matched:
+        print(f"[DEBUG] {step_name}: Nessun match trovato.", file=sys.stderr)
+    return matched
+
+def _dedupe(matches):
+    # Deduplica per url
+    seen = set()
+    deduped = []
+    for m in matches:
+        if m['url'] not in seen:
+            deduped.append(m)
+            seen.add(m['url'])
+    return deduped
+
+class MalIndex:
+    """
+    Indice persistente (JSON) su disco condiviso tra processi:
+    - ids: MAL id -> risultato verificato di search_anime_by_title_or_malid, anche vuoto
+    - pages: pagina anime -> titolo e id MAL letto, imparato dalle verifiche e dal crawl di /animelist
+    Le pagine sono salvate come percorso, così un cambio di dominio non invalida l'indice.
+    """
+    def __init__(self, path=MAL_INDEX_PATH):
+        self.path = path
+        self._data = None
+        self._mtime = None
+        self._by_mal_id = None
+        # Pagine non verificate per errore durante la ricerca: un "nessun match" non è affidabile
+        self.failures = 0
+
+    @staticmethod
+    def _path(url):
+        return urllib.parse.urlparse(url).path
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == 1:
+                return data
+        except (OSError, ValueError):
+            pass
+        return {"version": 1, "crawled": 0, "ids": {}, "pages": {}}
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if self._data is None or mtime != self._mtime:
+            self._data = self._read()
+            self._mtime = mtime
+            self._by_mal_id = None
+        return self._data
+
+    def _update(self, function):
+        """Rilegge l'indice sotto lock, applica function e lo riscrive: nessun aggiornamento perso tra processi"""
+        try:
+            with FileLock(self.path + ".lock"):
+                data = self._read()
+                function(data)
+                write_json_atomic(self.path, data)
+        except OSError as e:
+            print(f"[DEBUG] Impossibile aggiornare l'indice MAL: {e}", file=sys.stderr)
+            return
+        self._data = None
+
+    def crawl_age(self):
+        return time.time() - self._load().get("crawled", 0)
+
+    def page_ids(self, urls):
+        """Id MAL già noti per le pagine indicate (le pagine senza link MAL scadono dopo MAL_INDEX_MISS_TTL)"""
+        pages = self._load()["pages"]
+        now = time.time()
+        known = {}
+        for url in urls:
+            entry = pages.get(self._path(url))
+            if entry and (entry["mal_id"] or now - entry["t"] < MAL_INDEX_MISS_TTL):
+                known[url] = entry["mal_id"]
+        return known
+
+    def learn_pages(self, learned):
+        """learned: url -> (titolo, id MAL o None)"""
+        now = time.time()
+
+        def apply(data):
+            for url, (title, mal_id) in learned.items():
+                data["pages"][self._path(url)] = {"title": title, "mal_id": mal_id, "t": now}
+        self._update(apply)
+
+    def record(self, mal_id, results):
+        now = time.time()
+        entry = {"results": [{"title": r["title"], "path": self._path(r["url"])} for r in results], "t": now}
+        self._update(lambda data: data["ids"].__setitem__(str(mal_id), entry))
+
+    def mark_crawled(self):
+        self._update(lambda data: data.__setitem__("crawled", time.time()))
+
+    def _variants_from_pages(self, mal_id):
+        # Prima pagina per versione, nell'ordine in cui sono state imparate
+        if self._by_mal_id is None:
+            self._by_mal_id = {}
+            for path, entry in self._load()["pages"].items():
+                if entry["mal_id"]:
+                    self._by_mal_id.setdefault(entry["mal_id"], []).append((path, entry["title"]))
+        variants = {}
+        for path, title in self._by_mal_id.get(mal_id, []):
+            variants.setdefault(_variant(title), {"title": title, "url": BASE_URL + path})
+        return [variants[v] for v in ("normal", "ita", "cr") if v in variants]
+
+    def lookup(self, mal_id):
+        """
+        Versioni note per mal_id, lista vuota se una ricerca recente non ha trovato nulla,
+        None se serve la ricerca. Con un crawl completo e recente valgono le pagine imparate,
+        poi il risultato registrato finché non scade (MAL_INDEX_TTL, MAL_INDEX_MISS_TTL se vuoto).
+        Un id assente dal crawl non basta per dire "nessun match": l'anime può essere più recente.
+        """
+        mal_id = str(mal_id)
+        data = self._load()
+        if self.crawl_age() < MAL_INDEX_CRAWL_MAX_AGE:
+            variants = self._variants_from_pages(mal_id)
+            if variants:
+                return variants
+        entry = data["ids"].get(mal_id)
+        if entry:
+            ttl = MAL_INDEX_TTL if entry["results"] else MAL_INDEX_MISS_TTL
+            if time.time() - entry["t"] < ttl:
+                return [{"title": r["title"], "url": BASE_URL + r["path"]} for r in entry["results"]]
+        return None
+
+def list_animelist(workers=CRAWL_WORKERS):
+    """Tutte le voci di /animelist: prima pagina, poi le altre in parallelo se la paginazione indica l'ultima"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    results, has_next, last_page = fetch_animelist_page(1)
+    if has_next and last_page:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for page_results in pool.map(lambda page: fetch_animelist_page(page)[0], range(2, last_page + 1)):
+                results += page_results
+    else:
+        page = 1
+        while has_next:
+            page += 1
+            page_results, has_next, _ = fetch_animelist_page(page)
+            results += page_results
+    seen = set()
+    return [r for r in results if not (r["url"] in seen or seen.add(r["url"]))]
+
+def crawl_mal_index(workers=CRAWL_WORKERS):
+    """
+    Popola l'indice MAL leggendo tutte le pagine anime di /animelist non ancora note.
+    Il crawl conta come completo solo se gli errori restano sotto l'1% delle pagine.
+    Un solo crawl alla volta: se ne è già in corso uno restituisce None.
+    Altrimenti restituisce (pagine lette, errori).
+    """
+    try:
+        with FileLock(MAL_INDEX_PATH + ".running", blocking=False):
+            return _crawl_mal_index(workers)
+    except BlockingIOError:
+        print("[DEBUG] Crawl indice MAL già in corso in un altro processo", file=sys.stderr)
+        return None
+
+def _crawl_mal_index(workers):
+    index = MalIndex()
+    entries = list_animelist(workers)
+    known = index.page_ids([e["url"] for e in entries])
+    todo = [e for e in entries if e["url"] not in known]
+    print(f"[DEBUG] Crawl indice MAL: {len(entries)} anime in /animelist, {len(todo)} da leggere", file=sys.stderr)
+    learned = {}
+    errors = 0
+    for position, found_id, error in iter_mal_ids(todo, threading.Event()):
+        item = todo[position]
+        if error is not None:
+            errors += 1
+            print(f"[DEBUG] Errore visitando '{item['title']}': {error}", file=sys.stderr)
+            continue
+        learned[item["url"]] = (item["title"], found_id)
+        # Salvataggi periodici: un crawl interrotto non riparte da zero
+        if len(learned) >= 200:
+            index.learn_pages(learned)
+            learned = {}
+    if learned:
+        index.learn_pages(learned)
+    if entries and errors <= len(todo) // 100:
+        index.mark_crawled()
+    print(f"[DEBUG] Crawl indice MAL terminato: {len(todo) - errors} pagine lette, {errors} errori", file=sys.stderr)
+    return len(todo) - errors, errors
+
+def _spawn_mal_index_refresh():
+    """
+    Avvia il crawl dell'indice MAL in un processo separato, se non ne è partito
+    uno nell'ultima ora (il file .crawl viene rimosso dal crawler quando ha finito)
+    e se non ce n'è uno ancora in corso (lock .running tenuto per tutto il crawl)
+    """
+    import subprocess
+
+    lock_path = MAL_INDEX_PATH + ".crawl"
+    try:
+        if time.time() - os.path.getmtime(lock_path) < 3600:
+            return
+    except OSError:
+        pass
+    try:
+        with FileLock(MAL_INDEX_PATH + ".running", blocking=False):
+            pass
+    except BlockingIOError:
+        return
+    except OSError:
+        pass
+    try:
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, "w") as f:
+            f.write(str(os.getpid()))
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "crawl_mal_index", "--release-lock"],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    except OSError as e:
+        print(f"[DEBUG] Impossibile avviare il crawl dell'indice MAL: {e}", file=sys.stderr)
+
+def search_anime_by_title_or_malid(title, mal_id):
+    """Versioni AnimeSaturn di mal_id: dall'indice MAL se note, altrimenti ricerca per titolo e verifica"""
+    index = MalIndex()
+    if MAL_INDEX_AUTO_REFRESH and index.crawl_age() > MAL_INDEX_CRAWL_MAX_AGE:
+        _spawn_mal_index_refresh()
+    cached = index.lookup(mal_id)
+    if cached is not None:
+        print(f"[DEBUG] Indice MAL: {len(cached)} versioni per mal_id={mal_id}", file=sys.stderr)
+        return cached
+    results = _search_and_verify(title, mal_id, index)
+    if results or not index.failures:
+        index.record(mal_id, results)
+    return results
+
+def _search_and_verify(title, mal_id, index=None):
+    print(f"[DEBUG] INIZIO: title={title}, mal_id={mal_id}", file=sys.stderr)
 
     # --- Fallback Chain ---
 
     # 1. Ricerca diretta per titolo completo
     direct_results = search_anime(title)
-    matches = check_results_for_mal_id(direct_results, mal_id, "Step 1: Ricerca Diretta") or []
+    matches = find_mal_matches(direct_results, mal_id, "Step 1: Ricerca Diretta", index)
     print(f"[DEBUG] matches dopo ricerca diretta: {matches}", file=sys.stderr)
 
     # 2. Fallback: Titolo troncato all'apostrofo
@@ -318,12 +724,11 @@ def search_anime_by_title_or_malid(title, mal_id):
             truncated_title = title[:last_apos].strip()
             print(f"[DEBUG] Titolo troncato per Fallback #1: '{truncated_title}'", file=sys.stderr)
             truncated_results = search_anime(truncated_title)
-            matches += check_results_for_mal_id(truncated_results, mal_id, "Step 2: Ricerca Titolo Troncato") or []
+            matches += find_mal_matches(truncated_results, mal_id, "Step 2: Ricerca Titolo Troncato", index)
     print(f"[DEBUG] matches dopo troncato: {matches}", file=sys.stderr)
 
     # 3. Fallback finale: Ricerca fuzzy con prime 3 lettere
     if not matches:
-        print(f"[DEBUG] PRIMA DELLA FUZZY: matches={matches}", file=sys.stderr)
         short_key = title[:3]
         print(f"[DEBUG] Avvio fallback fuzzy: chiave '{short_key}'", file=sys.stderr)
         # Usa la ricerca HTML per la fuzzy search
@@ -332,70 +737,20 @@ def search_anime_by_title_or_malid(title, mal_id):
         # Evita duplicati
         urls_to_skip = {r['url'] for r in (direct_results or [])}
         unique_fuzzy_results = [r for r in fuzzy_results if r['url'] not in urls_to_skip]
-        fuzzy_matches = []
-        found_normal = None
-        found_ita = None
-        found_cr = None
-        found_count = 0
-        for item in unique_fuzzy_results:
-            try:
-                print(f"[DEBUG] Visito URL: {item['url']}", file=sys.stderr)
-                resp = requests.get(item["url"], headers=HEADERS, timeout=TIMEOUT)
-                resp.raise_for_status()
-                soup = BeautifulSoup(resp.text, "html.parser")
-                mal_btn = soup.find("a", href=re.compile(r"myanimelist\.net/anime/(\d+)"))
-                if mal_btn:
-                    found_id_match = re.search(r"myanimelist\.net/anime/(\d+)", mal_btn["href"])
-                    if found_id_match:
-                        found_id = found_id_match.group(1)
-                        print(f"[DEBUG] -> Controllo '{item['title']}': trovato MAL ID {found_id} (cerco {mal_id})", file=sys.stderr)
-                        if found_id == str(mal_id):
-                            print(f"[DEBUG] MATCH TROVATO!", file=sys.stderr)
-                            t_upper = item['title'].upper()
-                            if not found_normal and '(ITA' not in t_upper and '(CR' not in t_upper:
-                                found_normal = item
-                                found_count += 1
-                            elif not found_ita and '(ITA' in t_upper:
-                                found_ita = item
-                                found_count += 1
-                            elif not found_cr and '(CR' in t_upper:
-                                found_cr = item
-                            # Se hai trovato normal e ita, continua a cercare CR fino a fine terza pagina
-                            if found_normal and found_ita and found_cr:
-                                break
-            except Exception as e:
-                print(f"[DEBUG] Errore visitando '{item['title']}': {e}", file=sys.stderr)
-            # Se hai già trovato normal e ita e sei oltre la terza pagina, esci
-            if item.get('page', 1) >= 3 and found_normal and found_ita:
-                break
-        # Aggiungi le versioni trovate
-        if found_normal:
-            fuzzy_matches.append(found_normal)
-        if found_ita:
-            fuzzy_matches.append(found_ita)
-        if found_cr:
-            fuzzy_matches.append(found_cr)
+        # Solo il primo match per versione (normale, ITA, CR)
+        fuzzy_matches = {}
+        for item in find_mal_matches(unique_fuzzy_results, mal_id, "Step 3: Ricerca Fuzzy", index,
+                                     first_per_variant=True):
+            fuzzy_matches.setdefault(_variant(item['title']), item)
+        fuzzy_matches = [fuzzy_matches[v] for v in ("normal", "ita", "cr") if v in fuzzy_matches]
         print(f"[DEBUG] fuzzy_matches trovati: {fuzzy_matches}", file=sys.stderr)
-        if fuzzy_matches and len(fuzzy_matches) >= 2:
-            seen = set()
-            deduped = []
-            for m in fuzzy_matches:
-                if m['url'] not in seen:
-                    deduped.append(m)
-                    seen.add(m['url'])
-            return deduped
+        if len(fuzzy_matches) >= 2:
+            return _dedupe(fuzzy_matches)
         matches += fuzzy_matches
     print(f"[DEBUG] matches finali: {matches}", file=sys.stderr)
 
     if matches:
-        # Deduplica per url
-        seen = set()
-        deduped = []
-        for m in matches:
-            if m['url'] not in seen:
-                deduped.append(m)
-                seen.add(m['url'])
-        return deduped
+        return _dedupe(matches)
 
     print(f"[DEBUG] NESSUN MATCH TROVATO dopo tutti i tentativi.", file=sys.stderr)
     return []
@@ -483,6 +838,11 @@ def main_cli():
     stream_parser.add_argument("--mfp-proxy-url", required=False, help="MediaFlow Proxy URL for m3u8 streams")
     stream_parser.add_argument("--mfp-proxy-password", required=False, help="MediaFlow Proxy Password for m3u8 streams")
 
+    # Crawl MAL index command
+    crawl_parser = subparsers.add_parser("crawl_mal_index", help="Pre-populate the MAL id index from /animelist")
+    crawl_parser.add_argument("--workers", type=int, default=CRAWL_WORKERS, help="Parallel /animelist page downloads")
+    crawl_parser.add_argument("--release-lock", action="store_true", help=argparse.SUPPRESS)
+
     args = parser.parse_args()
 
     if args.command == "search":
@@ -540,6 +900,19 @@ def main_cli():
                 
         # Test: se vuoi solo il link, restituisci {"url": stream_url}
         print(json.dumps(stremio_stream if stremio_stream else {"url": stream_url}, indent=2))
+    elif args.command == "crawl_mal_index":
+        result = crawl_mal_index(workers=args.workers)
+        if result is None:
+            print(json.dumps({"running": True}))
+            return
+        pages, errors = result
+        print(json.dumps({"pages": pages, "errors": errors}))
+        # Solo dopo un crawl riuscito: se fallisce il lock resta e i tentativi si diradano
+        if args.release_lock and MalIndex().crawl_age() < MAL_INDEX_CRAWL_MAX_AGE:
+            try:
+                os.remove(MAL_INDEX_PATH + ".crawl")
+            except OSError:
+                pass
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
@@ -12,9 +12,11 @@ import re
 import time
 import argparse
 import sys
+import threading
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, urljoin, unquote
 import json, os
+from cache_utils import ExpiringCache, FileLock, write_json_atomic
 with open(os.path.join(os.path.dirname(__file__), '../../config/domains.json'), encoding='utf-8') as f:
     DOMAINS = json.load(f)
 BASE_URL = f"https://www.{DOMAINS['animeunity']}"
@@ -28,16 +30,150 @@ HEADERS = {
     "Upgrade-Insecure-Requests": "1"
 }
 TIMEOUT = 20
+# Cache locale (token di sessione, episodi, ...) condivisa tra le invocazioni dello script
+CACHE_DIR = os.environ.get("ANIMEUNITY_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../cache'))
+TOKEN_CACHE_PATH = os.path.join(CACHE_DIR, "animeunity_session.json")
+# Durata del token CSRF e dei cookie di sessione (secondi)
+TOKEN_TTL = int(os.environ.get("ANIMEUNITY_TOKEN_TTL", "1800"))
+HTTP_POOL_SIZE = int(os.environ.get("ANIMEUNITY_HTTP_POOL_SIZE", "16"))
+# Episodi: cache per anime, blocchi di info_api, richieste parallele e validità
+# della lista per le serie in corso (quelle concluse si servono sempre dalla cache)
+EPISODES_CACHE_DIR = os.path.join(CACHE_DIR, "animeunity_episodes")
+EPISODES_RANGE_SIZE = 120
+EPISODES_WORKERS = int(os.environ.get("ANIMEUNITY_EPISODES_WORKERS", "6"))
+EPISODES_ONGOING_TTL = int(os.environ.get("ANIMEUNITY_EPISODES_TTL", "600"))
+FINISHED_STATUSES = ("terminato", "finished", "completed", "concluso")
+# Cache HTTP su disco delle GET di info_api: dimensione massima, validità dei dati
+# stabili (serie concluse, blocchi di episodi completi) e degli altri
+HTTP_CACHE_DIR = os.path.join(CACHE_DIR, "animeunity_http")
+HTTP_CACHE_MAX_BYTES = int(os.environ.get("ANIMEUNITY_HTTP_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+HTTP_CACHE_STABLE_TTL = int(os.environ.get("ANIMEUNITY_HTTP_CACHE_STABLE_TTL", str(7 * 24 * 3600)))
+HTTP_CACHE_DEFAULT_TTL = int(os.environ.get("ANIMEUNITY_HTTP_CACHE_TTL", "600"))
+# Pulizia della cache HTTP: al più una ogni HTTP_CACHE_EVICT_INTERVAL secondi tra tutti i
+# processi, o ogni HTTP_CACHE_EVICT_EVERY scritture nello stesso processo
+HTTP_CACHE_EVICT_INTERVAL = int(os.environ.get("ANIMEUNITY_HTTP_CACHE_EVICT_INTERVAL", "300"))
+HTTP_CACHE_EVICT_EVERY = int(os.environ.get("ANIMEUNITY_HTTP_CACHE_EVICT_EVERY", "100"))
+# Cache dei link di get_stream: voci in memoria/su disco, margine sulla scadenza
+# dichiarata (expires=) e durata per i link che non ne dichiarano una
+STREAM_CACHE_PATH = os.path.join(CACHE_DIR, "animeunity_streams.json")
+STREAM_CACHE_SIZE = int(os.environ.get("ANIMEUNITY_STREAM_CACHE_SIZE", "512"))
+STREAM_CACHE_MARGIN = int(os.environ.get("ANIMEUNITY_STREAM_CACHE_MARGIN", "120"))
+STREAM_CACHE_TTL = int(os.environ.get("ANIMEUNITY_STREAM_CACHE_TTL", "600"))
+# get_streams: episodi risolti in parallelo e processi per il parsing completo delle pagine
+STREAMS_WORKERS = int(os.environ.get("ANIMEUNITY_STREAMS_WORKERS", "4"))
+PARSE_WORKERS = int(os.environ.get("ANIMEUNITY_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
 
-def get_session_tokens():
-    """Recupera token di sessione per le richieste API"""
-    response = requests.get(f"{BASE_URL}/", headers=HEADERS, timeout=TIMEOUT)
-    response.raise_for_status()
+# Catalogo locale (SQLite + FTS) costruito da /archivio/get-animes: validità prima di
+# un aggiornamento incrementale, ricrawl completo periodico, richieste parallele
+CATALOG_DB_PATH = os.path.join(CACHE_DIR, "animeunity_catalog.sqlite3")
+CATALOG_MAX_AGE = int(os.environ.get("ANIMEUNITY_CATALOG_MAX_AGE", str(24 * 3600)))
+CATALOG_FULL_MAX_AGE = int(os.environ.get("ANIMEUNITY_CATALOG_FULL_MAX_AGE", str(7 * 24 * 3600)))
+CATALOG_WORKERS = int(os.environ.get("ANIMEUNITY_CATALOG_WORKERS", "4"))
+CATALOG_NEWEST_ORDER = os.environ.get("ANIMEUNITY_CATALOG_NEWEST_ORDER", "Ultime aggiunte")
+# Aggiornamento automatico dalle ricerche: "0" spento, "1" solo incrementale su un catalogo
+# già costruito (il primo crawl completo va lanciato a mano), "full" anche crawl completi
+CATALOG_AUTO_REFRESH = os.environ.get("ANIMEUNITY_CATALOG_AUTO_REFRESH", "1")
+CATALOG_SEARCH_LIMIT = 40
+# Ricerca con fallback: ogni variante successiva parte dopo questo ritardo (o subito se le precedenti sono vuote)
+FALLBACK_STAGGER = float(os.environ.get("ANIMEUNITY_FALLBACK_STAGGER", "0.3"))
+
+# <meta name="csrf-token" content="..."> in qualsiasi ordine di attributi
+CSRF_META_RE = re.compile(
+    rb'<meta\s[^>]*?(?:name=["\']csrf-token["\'][^>]*?content=["\']([^"\']+)["\']'
+    rb'|content=["\']([^"\']+)["\'][^>]*?name=["\']csrf-token["\'])',
+    re.IGNORECASE
+)
+
+# Estrazione in streaming: pattern a passata singola sui byte già ricevuti
+VIDEO_PLAYER_EMBED_RE = re.compile(rb'<video-player\b[^>]*?\bembed_url=["\']([^"\']+)["\']', re.IGNORECASE)
+# Solo il metodo 1 di extract_mp4_from_html (src_mp4/file dentro <script>): è l'unico che vince
+# appena trovato, gli altri valgono solo se la pagina intera non ne contiene
+MP4_URL_RE = re.compile(rb'(?:src_mp4|file)\s*[:=]\s*["\']([^"\']+\.mp4[^"\']*)["\']')
+SCRIPT_TAG_RE = re.compile(rb'<(/?)script\b[^>]*>', re.IGNORECASE)
+# Quanto del buffer già esaminato si riesamina a ogni blocco (match a cavallo tra due blocchi)
+SCAN_OVERLAP = 4096
+SCAN_CHUNK_SIZE = 16384
+
+_session_lock = threading.Lock()
+_session = None
+_token_lock = threading.Lock()
+_token_cache = {"csrf_token": None, "cookies": None, "expires": 0.0}
+
+def get_http_session():
+    """Sessione requests condivisa: keep-alive e pool di connessioni per tutte le chiamate"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def _read_csrf_token(response):
+    """Legge la pagina a blocchi e si ferma appena trova il meta csrf-token"""
+    buffer = b""
+    chunks = response.iter_content(8192)
+    for chunk in chunks:
+        buffer += chunk
+        match = CSRF_META_RE.search(buffer)
+        if match:
+            return (match.group(1) or match.group(2)).decode("utf-8")
+        if b"</head>" in buffer.lower():
+            break
+    # Fallback: parsing completo della pagina
+    buffer += b"".join(chunks)
+    meta = BeautifulSoup(buffer, "html.parser").select_one("meta[name=csrf-token]")
+    return meta["content"] if meta else None
+
+def scan_response(response, pattern, accept=None):
+    """
+    Legge la risposta a blocchi cercando pattern solo sulla parte nuova (più SCAN_OVERLAP)
+    e si ferma al primo match accettato. Restituisce (match o None, byte letti):
+    senza match i byte letti sono l'intera pagina, pronta per il parsing completo.
+    """
+    buffer = bytearray()
+    for chunk in response.iter_content(SCAN_CHUNK_SIZE):
+        start = max(0, len(buffer) - SCAN_OVERLAP)
+        buffer += chunk
+        for match in pattern.finditer(buffer, start):
+            if accept is None or accept(match):
+                return match, bytes(buffer)
+    return None, bytes(buffer)
+
+def _decode(response, data):
+    return data.decode(response.encoding or "utf-8", errors="replace")
+
+def _parse(parse_pool, function, *args):
+    """
+    Parsing completo (BeautifulSoup) nel pool di processi passato da get_streams, se c'è:
+    con i thread il lavoro CPU della soup verrebbe serializzato dal GIL
+    """
+    if parse_pool is not None:
+        return parse_pool.submit(function, *args).result()
+    return function(*args)
 
-    soup = BeautifulSoup(response.text, "html.parser")
-    csrf_token = soup.select_one("meta[name=csrf-token]")["content"]
-    cookies = response.cookies.get_dict()
+def _fetch_session_tokens():
+    """
+    Token CSRF e cookie di una sessione Laravel nuova, che nasce dalla homepage.
+    I cookie finiscono in una sessione a parte (stesso pool di connessioni di quella
+    condivisa): il jar condiviso non viene svuotato mentre altre richieste sono in volo.
+    """
+    shared = get_http_session()
+    session = requests.Session()
+    session.mount("https://", shared.get_adapter("https://"))
+    session.mount("http://", shared.get_adapter("http://"))
+    with session.get(f"{BASE_URL}/", headers=HEADERS, timeout=TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        csrf_token = _read_csrf_token(response)
+    if not csrf_token:
+        raise ValueError("meta csrf-token non trovato nella homepage")
+    return csrf_token, session.cookies.get_dict()
 
+def _session_data(csrf_token, cookies):
     return {
         "csrf_token": csrf_token,
         "cookies": cookies,
@@ -50,10 +186,402 @@ def get_session_tokens():
         }
     }
 
-def search_anime(query, dubbed=False):
-    """Ricerca anime tramite API livesearch e archivio"""
+def get_session_tokens(rejected=None):
+    """
+    Recupera token di sessione per le richieste API.
+    Usa la cache in memoria, poi quella su disco, e scarica la homepage solo se scaduti
+    o se il token in cache è quello appena rifiutato (un altro thread può averlo già rinnovato).
+    """
+    with _token_lock:
+        now = time.time()
+        force_refresh = rejected is not None and _token_cache["csrf_token"] == rejected
+        if not force_refresh and _token_cache["expires"] <= now:
+            try:
+                with open(TOKEN_CACHE_PATH, encoding="utf-8") as f:
+                    cached = json.load(f)
+                if cached.get("expires", 0) > now and cached.get("base_url") == BASE_URL:
+                    _token_cache.update(csrf_token=cached["csrf_token"], cookies=cached["cookies"], expires=cached["expires"])
+            except (OSError, ValueError, KeyError):
+                pass
+        if force_refresh or _token_cache["expires"] <= now:
+            csrf_token, cookies = _fetch_session_tokens()
+            # Scambio sotto _token_lock: le richieste successive usano i cookie nuovi,
+            # quelle già partite restano con i propri
+            _token_cache.update(csrf_token=csrf_token, cookies=cookies, expires=now + TOKEN_TTL)
+            get_http_session().cookies.update(cookies)
+            try:
+                write_json_atomic(TOKEN_CACHE_PATH, {**_token_cache, "base_url": BASE_URL})
+            except OSError as e:
+                print(f"⚠️ Impossibile salvare i token di sessione: {e}", file=sys.stderr)
+        return _session_data(_token_cache["csrf_token"], _token_cache["cookies"])
+
+def api_post(url, payload):
+    """
+    POST alle API con token e cookie in cache.
+    Su 419 (token CSRF scaduto) o 403 rinnova i token e riprova una sola volta.
+    """
+    session_data = get_session_tokens()
+    for attempt in range(2):
+        response = get_http_session().post(
+            url,
+            json=payload,
+            headers=session_data["session_headers"],
+            cookies=session_data["cookies"],
+            timeout=TIMEOUT
+        )
+        if response.status_code in (403, 419) and attempt == 0:
+            print(f"Debug: Token rifiutato ({response.status_code}), lo rinnovo", file=sys.stderr)
+            session_data = get_session_tokens(rejected=session_data["csrf_token"])
+            continue
+        response.raise_for_status()
+        return response
+
+def _external_id(value):
+    """Id MAL/AniList come intero (None se assente o non numerico)"""
+    try:
+        return int(value) if value not in (None, "", 0, "0") else None
+    except (TypeError, ValueError):
+        return None
+
+def archive_payload(title="", dubbed=False, offset=0, order="Lista A-Z"):
+    """Payload di /archivio/get-animes (dubbed=None: sia sub che dub)"""
+    return {
+        "title": title, "type": False, "year": False,
+        "order": order, "status": False, "genres": False,
+        "season": False, "offset": offset, "dubbed": dubbed
+    }
+
+class AnimeCatalog:
+    """
+    Copia locale dell'archivio AnimeUnity in SQLite, con indice FTS5 sui titoli
+    (ricerca LIKE se FTS5 non è disponibile). Un oggetto per thread: le connessioni
+    SQLite non si condividono tra thread.
+    """
+    def __init__(self, path=CATALOG_DB_PATH):
+        import sqlite3
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS anime (
+            id INTEGER PRIMARY KEY, slug TEXT, title TEXT, title_eng TEXT, title_it TEXT,
+            episodes_count INTEGER, dubbed INTEGER, updated REAL, mal_id INTEGER, anilist_id INTEGER)""")
+        # Cataloghi creati prima degli id esterni: colonne aggiunte al volo
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(anime)")}
+        for column in ("mal_id", "anilist_id"):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE anime ADD COLUMN {column} INTEGER")
+        self.db.execute("CREATE INDEX IF NOT EXISTS anime_mal_id ON anime (mal_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS anime_anilist_id ON anime (anilist_id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        try:
+            self.db.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS anime_fts USING fts5(
+                title, title_eng, title_it, content='anime', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2')""")
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM anime").fetchone()[0]
+
+    def age(self):
+        """Secondi dall'ultimo aggiornamento riuscito (None se il catalogo non è mai stato scaricato)"""
+        refreshed = self.get_meta("refreshed")
+        return time.time() - float(refreshed) if refreshed else None
+
+    def is_fresh(self, max_age=CATALOG_MAX_AGE):
+        age = self.age()
+        return age is not None and age < max_age and self.count() > 0
+
+    def upsert(self, records):
+        """
+        Inserisce o aggiorna i record dell'archivio; restituisce quanti erano nuovi.
+        I campi assenti dal record non cancellano quelli già noti (es. mal_id/anilist_id).
+        """
+        now = time.time()
+        new = 0
+        for record in records:
+            if not record or not record.get("id"):
+                continue
+            dubbed = record.get("dubbed")
+            row = (record.get("slug"), record.get("title"), record.get("title_eng"), record.get("title_it"),
+                   record.get("episodes_count"), None if dubbed is None else (1 if dubbed else 0), now,
+                   _external_id(record.get("mal_id")), _external_id(record.get("anilist_id")))
+            old = self.db.execute("SELECT title, title_eng, title_it FROM anime WHERE id = ?", (record["id"],)).fetchone()
+            if old is None:
+                new += 1
+            elif self.fts:
+                # Tabella FTS "external content": la vecchia riga va tolta con i suoi valori
+                self.db.execute("INSERT INTO anime_fts (anime_fts, rowid, title, title_eng, title_it) VALUES ('delete', ?, ?, ?, ?)",
+                                (record["id"], *old))
+            self.db.execute("""INSERT INTO anime (id, slug, title, title_eng, title_it, episodes_count,
+                               dubbed, updated, mal_id, anilist_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                               ON CONFLICT(id) DO UPDATE SET
+                               slug = COALESCE(excluded.slug, slug), title = COALESCE(excluded.title, title),
+                               title_eng = COALESCE(excluded.title_eng, title_eng),
+                               title_it = COALESCE(excluded.title_it, title_it),
+                               episodes_count = COALESCE(excluded.episodes_count, episodes_count),
+                               dubbed = COALESCE(excluded.dubbed, dubbed), updated = excluded.updated,
+                               mal_id = COALESCE(excluded.mal_id, mal_id),
+                               anilist_id = COALESCE(excluded.anilist_id, anilist_id)""", (record["id"], *row))
+            if self.fts:
+                titles = self.db.execute("SELECT title, title_eng, title_it FROM anime WHERE id = ?", (record["id"],)).fetchone()
+                self.db.execute("INSERT INTO anime_fts (rowid, title, title_eng, title_it) VALUES (?, ?, ?, ?)",
+                                (record["id"], *titles))
+        self.db.commit()
+        return new
+
+    def find_by_external_id(self, mal_id=None, anilist_id=None):
+        """
+        Versioni AnimeUnity (sub e dub) di un anime MAL/AniList, lette dall'indice locale.
+        Restituisce {"sub": [...], "dub": [...]} con voci nel formato di search_anime.
+        """
+        column, value = ("mal_id", mal_id) if mal_id is not None else ("anilist_id", anilist_id)
+        rows = self.db.execute(f"""SELECT id, slug, title_it, title_eng, title, episodes_count, dubbed
+            FROM anime WHERE {column} = ? ORDER BY id""", (int(value),)).fetchall()
+        variants = {"sub": [], "dub": []}
+        for anime_id, slug, title_it, title_eng, title, episodes_count, dubbed in rows:
+            variants["dub" if dubbed else "sub"].append({
+                "id": anime_id, "slug": slug or "",
+                "name": (title_it or title_eng or title or "").strip(),
+                "episodes_count": episodes_count or 0
+            })
+        return variants
+
+    def search(self, query, dubbed=False, limit=CATALOG_SEARCH_LIMIT):
+        """Ricerca per parole (prefisso), a prova di punteggiatura; stesso formato di search_anime"""
+        # Parole singole come la "s" di un apostrofo non restringono la ricerca
+        words = [w for w in re.findall(r"\w+", query.lower()) if len(w) > 1 or w.isdigit()]
+        if not words:
+            return []
+        if self.fts:
+            match = " AND ".join(f'"{word}"*' for word in words)
+            rows = self.db.execute("""SELECT a.id, a.slug, a.title_it, a.title_eng, a.title, a.episodes_count
+                FROM anime_fts JOIN anime a ON a.id = anime_fts.rowid
+                WHERE anime_fts MATCH ? AND a.dubbed = ? ORDER BY bm25(anime_fts) LIMIT ?""",
+                (match, 1 if dubbed else 0, limit)).fetchall()
+        else:
+            where = " AND ".join("(COALESCE(title, '') || ' ' || COALESCE(title_eng, '') || ' ' || COALESCE(title_it, '')) LIKE ?" for _ in words)
+            rows = self.db.execute(f"""SELECT id, slug, title_it, title_eng, title, episodes_count FROM anime
+                WHERE {where} AND dubbed = ? LIMIT ?""", (*[f"%{w}%" for w in words], 1 if dubbed else 0, limit)).fetchall()
+        results = []
+        for anime_id, slug, title_it, title_eng, title, episodes_count in rows:
+            name = (title_it or title_eng or title or "").strip()
+            if name:
+                results.append({"id": anime_id, "slug": slug or "", "name": name, "episodes_count": episodes_count or 0})
+        return results
+
+def _fetch_archive_page(offset, dubbed, order="Lista A-Z"):
+    data = api_post(f"{BASE_URL}/archivio/get-animes", archive_payload(dubbed=dubbed, offset=offset, order=order)).json()
+    records = data.get("records") or []
+    for record in records:
+        if record and "dubbed" not in record:
+            record["dubbed"] = dubbed
+    return records, data.get("tot")
+
+def crawl_catalog(full=False, workers=CATALOG_WORKERS, incremental=False):
+    """
+    Aggiorna il catalogo locale, versioni sub e dub. Completo (catalogo vuoto, forzato
+    o più vecchio di CATALOG_FULL_MAX_AGE): tutte le pagine per offset, in parallelo.
+    Incrementale: pagine in ordine di aggiunta finché non compaiono solo anime già noti.
+    Con incremental non si passa mai al crawl completo (catalogo vuoto: nessun crawl).
+    Un solo crawl alla volta: se ne è già in corso uno restituisce None.
+    Altrimenti restituisce il numero di anime nuovi.
+    """
+    try:
+        with FileLock(CATALOG_DB_PATH + ".running", blocking=False):
+            return _crawl_catalog(full, workers, incremental)
+    except BlockingIOError:
+        print("Debug: Aggiornamento del catalogo già in corso in un altro processo", file=sys.stderr)
+        return None
+
+def _crawl_catalog(full, workers, incremental):
+    from concurrent.futures import ThreadPoolExecutor
+
+    catalog = AnimeCatalog()
+    try:
+        if incremental and catalog.count() == 0:
+            print("⚠️ Catalogo locale vuoto: serve un crawl completo (crawl_catalog --full)", file=sys.stderr)
+            return 0
+        last_full = float(catalog.get_meta("full_crawl", 0))
+        if not incremental:
+            full = full or catalog.count() == 0 or time.time() - last_full > CATALOG_FULL_MAX_AGE
+        new = 0
+        for dubbed in (False, True):
+            if full:
+                records, total = _fetch_archive_page(0, dubbed)
+                page_size = len(records) or 30
+                new += catalog.upsert(records)
+                if total is not None:
+                    offsets = range(page_size, int(total), page_size)
+                    with ThreadPoolExecutor(max_workers=workers) as pool:
+                        # Scrittura dal thread principale, man mano che le pagine arrivano in ordine
+                        for page in pool.map(lambda offset: _fetch_archive_page(offset, dubbed)[0], offsets):
+                            new += catalog.upsert(page)
+                else:
+                    # Senza "tot" l'ultima pagina non è nota: si prosegue in ordine fino a una pagina vuota,
+                    # così il crawl viene segnato completo solo dopo averla vista davvero
+                    offset = len(records)
+                    while records:
+                        records, _ = _fetch_archive_page(offset, dubbed)
+                        new += catalog.upsert(records)
+                        offset += len(records)
+            else:
+                offset = 0
+                while True:
+                    records, _ = _fetch_archive_page(offset, dubbed, CATALOG_NEWEST_ORDER)
+                    added = catalog.upsert(records)
+                    new += added
+                    if not records or not added:
+                        break
+                    offset += len(records)
+        if full:
+            catalog.set_meta("full_crawl", time.time())
+        catalog.set_meta("refreshed", time.time())
+        catalog.db.commit()
+        print(f"Debug: Catalogo aggiornato ({'completo' if full else 'incrementale'}): "
+              f"{new} nuovi, {catalog.count()} totali", file=sys.stderr)
+        return new
+    finally:
+        catalog.close()
+
+def _spawn_catalog_refresh():
+    """
+    Avvia l'aggiornamento del catalogo in un processo separato, se non ne è partito
+    uno nell'ultima ora (il file .crawl, creato in modo esclusivo, viene rimosso dal
+    crawler quando ha finito) e se non ce n'è uno ancora in corso (lock .running).
+    Incrementale, salvo ANIMEUNITY_CATALOG_AUTO_REFRESH=full.
+    """
+    import subprocess
+
+    lock_path = CATALOG_DB_PATH + ".crawl"
     try:
-        session_data = get_session_tokens()
+        with FileLock(CATALOG_DB_PATH + ".running", blocking=False):
+            pass
+    except BlockingIOError:
+        return
+    except OSError:
+        pass
+    try:
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # Marcatore rimasto da un crawl fallito: dopo un'ora si riprova, una sola ricerca vince
+            if time.time() - os.path.getmtime(lock_path) < 3600:
+                return
+            os.remove(lock_path)
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        command = [sys.executable, os.path.abspath(__file__), "crawl_catalog", "--release-lock"]
+        if CATALOG_AUTO_REFRESH != "full":
+            command.append("--incremental")
+        subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True)
+    except (FileExistsError, FileNotFoundError):
+        # Un'altra ricerca ha appena preso (o rinnovato) il marcatore
+        return
+    except OSError as e:
+        print(f"⚠️ Impossibile avviare l'aggiornamento del catalogo: {e}", file=sys.stderr)
+
+def lookup_external_id(mal_id=None, anilist_id=None, dubbed=False):
+    """
+    Risolve un id MAL/AniList nelle versioni AnimeUnity con una lettura del catalogo
+    locale, senza euristiche sui titoli. Restituisce la lista nel formato di search_anime.
+    """
+    try:
+        catalog = AnimeCatalog()
+    except Exception as e:
+        print(f"⚠️ Catalogo locale non disponibile: {e}", file=sys.stderr)
+        return []
+    try:
+        variants = catalog.find_by_external_id(mal_id=mal_id, anilist_id=anilist_id)
+        stale = not catalog.is_fresh()
+    finally:
+        catalog.close()
+    if stale and CATALOG_AUTO_REFRESH != "0":
+        _spawn_catalog_refresh()
+    results = variants["dub" if dubbed else "sub"]
+    print(f"Debug: {len(results)} versioni per mal_id={mal_id} anilist_id={anilist_id} nel catalogo locale", file=sys.stderr)
+    return results
+
+def _remember_records(records):
+    """Salva nel catalogo locale i record (con id esterni) arrivati dalle ricerche online"""
+    try:
+        catalog = AnimeCatalog()
+        try:
+            catalog.upsert(records)
+        finally:
+            catalog.close()
+    except Exception as e:
+        print(f"⚠️ Impossibile aggiornare il catalogo locale: {e}", file=sys.stderr)
+
+def search_catalog(query, dubbed=False):
+    """
+    Cerca nel catalogo locale se è aggiornato; altrimenti restituisce None (serve la rete)
+    e, se abilitato, avvia l'aggiornamento in background per le prossime ricerche.
+    """
+    try:
+        catalog = AnimeCatalog()
+    except Exception as e:
+        print(f"⚠️ Catalogo locale non disponibile: {e}", file=sys.stderr)
+        return None
+    try:
+        if catalog.is_fresh():
+            results = catalog.search(query, dubbed)
+            print(f"Debug: Trovati {len(results)} risultati per '{query}' nel catalogo locale", file=sys.stderr)
+            return results
+    finally:
+        catalog.close()
+    if CATALOG_AUTO_REFRESH != "0":
+        _spawn_catalog_refresh()
+    return None
+
+def _search_endpoint(endpoint, cancel=None):
+    """Interroga un endpoint di ricerca e restituisce i suoi record ([] su errore o annullamento)"""
+    if cancel is not None and cancel.is_set():
+        return []
+    try:
+        response = api_post(endpoint["url"], endpoint["payload"])
+        data = response.json()
+        print(f"Debug: Risposta da {endpoint['url']}: {data.get('records', [])[:2]}", file=sys.stderr)
+        return data.get("records", [])
+    except Exception as e:
+        # Print error to stderr so it doesn't interfere with JSON output
+        print(f"⚠️ Errore ricerca {endpoint['url']}: {e}", file=sys.stderr)
+        return []
+
+def search_anime(query, dubbed=False, cancel=None):
+    """
+    Ricerca anime tramite API livesearch e archivio, interrogate in parallelo.
+    I risultati restano nell'ordine di sempre: prima livesearch, poi archivio.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Catalogo locale aggiornato: nessuna richiesta di rete. Se non trova nulla si prova
+    # comunque online: l'anime può essere stato aggiunto dopo l'ultimo crawl
+    indexed = search_catalog(query, dubbed)
+    if indexed:
+        return indexed
+
+    if cancel is not None and cancel.is_set():
+        return []
+    try:
+        get_session_tokens()
     except Exception as e:
         print(f"⚠️ Errore ottenimento token di sessione: {e}", file=sys.stderr)
         return []
@@ -64,120 +592,367 @@ def search_anime(query, dubbed=False):
     # Endpoint di ricerca
     search_endpoints = [
         {"url": f"{BASE_URL}/livesearch", "payload": {"title": query}},
-        {"url": f"{BASE_URL}/archivio/get-animes", "payload": {
-            "title": query, "type": False, "year": False,
-            "order": "Lista A-Z", "status": False, "genres": False,
-            "season": False, "offset": 0, "dubbed": dubbed
-        }}
+        {"url": f"{BASE_URL}/archivio/get-animes", "payload": archive_payload(query, dubbed)}
     ]
 
-    for endpoint in search_endpoints:
-        try:
-            response = requests.post(
-                endpoint["url"],
-                json=endpoint["payload"],
-                headers=session_data["session_headers"],
-                cookies=session_data["cookies"],
-                timeout=TIMEOUT
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            print(f"Debug: Risposta da {endpoint['url']}: {data.get('records', [])[:2]}", file=sys.stderr)
+    with ThreadPoolExecutor(max_workers=len(search_endpoints)) as pool:
+        responses = list(pool.map(lambda endpoint: _search_endpoint(endpoint, cancel), search_endpoints))
+    # I record dell'archivio portano anche mal_id/anilist_id: restano nel catalogo locale,
+    # marcati sub/dub come nel crawl (la ricerca è filtrata su dubbed)
+    for record in responses[1]:
+        if record and "dubbed" not in record:
+            record["dubbed"] = dubbed
+    _remember_records(responses[1])
 
-            for record in data.get("records", []):
-                if not record or not record.get("id"):
-                    continue
-                anime_id = record["id"]
-                if anime_id not in seen_ids:
-                    seen_ids.add(anime_id)
-                    title = (record.get("title_it") or
-                            record.get("title_eng") or
-                            record.get("title") or "")
-                    if title.strip():
-                        results.append({
-                            "id": anime_id,
-                            "slug": record.get("slug", ""),
-                            "name": title.strip(),
-                            "episodes_count": record.get("episodes_count", 0)
-                        })
-        except Exception as e:
-            # Print error to stderr so it doesn't interfere with JSON output
-            print(f"⚠️ Errore ricerca {endpoint['url']}: {e}", file=sys.stderr)
-            continue
+    for records in responses:
+        for record in records:
+            if not record or not record.get("id"):
+                continue
+            anime_id = record["id"]
+            if anime_id not in seen_ids:
+                seen_ids.add(anime_id)
+                title = (record.get("title_it") or
+                        record.get("title_eng") or
+                        record.get("title") or "")
+                if title.strip():
+                    results.append({
+                        "id": anime_id,
+                        "slug": record.get("slug", ""),
+                        "name": title.strip(),
+                        "episodes_count": record.get("episodes_count", 0)
+                    })
 
     print(f"Debug: Trovati {len(results)} risultati per '{query}'", file=sys.stderr)
     return results
 
-def search_anime_with_fallback(query, dubbed=False):
-    results = search_anime(query, dubbed)
-    if results:
-        return results
+def search_variants(query, dubbed=False):
+    """Query da provare in ordine di preferenza: originale e poi i fallback"""
+    variants = [(query, dubbed)]
     # Fallback: senza apostrofi
     if "'" in query or "’" in query:
-        results = search_anime(query.replace("'", "").replace("’", ""))
-        if results:
-            return results
+        variants.append((query.replace("'", "").replace("’", ""), dubbed))
     # Fallback: senza parentesi
     if "(" in query:
-        results = search_anime(query.split("(")[0].strip(), dubbed)
-        if results:
-            return results
+        variants.append((query.split("(")[0].strip(), dubbed))
     # Fallback: prime 3 parole
     words = query.split()
     if len(words) > 3:
-        results = search_anime(" ".join(words[:3]), dubbed)
-        if results:
-            return results
+        variants.append((" ".join(words[:3]), dubbed))
+    unique = []
+    for variant in variants:
+        if variant not in unique:
+            unique.append(variant)
+    return unique
+
+def search_anime_with_fallback(query, dubbed=False):
+    """
+    Prova la query originale e poi i fallback, restituendo i risultati della prima
+    variante in ordine di preferenza che ne trova. Le varianti partono scaglionate:
+    la successiva dopo FALLBACK_STAGGER secondi, o subito se le precedenti sono
+    già finite senza risultati. Appena una variante vince le altre vengono annullate
+    e quelle non ancora partite non inviano richieste.
+    """
+    import queue
+
+    variants = search_variants(query, dubbed)
+    if len(variants) == 1:
+        return search_anime(query, dubbed)
+    cancel = threading.Event()
+    done = queue.Queue()
+
+    def run(index, variant_query, variant_dubbed):
+        try:
+            done.put((index, search_anime(variant_query, variant_dubbed, cancel)))
+        except Exception as e:
+            print(f"⚠️ Errore ricerca '{variant_query}': {e}", file=sys.stderr)
+            done.put((index, []))
+
+    def launch(index):
+        # Thread daemon: le varianti annullate non trattengono l'uscita dello script
+        threading.Thread(target=run, args=(index, *variants[index]), daemon=True).start()
+        return index + 1, time.monotonic() + FALLBACK_STAGGER
+
+    launched, next_launch = launch(0)
+    outcomes = {}
+    next_index = 0
+    while next_index < len(variants):
+        pending = launched < len(variants)
+        if pending and next_index >= launched:
+            # Tutte le varianti partite sono vuote: inutile aspettare il ritardo
+            launched, next_launch = launch(launched)
+            continue
+        try:
+            index, results = done.get(timeout=max(0, next_launch - time.monotonic()) if pending else None)
+        except queue.Empty:
+            launched, next_launch = launch(launched)
+            continue
+        outcomes[index] = results
+        # Fusione per priorità: si avanza solo sulle varianti già concluse
+        while next_index in outcomes:
+            if outcomes[next_index]:
+                cancel.set()
+                return outcomes[next_index]
+            next_index += 1
     return []
 
+class CachedResponse:
+    """Risposta servita dalla cache HTTP (sottoinsieme dell'interfaccia di requests)"""
+    def __init__(self, status_code, text, from_cache):
+        self.status_code = status_code
+        self.text = text
+        self.from_cache = from_cache
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+_INFO_API_COUNT_RE = re.compile(r"/info_api/\d+/?$")
+_INFO_API_RANGE_RE = re.compile(r"/info_api/\d+/1$")
+
+def http_freshness(url, params, data):
+    """
+    Per quanto una risposta resta valida senza rivalidarla, per endpoint:
+    - info_api/{id}/: a lungo se la serie è conclusa, altrimenti HTTP_CACHE_DEFAULT_TTL
+    - info_api/{id}/1 a intervalli: a lungo se il blocco è completo (episodi già usciti)
+    """
+    path = urlparse(url).path
+    if _INFO_API_COUNT_RE.search(path) and isinstance(data, dict):
+        if str(data.get("status") or "").strip().lower() in FINISHED_STATUSES:
+            return HTTP_CACHE_STABLE_TTL
+    elif _INFO_API_RANGE_RE.search(path) and isinstance(data, dict) and params:
+        expected = int(params["end_range"]) - int(params["start_range"]) + 1
+        if len(data.get("episodes") or []) >= expected:
+            return HTTP_CACHE_STABLE_TTL
+    return HTTP_CACHE_DEFAULT_TTL
+
+class HttpCache:
+    """
+    Cache su disco delle GET JSON: un file per URL+parametri. Le voci ancora fresche
+    si servono senza rete; le altre si rivalidano con If-None-Match/If-Modified-Since
+    quando il server ha dato ETag/Last-Modified (304 = corpo dalla cache).
+    Oltre max_bytes si eliminano le voci usate meno di recente: l'mtime di ogni file
+    viene aggiornato da noi a ogni uso (l'atime non è affidabile con noatime/relatime).
+    La directory si scorre solo ogni tanto (vedi _maybe_evict), non a ogni scrittura.
+    """
+    def __init__(self, directory=HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_MAX_BYTES, freshness=http_freshness):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.freshness = freshness
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _path(self, url, params):
+        import hashlib
+
+        key = url + "?" + "&".join(f"{k}={v}" for k, v in sorted((params or {}).items()))
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, path, entry):
+        try:
+            write_json_atomic(path, entry)
+            self._maybe_evict()
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare la cache HTTP: {e}", file=sys.stderr)
+
+    def _maybe_evict(self):
+        """
+        Pulisce la cache ogni HTTP_CACHE_EVICT_EVERY scritture di questo processo o se
+        l'ultima pulizia (mtime del file .evicted, condiviso tra i processi) è più vecchia
+        di HTTP_CACHE_EVICT_INTERVAL: per le altre scritture basta una stat
+        """
+        marker = os.path.join(self.directory, ".evicted")
+        with self._lock:
+            self._writes += 1
+            if self._writes < HTTP_CACHE_EVICT_EVERY:
+                try:
+                    if time.time() - os.path.getmtime(marker) < HTTP_CACHE_EVICT_INTERVAL:
+                        return
+                except OSError:
+                    pass
+            self._writes = 0
+            with open(marker, "a"):
+                pass
+            os.utime(marker)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            files = []
+            try:
+                entries = list(os.scandir(self.directory))
+            except OSError:
+                return
+            for e in entries:
+                if not e.name.endswith(".json"):
+                    continue
+                try:
+                    st = e.stat()
+                except OSError:  # rimossa da un altro processo nel frattempo
+                    continue
+                files.append((st.st_mtime, st.st_size, e.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def get(self, url, params=None, headers=None, timeout=TIMEOUT, revalidate=False):
+        """GET con cache; revalidate=True ignora la freschezza e fa sempre la richiesta condizionale"""
+        path = self._path(url, params)
+        entry = self._load(path)
+        now = time.time()
+        if entry and not revalidate and entry.get("fresh_until", 0) > now:
+            try:
+                os.utime(path)  # usata di recente: ultima a essere eliminata
+            except OSError:
+                pass
+            return CachedResponse(200, entry["body"], True)
+
+        request_headers = dict(headers or HEADERS)
+        if entry:
+            if entry.get("etag"):
+                request_headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                request_headers["If-Modified-Since"] = entry["last_modified"]
+        response = get_http_session().get(url, params=params, headers=request_headers, timeout=timeout)
+        if response.status_code == 304 and entry:
+            entry["fresh_until"] = now + self.freshness(url, params, json.loads(entry["body"]))
+            self._store(path, entry)
+            return CachedResponse(200, entry["body"], True)
+        response.raise_for_status()
+        try:
+            data = response.json()
+        except ValueError:
+            return response
+        self._store(path, {
+            "url": url,
+            "params": params,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fresh_until": now + self.freshness(url, params, data),
+            "body": response.text
+        })
+        return response
+
+http_cache = HttpCache()
+
+def _episodes_cache_path(anime_id):
+    return os.path.join(EPISODES_CACHE_DIR, f"{re.sub(r'[^0-9A-Za-z_-]', '_', str(anime_id))}.json")
+
+def load_episodes_cache(anime_id):
+    try:
+        with open(_episodes_cache_path(anime_id), encoding="utf-8") as f:
+            cached = json.load(f)
+        return cached if isinstance(cached.get("episodes"), list) else None
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _fetch_episode_range(anime_id, start, end):
+    response = http_cache.get(
+        f"{BASE_URL}/info_api/{anime_id}/1",
+        params={"start_range": start, "end_range": end},
+        headers=HEADERS,
+        timeout=TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json().get("episodes", [])
+
+def fetch_episode_ranges(anime_id, first, total):
+    """
+    Scarica in parallelo i blocchi da 120 episodi tra first e total, restituendoli in ordine.
+    Restituisce (episodi, completa): se un blocco fallisce si tengono quelli precedenti,
+    come il vecchio ciclo sequenziale, e completa è False.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    ranges = [(start, min(start + EPISODES_RANGE_SIZE - 1, total))
+              for start in range(first, total + 1, EPISODES_RANGE_SIZE)]
+    if not ranges:
+        return [], True
+    episodes = []
+    with ThreadPoolExecutor(max_workers=min(EPISODES_WORKERS, len(ranges))) as pool:
+        futures = [pool.submit(_fetch_episode_range, anime_id, *r) for r in ranges]
+        for (start, end), future in zip(ranges, futures):
+            try:
+                episodes.extend(future.result())
+            except Exception as e:
+                print(f"⚠️ Errore recupero episodi {start}-{end}: {e}", file=sys.stderr)
+                for pending in futures:
+                    pending.cancel()
+                return episodes, False
+    return episodes, True
+
 def get_episodes_list(anime_id):
-    """Recupera lista episodi tramite API info_api"""
+    """
+    Recupera lista episodi tramite API info_api, con cache persistente per anime.
+    Serie concluse: servite dalla cache. Serie in corso: dopo EPISODES_ONGOING_TTL
+    si rilegge il conteggio e si scaricano solo i blocchi oltre l'ultimo episodio noto.
+    """
+    cached = load_episodes_cache(anime_id)
+    if cached and (cached.get("finished") or time.time() - cached.get("updated", 0) < EPISODES_ONGOING_TTL):
+        print(f"Debug: Episodi di {anime_id} dalla cache ({len(cached['episodes'])})", file=sys.stderr)
+        return cached["episodes"]
+
     episodes = []
 
     try:
         # Ottieni conteggio episodi
-        count_response = requests.get(
+        # La lista in cache è scaduta: il conteggio va sempre rivalidato (304 se invariato)
+        count_response = http_cache.get(
             f"{BASE_URL}/info_api/{anime_id}/",
             headers=HEADERS,
-            timeout=TIMEOUT
+            timeout=TIMEOUT,
+            revalidate=cached is not None
         )
         count_response.raise_for_status()
-        total_episodes = count_response.json().get("episodes_count", 0)
-
-        # Recupera episodi in batch
-        start = 1
-        while start <= total_episodes:
-            end = min(start + 119, total_episodes)
-
-            episodes_response = requests.get(
-                f"{BASE_URL}/info_api/{anime_id}/1",
-                params={"start_range": start, "end_range": end},
-                headers=HEADERS,
-                timeout=TIMEOUT
-            )
-            episodes_response.raise_for_status()
-            episodes.extend(episodes_response.json().get("episodes", []))
-            start = end + 1
+        info = count_response.json()
+        total_episodes = info.get("episodes_count", 0)
+        finished = str(info.get("status") or "").strip().lower() in FINISHED_STATUSES
+
+        # Aggiornamento incrementale: solo se la cache è un prefisso coerente della lista
+        known = cached["episodes"] if cached and len(cached["episodes"]) <= total_episodes else []
+        if known:
+            print(f"Debug: Episodi di {anime_id}: {len(known)} in cache, {total_episodes} totali", file=sys.stderr)
+        fetched, complete = fetch_episode_ranges(anime_id, len(known) + 1, total_episodes)
+        episodes = known + fetched
+        if not complete:
+            # Lista parziale: la si restituisce ma non la si salva
+            return episodes if cached is None or len(episodes) >= len(cached["episodes"]) else cached["episodes"]
+
+        try:
+            write_json_atomic(_episodes_cache_path(anime_id), {
+                "anime_id": anime_id,
+                "episodes_count": total_episodes,
+                "finished": finished and len(episodes) >= total_episodes,
+                "updated": time.time(),
+                "episodes": episodes
+            })
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare la cache episodi: {e}", file=sys.stderr)
 
     except Exception as e:
         print(f"⚠️ Errore recupero episodi: {e}", file=sys.stderr)
+        # Meglio una lista un po' vecchia che nessuna lista
+        if cached and not episodes:
+            return cached["episodes"]
 
     return episodes
 
-def get_video_page_content(anime_id, anime_slug, episode_id):
-    """Ottiene contenuto pagina episodio per estrazione embed URL"""
-    episode_url = f"{BASE_URL}/anime/{anime_id}-{anime_slug}/{episode_id}"
-
-    try:
-        response = requests.get(episode_url, headers=HEADERS, timeout=TIMEOUT)
-        response.raise_for_status()
-        return response.text
-    except Exception as e:
-        print(f"⚠️ Errore caricamento pagina episodio: {e}", file=sys.stderr)
-        return None
-
-def extract_mp4_from_vixcloud(embed_url):
+def extract_mp4_from_vixcloud(embed_url, parse_pool=None):
     """
     Estrae link MP4 diretto da VixCloud
     """
@@ -191,18 +966,51 @@ def extract_mp4_from_vixcloud(embed_url):
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
         }
 
-        # Richiesta pagina embed con SSL disabilitato
+        # Richiesta pagina embed con SSL disabilitato, letta in streaming
         import urllib3
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        response = requests.get(
+        with get_http_session().get(
             embed_url,
             headers=vixcloud_headers,
             timeout=TIMEOUT,
-            verify=False
-        )
-        response.raise_for_status()
+            verify=False,
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            match, content = scan_response(response, MP4_URL_RE, _is_direct_mp4)
+            if match:
+                return _mp4_from_match(match)
+            # Nessun link src_mp4 diretto: parsing completo con gli altri metodi nell'ordine di sempre
+            return _parse(parse_pool, extract_mp4_from_html, _decode(response, content))
 
-        soup = BeautifulSoup(response.text, "html.parser")
+    except Exception as e:
+        print(f"⚠️ Errore estrazione VixCloud: {e}", file=sys.stderr)
+        return None
+
+def _mp4_from_match(match):
+    return match.group(1).decode("utf-8", errors="replace").replace("\\/", "/")
+
+def _is_direct_mp4(match):
+    """
+    Stessi criteri del metodo 1 di extract_mp4_from_html: primo src_mp4/file
+    del suo <script> e URL assoluto
+    """
+    if not _mp4_from_match(match).startswith("http"):
+        return False
+    body_start = None
+    for tag in SCRIPT_TAG_RE.finditer(match.string, 0, match.start()):
+        body_start = None if tag.group(1) else tag.end()
+    if body_start is None:
+        return False
+    first = MP4_URL_RE.search(match.string, body_start)
+    return first.start() == match.start()
+
+def extract_mp4_from_html(full_text):
+    """
+    Estrae link MP4 dal testo completo della pagina embed VixCloud
+    """
+    try:
+        soup = BeautifulSoup(full_text, "html.parser")
 
         # Metodo 1: Cerca script con src_mp4 (logica MP4_downloader)
         scripts = soup.find_all("script")
@@ -218,7 +1026,6 @@ def extract_mp4_from_vixcloud(embed_url):
                         return mp4_url
 
         # Metodo 2: Cerca variabili JavaScript con URL MP4
-        full_text = response.text
         mp4_patterns = [
             r"(?:file|source|src)\s*[:=]\s*[\"']([^\"']*au-d1-[^\"']*\.mp4[^\"']*)[\"']",
             r"[\"']([^\"']*scws-content\.net[^\"']*\.mp4[^\"']*)[\"']",
@@ -270,53 +1077,194 @@ def extract_mp4_from_vixcloud(embed_url):
         print(f"⚠️ Errore estrazione VixCloud: {e}", file=sys.stderr)
         return None
 
-def get_stream(anime_id, anime_slug, episode_id):
-    """
-    Estrae sia embed URL che MP4 link
-    Restituisce un dizionario con entrambi i link
-    """
-    # Ottieni contenuto pagina episodio
-    page_content = get_video_page_content(anime_id, anime_slug, episode_id)
-    if not page_content:
-        return {"embed_url": None, "mp4_url": None, "episode_page": None}
-
-    episode_page_url = f"{BASE_URL}/anime/{anime_id}-{anime_slug}/{episode_id}"
+def _normalize_embed_url(embed_url):
+    # Normalizza URL se necessario
+    if embed_url.startswith("//"):
+        return "https:" + embed_url
+    if embed_url.startswith("/"):
+        return urljoin(BASE_URL, embed_url)
+    return embed_url
 
-    # Cerca embed URL di VixCloud
+def find_embed_url(page_content):
+    """Cerca l'embed URL VixCloud nel testo completo della pagina episodio (BeautifulSoup)"""
     soup = BeautifulSoup(page_content, "html.parser")
-    embed_url = None
 
     # Cerca video-player tag con embed_url
     video_player = soup.select_one("video-player")
     if video_player and video_player.get("embed_url"):
-        embed_url = video_player["embed_url"]
-
-        # Normalizza URL se necessario
-        if embed_url.startswith("//"):
-            embed_url = "https:" + embed_url
-        elif embed_url.startswith("/"):
-            embed_url = urljoin(BASE_URL, embed_url)
+        return _normalize_embed_url(video_player["embed_url"])
 
     # Fallback: cerca iframe VixCloud
-    if not embed_url:
-        iframe_match = re.search(r'<iframe[^>]+src="([^"]*vixcloud[^"]+)"', page_content)
-        if iframe_match:
-            embed_url = iframe_match.group(1)
-            if embed_url.startswith("//"):
-                embed_url = "https:" + embed_url
-            elif embed_url.startswith("/"):
-                embed_url = urljoin(BASE_URL, embed_url)
+    iframe_match = re.search(r'<iframe[^>]+src="([^"]*vixcloud[^"]+)"', page_content)
+    if iframe_match:
+        return _normalize_embed_url(iframe_match.group(1))
+    return None
+
+def get_embed_url(anime_id, anime_slug, episode_id, parse_pool=None):
+    """
+    Legge la pagina episodio in streaming e si ferma al tag <video-player> con embed_url.
+    Se il tag non c'è passa al parsing completo. Restituisce (embed_url, pagina caricata).
+    """
+    import html
+
+    episode_url = f"{BASE_URL}/anime/{anime_id}-{anime_slug}/{episode_id}"
+    try:
+        with get_http_session().get(episode_url, headers=HEADERS, timeout=TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            match, content = scan_response(response, VIDEO_PLAYER_EMBED_RE)
+            if match:
+                return _normalize_embed_url(html.unescape(match.group(1).decode("utf-8", errors="replace"))), True
+            return _parse(parse_pool, find_embed_url, _decode(response, content)), True
+    except Exception as e:
+        print(f"⚠️ Errore caricamento pagina episodio: {e}", file=sys.stderr)
+        return None, False
+
+def parse_expires(url):
+    """Scadenza (epoch, secondi) dal parametro expires= di un link VixCloud, se presente"""
+    from urllib.parse import parse_qs
+
+    values = parse_qs(urlparse(url or "").query).get("expires") or []
+    return int(values[0]) if values and values[0].isdigit() else None
+
+class StreamCache(ExpiringCache):
+    """
+    Cache LRU dei risultati di get_stream, indicizzata per (anime_id, episode_id).
+    Ogni voce vale fino alla scadenza dell'mp4_url meno un margine; il tier su
+    disco è condiviso tra i processi lanciati dall'addon.
+    """
+    def __init__(self, max_size=STREAM_CACHE_SIZE, margin=STREAM_CACHE_MARGIN,
+                 default_ttl=STREAM_CACHE_TTL, disk_path=STREAM_CACHE_PATH):
+        super().__init__(max_size, disk_path)
+        self.margin = margin
+        self.default_ttl = default_ttl
+
+    @staticmethod
+    def key(anime_id, episode_id):
+        return f"{anime_id}:{episode_id}"
+
+    def get(self, anime_id, episode_id):
+        return self.lookup(self.key(anime_id, episode_id))
+
+    def put(self, anime_id, episode_id, result):
+        """Salva solo risultati completi (con mp4_url) e non ancora scaduti"""
+        if not result.get("mp4_url"):
+            return
+        declared = parse_expires(result["mp4_url"])
+        expires = declared - self.margin if declared else time.time() + self.default_ttl
+        try:
+            self.store(self.key(anime_id, episode_id), result, expires)
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare la cache stream: {e}", file=sys.stderr)
+
+stream_cache = StreamCache()
+
+def get_stream(anime_id, anime_slug, episode_id, use_cache=True, parse_pool=None):
+    """
+    Estrae sia embed URL che MP4 link
+    Restituisce un dizionario con entrambi i link
+    """
+    cached = stream_cache.get(anime_id, episode_id) if use_cache else None
+    if cached:
+        print(f"Debug: Stream di {anime_id}/{episode_id} dalla cache", file=sys.stderr)
+        return cached
+
+    # Cerca embed URL di VixCloud nella pagina episodio
+    embed_url, page_loaded = get_embed_url(anime_id, anime_slug, episode_id, parse_pool)
+    if not page_loaded:
+        return {"embed_url": None, "mp4_url": None, "episode_page": None}
+
+    episode_page_url = f"{BASE_URL}/anime/{anime_id}-{anime_slug}/{episode_id}"
 
     # Estrai MP4 dall'embed URL (se trovato)
     mp4_url = None
     if embed_url:
-        mp4_url = extract_mp4_from_vixcloud(embed_url)
+        mp4_url = extract_mp4_from_vixcloud(embed_url, parse_pool)
 
-    return {
+    result = {
         "episode_page": episode_page_url,
         "embed_url": embed_url,
         "mp4_url": mp4_url
     }
+    stream_cache.put(anime_id, episode_id, result)
+    return result
+
+def parse_episode_selection(spec):
+    """
+    Numeri di episodio da una selezione tipo "1-12,15,20-22" (ordine mantenuto, senza doppioni).
+    Solleva argparse.ArgumentTypeError se la selezione non è valida (usata come type= della CLI).
+    """
+    numbers = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                first, last = (int(x) for x in part.split("-", 1))
+                values = range(first, last + 1)
+            else:
+                values = [int(part)]
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"selezione episodi non valida: '{part}' (es. 1-12,15)")
+        numbers.extend(n for n in values if n not in numbers)
+    if not numbers:
+        raise argparse.ArgumentTypeError(f"selezione episodi vuota: '{spec}'")
+    return numbers
+
+def _episode_number(episode):
+    try:
+        return float(episode.get("number"))
+    except (TypeError, ValueError):
+        return None
+
+def get_streams(anime_id, anime_slug, episode_ids=None, numbers=None, workers=STREAMS_WORKERS, out=None):
+    """
+    Risolve più episodi con concorrenza limitata sulla sessione condivisa, scrivendo
+    una riga JSON per episodio appena è pronto (non in ordine). Gli episodi si indicano
+    per id o per numero (mappato tramite la lista episodi); un errore su un episodio
+    produce una riga con "error" senza interrompere gli altri. Restituisce gli errori.
+    """
+    import multiprocessing
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+    out = out or sys.stdout
+    targets = [{"episode_id": episode_id} for episode_id in episode_ids or []]
+    if numbers:
+        by_number = {}
+        for episode in get_episodes_list(anime_id):
+            by_number.setdefault(_episode_number(episode), episode)
+        for number in numbers:
+            episode = by_number.get(float(number))
+            targets.append({"episode_id": episode.get("id") if episode else None, "number": number})
+
+    def resolve(target):
+        if target["episode_id"] is None:
+            return {**target, "error": "episodio non trovato"}
+        try:
+            result = get_stream(anime_id, anime_slug, target["episode_id"], parse_pool=parse_pool)
+        except Exception as e:
+            return {**target, "error": str(e)}
+        if not result.get("mp4_url"):
+            return {**target, **result, "error": "link MP4 non trovato"}
+        return {**target, **result}
+
+    failures = 0
+    parse_pool = None
+    if PARSE_WORKERS > 1 and len(targets) > 1:
+        # Contesto spawn: un fork con altri thread attivi (pool HTTP, lock di requests/urllib3)
+        # può ereditare lock già presi e bloccarsi
+        parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(targets) or 1))) as pool:
+            for future in as_completed([pool.submit(resolve, target) for target in targets]):
+                line = future.result()
+                failures += 1 if "error" in line else 0
+                out.write(json.dumps(line) + "\n")
+                out.flush()
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+    return failures
 
 def main():
     parser = argparse.ArgumentParser(description="AnimeUnity Scraper CLI")
@@ -324,8 +1272,10 @@ def main():
 
     # Search command
     search_parser = subparsers.add_parser("search", help="Search for an anime")
-    search_parser.add_argument("--query", required=True, help="Anime title to search for")
+    search_parser.add_argument("--query", help="Anime title to search for")
     search_parser.add_argument("--dubbed", action="store_true", help="Search for dubbed version")
+    search_parser.add_argument("--mal-id", type=int, help="Look up by MyAnimeList ID in the local catalog")
+    search_parser.add_argument("--anilist-id", type=int, help="Look up by AniList ID in the local catalog")
 
     # Get episodes command
     episodes_parser = subparsers.add_parser("get_episodes", help="Get episode list for an anime")
@@ -337,6 +1287,22 @@ def main():
     stream_parser.add_argument("--anime-slug", required=True, help="Anime slug")
     stream_parser.add_argument("--episode-id", required=True, help="Episode ID")
 
+    # Get streams command (JSON lines, uno per episodio)
+    streams_parser = subparsers.add_parser("get_streams", help="Get stream URLs for several episodes (JSON lines)")
+    streams_parser.add_argument("--anime-id", required=True, help="AnimeUnity ID of the anime")
+    streams_parser.add_argument("--anime-slug", required=True, help="Anime slug")
+    selection = streams_parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument("--episodes", type=parse_episode_selection, help="Episode numbers, e.g. 1-12,15")
+    selection.add_argument("--episode-ids", help="Comma-separated episode IDs")
+    streams_parser.add_argument("--workers", type=int, default=STREAMS_WORKERS, help="Episodes resolved concurrently")
+
+    # Crawl catalog command (catalogo locale per la ricerca)
+    crawl_parser = subparsers.add_parser("crawl_catalog", help="Build or refresh the local search catalog")
+    crawl_parser.add_argument("--full", action="store_true", help="Crawl the whole archive")
+    crawl_parser.add_argument("--incremental", action="store_true",
+                              help="Only fetch newly added anime, never a full crawl")
+    crawl_parser.add_argument("--release-lock", action="store_true", help=argparse.SUPPRESS)
+
     args = parser.parse_args()
     
     # Disable SSL warnings
@@ -344,7 +1310,14 @@ def main():
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
     if args.command == "search":
-        results = search_anime_with_fallback(args.query, args.dubbed)
+        if not (args.query or args.mal_id or args.anilist_id):
+            parser.error("search richiede --query, --mal-id o --anilist-id")
+        results = []
+        if args.mal_id or args.anilist_id:
+            results = lookup_external_id(args.mal_id, args.anilist_id, args.dubbed)
+        # Id non ancora nel catalogo: ricerca per titolo, se fornito
+        if not results and args.query:
+            results = search_anime_with_fallback(args.query, args.dubbed)
         print(json.dumps(results, indent=4))
     elif args.command == "get_episodes":
         results = get_episodes_list(args.anime_id)
@@ -352,6 +1325,23 @@ def main():
     elif args.command == "get_stream":
         results = get_stream(args.anime_id, args.anime_slug, args.episode_id)
         print(json.dumps(results, indent=4))
+    elif args.command == "get_streams":
+        episode_ids = [e.strip() for e in args.episode_ids.split(",") if e.strip()] if args.episode_ids else None
+        numbers = args.episodes
+        failures = get_streams(args.anime_id, args.anime_slug, episode_ids, numbers, workers=max(1, args.workers))
+        print(f"Debug: get_streams completato, {failures} episodi non risolti", file=sys.stderr)
+    elif args.command == "crawl_catalog":
+        new = crawl_catalog(full=args.full, incremental=args.incremental and not args.full)
+        if new is None:
+            print(json.dumps({"running": True}))
+            return
+        print(json.dumps({"new": new}))
+        # Solo dopo un crawl riuscito: se fallisce il lock resta e i tentativi si diradano
+        if args.release_lock:
+            try:
+                os.remove(CATALOG_DB_PATH + ".crawl")
+            except OSError:
+                pass
 
 if __name__ == "__main__":
     main()
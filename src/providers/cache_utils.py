@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+cache_utils.py
+Primitive di cache su disco condivise da vavoo_resolver.py, animeunity_scraper.py e
+animesaturn.py: lock tra processi, scrittura JSON atomica e cache a scadenza con
+tier su disco. Solo libreria standard, così gli script restano leggeri all'import.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # piattaforme senza flock (Windows)
+    fcntl = None
+
+class FileLock:
+    """
+    Lock esclusivo su file (flock) condiviso tra più processi.
+    Con blocking=False solleva BlockingIOError se un altro processo lo tiene già.
+    """
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self._fd = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._fd = open(self.path, "a+")
+        if fcntl:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._fd.close()
+                self._fd = None
+                raise
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._fd.close()
+        self._fd = None
+
+def write_json_atomic(path, data, durable=False, **dump_kwargs):
+    """
+    Scrive JSON su un file temporaneo e lo rinomina: i lettori non vedono mai file parziali.
+    Con durable il file viene anche sincronizzato su disco prima della rinomina.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    dump_kwargs.setdefault("ensure_ascii", False)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, **dump_kwargs)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class ExpiringCache:
+    """
+    Cache LRU in memoria con scadenza per voce e tier su disco opzionale (JSON),
+    condiviso tra i processi lanciati dall'addon.
+    Il disco viene scritto solo quando si salva una voce: una lettura non lo tocca.
+    Oltre max_size si scartano le voci che scadono prima, che sono anche quelle
+    che servirebbero per meno tempo.
+    """
+    def __init__(self, max_size, disk_path=None):
+        self.max_size = max_size
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _read_disk(self):
+        try:
+            with open(self.disk_path, encoding="utf-8") as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _store_memory(self, key, value, expires):
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def lookup(self, key):
+        """Valore ancora valido per key (memoria, poi disco), None se assente o scaduto."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0]
+            self._entries.pop(key, None)
+            if self.disk_path:
+                entry = self._read_disk().get(key)
+                if isinstance(entry, dict) and "value" in entry and entry.get("expires", 0) > now:
+                    self._store_memory(key, entry["value"], entry["expires"])
+                    self.stats["disk_hits"] += 1
+                    return entry["value"]
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, key, value, expires):
+        """Salva value fino a expires (epoch); le voci già scadute vengono ignorate."""
+        now = time.time()
+        if expires <= now:
+            return
+        with self._lock:
+            self._store_memory(key, value, expires)
+            self.stats["stores"] += 1
+            if not self.disk_path:
+                return
+            with FileLock(self.disk_path + ".lock"):
+                entries = {k: v for k, v in self._read_disk().items()
+                           if isinstance(v, dict) and "value" in v and v.get("expires", 0) > now}
+                entries[key] = {"value": value, "expires": expires}
+                if len(entries) > self.max_size:
+                    keep = sorted(entries, key=lambda k: entries[k]["expires"])[-self.max_size:]
+                    entries = {k: entries[k] for k in keep}
+                write_json_atomic(self.disk_path, entries)
+
+    def expires_at(self, key):
+        """Scadenza (epoch) della voce in memoria, None se assente."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry else None
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            if not self.disk_path:
+                return
+            with FileLock(self.disk_path + ".lock"):
+                entries = self._read_disk()
+                if entries.pop(key, None) is not None:
+                    write_json_atomic(self.disk_path, entries)
@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src", "providers"))
+
+# Le cache su disco dei moduli si leggono dall'ambiente all'import: mai quelle vere
+_CACHE_DIR = tempfile.mkdtemp(prefix="streamvix-tests-")
+for var in ("VAVOO_CACHE_DIR", "ANIMEUNITY_CACHE_DIR", "ANIMESATURN_CACHE_DIR"):
+    os.environ.setdefault(var, os.path.join(_CACHE_DIR, var.split("_")[0].lower()))
+os.environ.setdefault("ANIMESATURN_MAL_INDEX_AUTO_REFRESH", "0")
+os.environ.setdefault("ANIMEUNITY_CATALOG_AUTO_REFRESH", "0")
+
+
+class ChunkedResponse:
+    """Risposta finta: restituisce i blocchi dati così come sono, come requests con stream=True."""
+    encoding = "utf-8"
+    status_code = 200
+
+    def __init__(self, chunks):
+        self.chunks = [c.encode("utf-8") if isinstance(c, str) else c for c in chunks]
+
+    def iter_content(self, chunk_size=None):
+        yield from self.chunks
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@pytest.fixture
+def chunked_response():
+    return ChunkedResponse
@@ -0,0 +1,49 @@
+import animesaturn
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, **kwargs):
+        return self.response
+
+
+def _read(monkeypatch, response, chunks):
+    monkeypatch.setattr(animesaturn, "get_http_session", lambda: FakeSession(response(chunks)))
+    return animesaturn.read_mal_id("https://www.animesaturn.test/anime/x")
+
+
+def test_read_mal_id_chunk_boundary_inside_id(monkeypatch, chunked_response):
+    page = '<html><body>' + 'x' * 500 + '<a class="btn" href="https://myanimelist.net/anime/12345/Naruto">MAL</a></body></html>'
+    cut = page.index("12345") + 2
+    assert _read(monkeypatch, chunked_response, [page[:cut], page[cut:]]) == "12345"
+
+
+def test_read_mal_id_boundary_right_after_id(monkeypatch, chunked_response):
+    page = '<a href="https://myanimelist.net/anime/20">MAL</a>'
+    cut = page.index("20") + 2
+    assert _read(monkeypatch, chunked_response, [page[:cut], page[cut:]]) == "20"
+
+
+def test_read_mal_id_missing(monkeypatch, chunked_response):
+    assert _read(monkeypatch, chunked_response, ["<html><body>nessun link</body></html>"]) is None
+
+
+def test_variants_settled_ignores_absent_variants():
+    items = [{"title": "Naruto"}, {"title": "Naruto (ITA)"}, {"title": "Boruto"}]
+    assert not animesaturn._variants_settled(items, {0: "20"}, "20")
+    assert animesaturn._variants_settled(items, {0: "20", 1: "20"}, "20")
+    # Versione normale decisa al primo match anche se una pagina successiva è in attesa
+    assert animesaturn._variants_settled(items[:2], {0: "20", 1: "7"}, "20")
+
+
+def test_find_mal_matches_returns_every_match(monkeypatch):
+    items = [{"title": "Naruto", "url": "https://h/anime/a"},
+             {"title": "Naruto Special", "url": "https://h/anime/b"},
+             {"title": "Naruto (ITA)", "url": "https://h/anime/c"}]
+    ids = {"https://h/anime/a": "20", "https://h/anime/b": "20", "https://h/anime/c": "20"}
+    monkeypatch.setattr(animesaturn, "read_mal_id", lambda url, cancel=None: ids[url])
+    assert [m["url"] for m in animesaturn.find_mal_matches(items, 20, "test")] == list(ids)
+    first = animesaturn.find_mal_matches(items, 20, "test", first_per_variant=True)
+    assert "https://h/anime/a" in [m["url"] for m in first]
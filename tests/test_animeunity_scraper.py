@@ -0,0 +1,140 @@
+import os
+import threading
+
+import pytest
+
+import animeunity_scraper
+from cache_utils import FileLock
+
+
+EMBED_PAGE = ('<html><body>' + 'x' * 5000 +
+              '<video-player anime="{}" embed_url="https://vixcloud.test/embed/42?token=abc"></video-player>'
+              '</body></html>')
+MP4_PAGE = ('<html><body><script>var a = 1;</script>' + 'y' * 5000 +
+            '<script>window.src_mp4 = "https://cdn.test/ep1.mp4?e=1"; var file = "https://cdn.test/ep2.mp4";</script>'
+            '</body></html>')
+
+
+@pytest.mark.parametrize("cut", range(5000, 5110, 7))
+def test_scan_response_embed_split_across_chunks(chunked_response, cut):
+    match, _ = animeunity_scraper.scan_response(
+        chunked_response([EMBED_PAGE[:cut], EMBED_PAGE[cut:]]), animeunity_scraper.VIDEO_PLAYER_EMBED_RE)
+    assert match.group(1) == b"https://vixcloud.test/embed/42?token=abc"
+
+
+@pytest.mark.parametrize("cut", range(5030, 5140, 7))
+def test_scan_response_mp4_split_across_chunks(chunked_response, cut):
+    match, _ = animeunity_scraper.scan_response(
+        chunked_response([MP4_PAGE[:cut], MP4_PAGE[cut:]]), animeunity_scraper.MP4_URL_RE,
+        animeunity_scraper._is_direct_mp4)
+    assert animeunity_scraper._mp4_from_match(match) == "https://cdn.test/ep1.mp4?e=1"
+
+
+def test_scan_response_without_match_returns_whole_page(chunked_response):
+    chunks = ["<html>", "x" * 20000, "</html>"]
+    match, content = animeunity_scraper.scan_response(chunked_response(chunks), animeunity_scraper.MP4_URL_RE)
+    assert match is None
+    assert content == "".join(chunks).encode("utf-8")
+
+
+@pytest.fixture
+def spawned(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr(animeunity_scraper, "CATALOG_DB_PATH", str(tmp_path / "catalog.sqlite3"))
+    monkeypatch.setattr(animeunity_scraper, "CATALOG_AUTO_REFRESH", "1")
+    monkeypatch.setattr("subprocess.Popen", lambda command, **kwargs: calls.append(command))
+    return calls
+
+
+def test_spawn_catalog_refresh_starts_one_incremental_crawl(spawned):
+    barrier = threading.Barrier(8)
+
+    def search():
+        barrier.wait()
+        animeunity_scraper._spawn_catalog_refresh()
+
+    threads = [threading.Thread(target=search) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(spawned) == 1
+    assert "--incremental" in spawned[0]
+
+
+def test_spawn_catalog_refresh_retries_stale_marker(spawned):
+    marker = animeunity_scraper.CATALOG_DB_PATH + ".crawl"
+    open(marker, "w").close()
+    animeunity_scraper._spawn_catalog_refresh()
+    assert spawned == []
+    os.utime(marker, (0, 0))
+    animeunity_scraper._spawn_catalog_refresh()
+    assert len(spawned) == 1
+
+
+def test_spawn_catalog_refresh_skips_running_crawl(spawned):
+    with FileLock(animeunity_scraper.CATALOG_DB_PATH + ".running"):
+        animeunity_scraper._spawn_catalog_refresh()
+    assert spawned == []
+    assert not os.path.exists(animeunity_scraper.CATALOG_DB_PATH + ".crawl")
+
+
+def test_crawl_catalog_single_run(spawned):
+    with FileLock(animeunity_scraper.CATALOG_DB_PATH + ".running"):
+        assert animeunity_scraper.crawl_catalog() is None
+
+
+def test_incremental_crawl_never_crawls_empty_catalog(spawned, monkeypatch):
+    monkeypatch.setattr(animeunity_scraper, "_fetch_archive_page",
+                        lambda *args: pytest.fail("nessuna pagina va scaricata"))
+    assert animeunity_scraper.crawl_catalog(incremental=True) == 0
+
+
+def _http_cache(tmp_path, max_bytes):
+    cache = animeunity_scraper.HttpCache(directory=str(tmp_path), max_bytes=max_bytes)
+    for name, mtime in (("old", 100), ("recent", 300), ("middle", 200)):
+        path = tmp_path / f"{name}.json"
+        path.write_text("x" * 100)
+        os.utime(path, (0, mtime))  # atime fermo, come con noatime
+    return cache
+
+
+def test_http_cache_evicts_by_mtime(tmp_path):
+    cache = _http_cache(tmp_path, max_bytes=200)
+    cache._evict()
+    assert sorted(p.name for p in tmp_path.glob("*.json")) == ["middle.json", "recent.json"]
+
+
+def test_http_cache_sweeps_only_periodically(tmp_path, monkeypatch):
+    cache = _http_cache(tmp_path, max_bytes=0)
+    sweeps = []
+    monkeypatch.setattr(cache, "_evict", lambda: sweeps.append(1))
+    monkeypatch.setattr(animeunity_scraper, "HTTP_CACHE_EVICT_EVERY", 3)
+    for _ in range(5):
+        cache._maybe_evict()
+    # La prima scrittura trova il marcatore assente, poi solo ogni 3 scritture
+    assert len(sweeps) == 2
+
+
+def test_fetch_session_tokens_keeps_shared_cookies(monkeypatch, chunked_response):
+    import requests
+
+    shared = requests.Session()
+    shared.cookies.set("in_flight", "1")
+    monkeypatch.setattr(animeunity_scraper, "get_http_session", lambda: shared)
+
+    def fake_get(session, url, **kwargs):
+        assert session is not shared
+        session.cookies.set("laravel_session", "nuova")
+        return chunked_response(['<head><meta name="csrf-token" content="tok"></head>'])
+
+    monkeypatch.setattr(requests.Session, "get", fake_get)
+    assert animeunity_scraper._fetch_session_tokens() == ("tok", {"laravel_session": "nuova"})
+    assert shared.cookies.get("in_flight") == "1"
+
+
+def test_search_variants_keep_dubbed():
+    variants = animeunity_scraper.search_variants("JoJo's Bizarre Adventure (2012) Stardust", dubbed=True)
+    assert variants[0] == ("JoJo's Bizarre Adventure (2012) Stardust", True)
+    assert ("JoJos Bizarre Adventure (2012) Stardust", True) in variants
+    assert all(dubbed for _, dubbed in variants)
@@ -0,0 +1,76 @@
+import json
+import os
+import time
+
+import pytest
+
+from cache_utils import ExpiringCache, FileLock, write_json_atomic
+
+
+def test_memory_lru_eviction():
+    cache = ExpiringCache(max_size=2)
+    expires = time.time() + 60
+    cache.store("a", 1, expires)
+    cache.store("b", 2, expires)
+    assert cache.lookup("a") == 1
+    cache.store("c", 3, expires)
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") == 1
+    assert cache.stats["evictions"] == 1
+
+
+def test_expired_entries(monkeypatch):
+    cache = ExpiringCache(max_size=4)
+    cache.store("old", 1, time.time() - 1)
+    assert cache.lookup("old") is None
+    cache.store("soon", 2, time.time() + 10)
+    real_time = time.time
+    monkeypatch.setattr(time, "time", lambda: real_time() + 20)
+    assert cache.lookup("soon") is None
+
+
+def test_disk_tier_shared_and_read_only_on_hit(tmp_path):
+    path = str(tmp_path / "streams.json")
+    ExpiringCache(max_size=4, disk_path=path).store("a", {"url": "x"}, time.time() + 60)
+    before = os.stat(path).st_mtime_ns
+    other = ExpiringCache(max_size=4, disk_path=path)
+    assert other.lookup("a") == {"url": "x"}
+    assert other.stats["disk_hits"] == 1
+    assert os.stat(path).st_mtime_ns == before
+
+
+def test_disk_eviction_drops_soonest_expiry(tmp_path):
+    path = str(tmp_path / "streams.json")
+    cache = ExpiringCache(max_size=2, disk_path=path)
+    now = time.time()
+    cache.store("late", 1, now + 300)
+    cache.store("early", 2, now + 100)
+    cache.store("mid", 3, now + 200)
+    with open(path, encoding="utf-8") as f:
+        assert sorted(json.load(f)) == ["late", "mid"]
+
+
+def test_invalidate_removes_from_disk(tmp_path):
+    path = str(tmp_path / "streams.json")
+    cache = ExpiringCache(max_size=2, disk_path=path)
+    cache.store("a", 1, time.time() + 60)
+    cache.invalidate("a")
+    assert ExpiringCache(max_size=2, disk_path=path).lookup("a") is None
+
+
+def test_file_lock_non_blocking(tmp_path):
+    path = str(tmp_path / "x.lock")
+    with FileLock(path):
+        with pytest.raises(BlockingIOError):
+            with FileLock(path, blocking=False):
+                pass
+    with FileLock(path, blocking=False):
+        pass
+
+
+def test_write_json_atomic_leaves_no_temp(tmp_path):
+    path = str(tmp_path / "sub" / "data.json")
+    write_json_atomic(path, {"è": 1}, durable=True)
+    assert os.listdir(tmp_path / "sub") == ["data.json"]
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"è": 1}
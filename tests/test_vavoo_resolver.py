@@ -0,0 +1,187 @@
+import json
+import os
+import random
+
+import pytest
+
+import vavoo_resolver as vr
+
+
+def test_breaker_opens_after_threshold_and_is_shared(tmp_path):
+    path = str(tmp_path / "upstream.json")
+    monitor = vr.UpstreamMonitor(path=path)
+    for _ in range(vr.BREAKER_THRESHOLD):
+        monitor.record_failure()
+    assert monitor.is_open()
+    assert vr.UpstreamMonitor(path=path).is_open()
+
+
+def test_success_closes_breaker_immediately(tmp_path):
+    path = str(tmp_path / "upstream.json")
+    monitor = vr.UpstreamMonitor(path=path, batch=1000)
+    for _ in range(vr.BREAKER_THRESHOLD):
+        monitor.record_failure()
+    monitor.record_success(0.2)
+    with open(path, encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["failures"] == 0 and state["open_until"] == 0.0
+    assert not vr.UpstreamMonitor(path=path).is_open()
+
+
+def test_latencies_are_batched(tmp_path, monkeypatch):
+    monkeypatch.setattr(random, "random", lambda: 0.99)
+    path = str(tmp_path / "upstream.json")
+    monitor = vr.UpstreamMonitor(path=path, batch=3)
+    monitor.record_success(0.1)
+    monitor.record_success(0.2)
+    assert not os.path.exists(path)
+    monitor.record_success(0.3)
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["latencies"] == [0.1, 0.2, 0.3]
+
+
+def test_popularity_appends_and_compacts(monkeypatch, tmp_path):
+    path = str(tmp_path / "popularity.jsonl")
+    monkeypatch.setattr(vr, "POPULARITY_PATH", path)
+    monkeypatch.setattr(vr, "POPULARITY_COMPACT_LINES", 3)
+    for name in ("RAI 1", "RAI 1", "CANALE 5", "RAI 1"):
+        vr.record_request(name)
+    assert vr.load_popularity() == {"RAI 1": 3, "CANALE 5": 1}
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+    assert vr.load_popularity() == {"RAI 1": 3, "CANALE 5": 1}
+
+
+def test_original_link_is_the_found_channel(monkeypatch):
+    channels = [{"name": "RAI 1 .a", "url": "https://vavoo.to/play/a/index.m3u8"},
+                {"name": "RAI 1 .b", "url": "https://vavoo.to/play/b/index.m3u8"}]
+    monkeypatch.setattr(vr, "load_health", lambda: {channels[0]["url"]: {"ok": True, "ttfb_ms": 10, "checked": 9e18}})
+    variant, link = vr.resolve_best_variant(channels[1], channels, return_original_link=True)
+    assert variant is channels[1] and link == channels[1]["url"]
+
+
+def test_compact_cache_round_trip(tmp_path):
+    path = str(tmp_path / "vavoo_cache.idx")
+    vr.write_compact_cache({"RAI 1": "https://vavoo.to/play/1", "CANALE 5": "https://vavoo.to/play/5"}, path)
+    with vr.CompactCatalog(path) as compact:
+        assert compact.get("RAI 1") == "https://vavoo.to/play/1"
+        assert compact.get("ITALIA 1") is None
+
+
+@pytest.fixture
+def cache_paths(monkeypatch, tmp_path):
+    for name, file in (("VAVOO_CACHE_PATH", "vavoo_cache.json"), ("COMPACT_CACHE_PATH", "vavoo_cache.idx"),
+                       ("BUILD_CHECKPOINT_PATH", "vavoo_build_checkpoint.json"),
+                       ("MATCHES_PATH", "vavoo_matches.json"), ("MISS_REFETCH_PATH", "vavoo_catalog_refetch")):
+        monkeypatch.setattr(vr, name, str(tmp_path / file))
+    monkeypatch.setattr(vr, "_write_matches", lambda channels: None)
+    return tmp_path
+
+
+def _channels(n):
+    return [{"name": f"CH {i}", "url": f"https://vavoo.to/play/{i}/index.m3u8"} for i in range(n)]
+
+
+def test_update_unchanged_only_touches_mtime(cache_paths):
+    assert vr.update_vavoo_cache(_channels(10)) == "updated"
+    with open(vr.VAVOO_CACHE_PATH, "rb") as f:
+        before = f.read()
+    os.utime(vr.VAVOO_CACHE_PATH, (0, 0))
+    assert vr.update_vavoo_cache(_channels(10)) == "unchanged"
+    with open(vr.VAVOO_CACHE_PATH, "rb") as f:
+        assert f.read() == before
+    assert os.path.getmtime(vr.VAVOO_CACHE_PATH) > 0
+
+
+def test_shrunk_catalog_accepted_after_repeated_rejects(cache_paths, monkeypatch):
+    monkeypatch.setattr(vr, "CACHE_MAX_REJECTS", 3)
+    vr.update_vavoo_cache(_channels(10))
+    os.utime(vr.VAVOO_CACHE_PATH, (0, 0))
+    assert vr.update_vavoo_cache(_channels(3)) == "rejected"
+    assert os.path.getmtime(vr.VAVOO_CACHE_PATH) > 0
+    assert vr.update_vavoo_cache(_channels(3)) == "rejected"
+    assert vr.update_vavoo_cache(_channels(3)) == "updated"
+    data = vr.read_vavoo_cache()
+    assert data["count"] == 3 and "rejects" not in data
+
+
+def test_force_accepts_shrunk_catalog(cache_paths):
+    vr.update_vavoo_cache(_channels(10))
+    assert vr.update_vavoo_cache(_channels(3), force=True) == "updated"
+
+
+def test_build_cache_resumes_from_checkpoint(cache_paths, monkeypatch):
+    pages = {"A": [_channels(4)[:2], _channels(4)[2:]]}
+    calls = []
+
+    def fetch_catalog(state=None, on_page=None):
+        state = state or {}
+        channels = []
+        for group, group_pages in pages.items():
+            done = state.get(group, {}).get("items", [])
+            channels += done
+            for index in range(len(done) // 2, len(group_pages)):
+                calls.append(index)
+                if index == 1 and len(calls) == 2:
+                    return channels, False
+                channels += group_pages[index]
+                on_page(group, group_pages[index], {"cursor": index + 1, "done": index == len(group_pages) - 1})
+        return channels, True
+
+    monkeypatch.setattr(vr, "fetch_catalog", fetch_catalog)
+    assert vr.build_cache_file() == "incomplete"
+    # Riga troncata da un processo interrotto durante la scrittura
+    with open(vr.BUILD_CHECKPOINT_PATH, "a", encoding="utf-8") as f:
+        f.write('{"group": "A", "ite')
+    assert vr.build_cache_file() == "updated"
+    assert calls == [0, 1, 1]
+    assert vr.read_vavoo_cache()["count"] == 4
+    assert not os.path.exists(vr.BUILD_CHECKPOINT_PATH)
+
+
+def test_build_cache_single_run(cache_paths):
+    with vr.FileLock(vr.BUILD_CHECKPOINT_PATH + ".lock"):
+        assert vr.build_cache_file() == "running"
+
+
+@pytest.mark.parametrize("argv", [["--batch", "--workers", "molti"], ["--batch", "--workers", "0"], ["--batch", "--workers"]])
+def test_main_rejects_bad_workers(argv, capsys):
+    assert vr.main(argv) == 1
+    err = capsys.readouterr().err
+    assert "--workers richiede un intero positivo" in err
+    assert "Usage:" in err
+
+
+def test_lookup_miss_refetches_at_most_once_per_interval(cache_paths, monkeypatch):
+    assert vr.update_vavoo_cache(_channels(10)) == "updated"
+    fetches = []
+    monkeypatch.setattr(vr, "fetch_catalog", lambda: fetches.append(1) or (_channels(10), True))
+    for _ in range(3):
+        # Ogni giro è un nuovo processo CLI: stato in memoria vuoto
+        monkeypatch.setattr(vr, "_catalog", {"channels": None, "loaded": False, "fetched": False, "mtime": None})
+        found, channels = vr.lookup_channel("Canale Inesistente")
+        assert found is None and len(channels) == 10
+    assert len(fetches) == 1
+    os.utime(vr.MISS_REFETCH_PATH, (0, 0))
+    monkeypatch.setattr(vr, "_catalog", {"channels": None, "loaded": False, "fetched": False, "mtime": None})
+    vr.lookup_channel("Canale Inesistente")
+    assert len(fetches) == 2
+
+
+def test_stream_cache_expiry_from_url_and_lru(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(vr.time, "time", lambda: now)
+    cache = vr.StreamCache(max_size=2, default_ttl=600, margin=60, disk_path=None)
+    cache.put("a", f"https://cdn.test/a.m3u8?expires={int(now) + 300}")
+    cache.put("b", "https://cdn.test/b.m3u8")
+    assert cache.expires_at("a") == now + 240
+    assert cache.expires_at("b") == now + 600
+    # Scadenza più vicina del margine: non vale la pena salvarla
+    cache.put("c", f"https://cdn.test/c.m3u8?expires={int(now) + 30}")
+    assert cache.get("c") is None
+    cache.get("a")
+    cache.put("d", "https://cdn.test/d.m3u8")
+    assert cache.get("b") is None and cache.get("a") is not None
+    now += 241
+    assert cache.get("a") is None
+    assert cache.get("d") == "https://cdn.test/d.m3u8"
@@ -4,16 +4,420 @@
 vavoo_resolver.py
 Script unico: dato il nome del canale, trova il link Vavoo e lo risolve in tempo reale.
 """
+# Solo moduli standard leggeri a livello di modulo: requests e la configurazione
+# vengono caricati al primo uso, così l'import è rapido e senza effetti collaterali
 import sys
-import requests
 import json
 import os
 import re
+import time
+import threading
 
-with open(os.path.join(os.path.dirname(__file__), 'config/domains.json'), encoding='utf-8') as f:
-    DOMAINS = json.load(f)
+# Lock, scrittura atomica e cache a scadenza condivisi con i provider anime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "providers"))
+from cache_utils import ExpiringCache, FileLock, write_json_atomic  # noqa: E402
 
-VAVOO_DOMAIN = DOMAINS.get("vavoo")
+DOMAINS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config/domains.json')
+_domains = None
+
+def get_domains():
+    """Legge config/domains.json al primo utilizzo."""
+    global _domains
+    if _domains is None:
+        with open(DOMAINS_PATH, encoding='utf-8') as f:
+            _domains = json.load(f)
+    return _domains
+
+def get_vavoo_domain():
+    return get_domains().get("vavoo")
+
+def get_vavoo_base_url():
+    """Base URL delle API mediahubmx; VAVOO_BASE_URL la sostituisce (es. server mock locale)."""
+    return os.environ.get("VAVOO_BASE_URL") or f"https://{get_vavoo_domain()}"
+
+def get_ping_url():
+    # Usa sempre il dominio ufficiale per la signature, salvo override esplicito
+    return os.environ.get("VAVOO_PING_URL") or "https://www.vavoo.tv/api/app/ping"
+
+def __getattr__(name):
+    # Compatibilità con chi legge DOMAINS / VAVOO_DOMAIN come attributi del modulo
+    if name == "DOMAINS":
+        return get_domains()
+    if name == "VAVOO_DOMAIN":
+        return get_vavoo_domain()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Directory condivisa con addon.ts (../cache rispetto a dist/)
+CACHE_DIR = os.environ.get("VAVOO_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+SIGNATURE_CACHE_PATH = os.path.join(CACHE_DIR, "vavoo_signature.json")
+VAVOO_CACHE_PATH = os.path.join(CACHE_DIR, "vavoo_cache.json")
+COMPACT_CACHE_PATH = os.path.join(CACHE_DIR, "vavoo_cache.idx")
+# Età massima del catalogo locale prima di tornare in rete (come CACHE_MAX_AGE in addon.ts)
+CATALOG_MAX_AGE = int(os.environ.get("VAVOO_CATALOG_MAX_AGE", str(12 * 60 * 60)))
+# Canale assente dal catalogo locale: al più un nuovo download ogni MISS_REFETCH_INTERVAL
+# secondi tra tutti i processi (la data dell'ultimo download è la mtime di MISS_REFETCH_PATH)
+MISS_REFETCH_PATH = os.path.join(CACHE_DIR, "vavoo_catalog_refetch")
+MISS_REFETCH_INTERVAL = int(os.environ.get("VAVOO_MISS_REFETCH_INTERVAL", "300"))
+# --build-cache: checkpoint della paginazione e soglia sotto cui il nuovo catalogo
+# (rispetto al precedente) è considerato incompleto e scartato
+BUILD_CHECKPOINT_PATH = os.path.join(CACHE_DIR, "vavoo_build_checkpoint.json")
+BUILD_CHECKPOINT_MAX_AGE = int(os.environ.get("VAVOO_BUILD_CHECKPOINT_MAX_AGE", "3600"))
+CACHE_MIN_RATIO = float(os.environ.get("VAVOO_CACHE_MIN_RATIO", "0.5"))
+# Dopo tanti rifiuti consecutivi il catalogo più piccolo si accetta: il ridimensionamento è reale
+CACHE_MAX_REJECTS = int(os.environ.get("VAVOO_CACHE_MAX_REJECTS", "3"))
+# Validità della addonSig e finestra di refresh anticipato (secondi)
+SIGNATURE_TTL = int(os.environ.get("VAVOO_SIGNATURE_TTL", "900"))
+SIGNATURE_REFRESH_AHEAD = int(os.environ.get("VAVOO_SIGNATURE_REFRESH_AHEAD", "120"))
+# Connessioni keep-alive per host nella sessione condivisa e worker della modalità --batch
+HTTP_POOL_SIZE = int(os.environ.get("VAVOO_HTTP_POOL_SIZE", "16"))
+BATCH_WORKERS = int(os.environ.get("VAVOO_BATCH_WORKERS", "8"))
+# Richieste contemporanee massime verso lo stesso host
+HOST_CONCURRENCY = int(os.environ.get("VAVOO_HOST_CONCURRENCY", "8"))
+# Gruppi del catalogo (separati da virgola), regione e lingua inviate alle API
+CATALOG_GROUPS = [g.strip() for g in os.environ.get("VAVOO_GROUPS", "Italy").split(",") if g.strip()]
+VAVOO_REGION = os.environ.get("VAVOO_REGION", "AT")
+VAVOO_LANGUAGE = os.environ.get("VAVOO_LANGUAGE", "de")
+# Cache dei link risolti: durata di default (se l'URL non dichiara una scadenza),
+# margine di sicurezza, numero massimo di voci e tier su disco (0 per disattivarlo)
+STREAM_CACHE_TTL = int(os.environ.get("VAVOO_STREAM_CACHE_TTL", "300"))
+STREAM_CACHE_MARGIN = int(os.environ.get("VAVOO_STREAM_CACHE_MARGIN", "30"))
+STREAM_CACHE_SIZE = int(os.environ.get("VAVOO_STREAM_CACHE_SIZE", "256"))
+STREAM_CACHE_DISK = os.environ.get("VAVOO_STREAM_CACHE_DISK", "1") != "0"
+STREAM_CACHE_PATH = os.path.join(CACHE_DIR, "vavoo_streams.json")
+# Refresher del palinsesto: anticipo sulla scadenza, jitter, attesa dopo un errore
+TV_CHANNELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config/tv_channels.json")
+# Contatori di richieste in JSON Lines: una riga accodata per richiesta, compattata oltre POPULARITY_COMPACT_LINES
+POPULARITY_PATH = os.path.join(CACHE_DIR, "vavoo_popularity.jsonl")
+POPULARITY_COMPACT_LINES = int(os.environ.get("VAVOO_POPULARITY_COMPACT_LINES", "5000"))
+TRACK_POPULARITY = os.environ.get("VAVOO_TRACK_POPULARITY", "1") != "0"
+REFRESH_LEAD = int(os.environ.get("VAVOO_REFRESH_LEAD", "60"))
+REFRESH_JITTER = int(os.environ.get("VAVOO_REFRESH_JITTER", "15"))
+REFRESH_RETRY = int(os.environ.get("VAVOO_REFRESH_RETRY", "60"))
+# Tetto del backoff esponenziale per i canali che continuano a fallire
+REFRESH_MAX_BACKOFF = int(os.environ.get("VAVOO_REFRESH_MAX_BACKOFF", "1800"))
+REFRESH_WORKERS = int(os.environ.get("VAVOO_REFRESH_WORKERS", "4"))
+# Sonda delle varianti (.a/.b, HD/FHD): esiti salvati, validità, timeout e parallelismo
+HEALTH_PATH = os.path.join(CACHE_DIR, "vavoo_health.json")
+HEALTH_MAX_AGE = int(os.environ.get("VAVOO_HEALTH_MAX_AGE", "1800"))
+PROBE_TIMEOUT = float(os.environ.get("VAVOO_PROBE_TIMEOUT", "5"))
+PROBE_WORKERS = int(os.environ.get("VAVOO_PROBE_WORKERS", "8"))
+# Risoluzione: timeout massimo per tentativo e budget complessivo (sotto i 5 s di
+# execFile in addon.ts), ritardo minimo dell'hedge, soglia e pausa del circuit breaker
+RESOLVE_TIMEOUT = float(os.environ.get("VAVOO_RESOLVE_TIMEOUT", "10"))
+RESOLVE_BUDGET = float(os.environ.get("VAVOO_RESOLVE_BUDGET", "4.5"))
+HEDGE_MIN_DELAY = float(os.environ.get("VAVOO_HEDGE_MIN_DELAY", "0.25"))
+BREAKER_THRESHOLD = int(os.environ.get("VAVOO_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("VAVOO_BREAKER_COOLDOWN", "30"))
+UPSTREAM_STATE_PATH = os.path.join(CACHE_DIR, "vavoo_upstream.json")
+# Le latenze si salvano a gruppi di questa dimensione, o per un processo su tanti:
+# lo stato del breaker invece si scrive solo quando cambia
+UPSTREAM_LATENCY_BATCH = max(1, int(os.environ.get("VAVOO_UPSTREAM_LATENCY_BATCH", "10")))
+# Riconciliazione offline vavooNames -> catalogo: file prodotto con --build-cache,
+# punteggio minimo per usare un abbinamento e soglia sotto cui va rivisto
+MATCHES_PATH = os.path.join(CACHE_DIR, "vavoo_matches.json")
+MATCH_MIN_SCORE = float(os.environ.get("VAVOO_MATCH_MIN_SCORE", "0.75"))
+MATCH_REVIEW_SCORE = float(os.environ.get("VAVOO_MATCH_REVIEW_SCORE", "0.9"))
+
+_signature_lock = threading.Lock()
+_signature_cache = {"signature": None, "expires": 0.0}
+_signature_refreshing = False
+
+def _read_signature_file():
+    try:
+        with open(SIGNATURE_CACHE_PATH, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("signature") and float(data.get("expires", 0)) > time.time():
+            return data["signature"], float(data["expires"])
+    except (OSError, ValueError, TypeError):
+        pass
+    return None, 0.0
+
+def _write_signature_file(signature, expires):
+    try:
+        write_json_atomic(SIGNATURE_CACHE_PATH, {"signature": signature, "expires": expires})
+    except OSError as e:
+        print(f"[DEBUG] Impossibile salvare la signature su disco: {e}", file=sys.stderr)
+
+def _refresh_signature():
+    """Aggiorna la signature sotto lock su file: un solo processo fa il ping."""
+    with FileLock(SIGNATURE_CACHE_PATH + ".lock"):
+        # Un altro processo potrebbe averla già rinnovata mentre aspettavamo il lock
+        signature, expires = _read_signature_file()
+        if signature and expires - time.time() > SIGNATURE_REFRESH_AHEAD:
+            _signature_cache.update(signature=signature, expires=expires)
+            return signature
+        signature = getAuthSignature()
+        if signature:
+            expires = time.time() + SIGNATURE_TTL
+            _signature_cache.update(signature=signature, expires=expires)
+            _write_signature_file(signature, expires)
+        return signature
+
+def _refresh_signature_background():
+    global _signature_refreshing
+    try:
+        _refresh_signature()
+    except Exception as e:
+        print(f"[DEBUG] Refresh anticipato della signature fallito: {e}", file=sys.stderr)
+    finally:
+        _signature_refreshing = False
+
+def get_cached_signature():
+    """
+    Restituisce la addonSig dalla cache (memoria, poi disco) rinnovandola solo se scaduta.
+    Nella finestra di refresh anticipato restituisce quella valida e la rinnova in background.
+    """
+    global _signature_refreshing
+    with _signature_lock:
+        now = time.time()
+        if not _signature_cache["signature"] or _signature_cache["expires"] <= now:
+            signature, expires = _read_signature_file()
+            if signature:
+                _signature_cache.update(signature=signature, expires=expires)
+        signature = _signature_cache["signature"]
+        remaining = _signature_cache["expires"] - now
+        if not signature or remaining <= 0:
+            return _refresh_signature()
+        if remaining <= SIGNATURE_REFRESH_AHEAD and not _signature_refreshing:
+            _signature_refreshing = True
+            threading.Thread(target=_refresh_signature_background, daemon=True).start()
+        return signature
+
+def invalidate_signature(rejected):
+    """Scarta la signature rifiutata (401/403) da memoria e disco, se non è già stata sostituita."""
+    with _signature_lock:
+        if _signature_cache["signature"] == rejected:
+            _signature_cache.update(signature=None, expires=0.0)
+        with FileLock(SIGNATURE_CACHE_PATH + ".lock"):
+            signature, _ = _read_signature_file()
+            if signature == rejected:
+                try:
+                    os.remove(SIGNATURE_CACHE_PATH)
+                except OSError:
+                    pass
+
+def _is_auth_error(exc):
+    response = getattr(exc, "response", None)
+    return response is not None and response.status_code in (401, 403)
+
+_session_lock = threading.Lock()
+_session = None
+
+def get_http_session():
+    """Sessione requests condivisa (keep-alive e pool di connessioni) per tutte le chiamate."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+_host_slots = {}
+
+def _host_slot(url):
+    """Semaforo che limita le richieste contemporanee verso l'host dell'URL."""
+    from urllib.parse import urlsplit
+
+    host = urlsplit(url).netloc
+    with _session_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return _host_slots[host]
+
+def _post_signed(url, data, headers, timeout=10):
+    """
+    POST con header mediahubmx-signature dalla cache.
+    Su 401/403 invalida la signature e riprova una sola volta con una nuova.
+    """
+    signature = get_cached_signature()
+    if not signature:
+        return None
+    for attempt in range(2):
+        with _host_slot(url):
+            resp = get_http_session().post(url, json=data, headers={**headers, "mediahubmx-signature": signature}, timeout=timeout)
+        try:
+            resp.raise_for_status()
+            return resp
+        except Exception as e:
+            if attempt == 0 and _is_auth_error(e):
+                print(f"[DEBUG] Signature rifiutata ({resp.status_code}), la rinnovo", file=sys.stderr)
+                invalidate_signature(signature)
+                signature = get_cached_signature()
+                if signature:
+                    continue
+            raise
+
+class UpstreamError(Exception):
+    """Upstream non disponibile: circuito aperto o nessuna risposta entro il budget."""
+
+class UpstreamMonitor:
+    """
+    Latenze osservate e circuit breaker delle chiamate di risoluzione, condivisi tra
+    processi tramite un piccolo file JSON: ogni invocazione della CLI è un processo nuovo.
+    Dalle latenze derivano il ritardo dell'hedge (p90) e il timeout del tentativo (p99).
+    Il file si riscrive quando cambia lo stato del breaker; le latenze vi arrivano a
+    gruppi di UPSTREAM_LATENCY_BATCH, o con probabilità 1/UPSTREAM_LATENCY_BATCH per i
+    processi che ne osservano meno, così una risoluzione riuscita di solito non scrive.
+    """
+
+    WINDOW = 200
+
+    def __init__(self, path=UPSTREAM_STATE_PATH, batch=UPSTREAM_LATENCY_BATCH):
+        self.path = path
+        self.batch = batch
+        self._lock = threading.Lock()
+        self._state = None
+        self._pending = []
+
+    def _load(self):
+        if self._state is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+            self._state = {"latencies": state.get("latencies", [])[-self.WINDOW:],
+                           "failures": state.get("failures", 0),
+                           "open_until": state.get("open_until", 0.0)}
+        return self._state
+
+    def _save(self, update):
+        """Applica update(state) allo stato su disco (rileggendolo sotto lock) e in memoria."""
+        if not self.path:
+            update(self._load())
+            return
+        try:
+            with FileLock(self.path + ".lock"):
+                self._state = None
+                state = self._load()
+                update(state)
+                write_json_atomic(self.path, state)
+        except OSError as e:
+            update(self._load())
+            print(f"[DEBUG] Impossibile salvare lo stato upstream: {e}", file=sys.stderr)
+
+    def _percentile(self, pct, default):
+        latencies = sorted(self._load()["latencies"])
+        if len(latencies) < 10:
+            return default
+        return latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))]
+
+    def hedge_delay(self):
+        """Dopo quanto lanciare il secondo tentativo: p90 delle latenze osservate."""
+        with self._lock:
+            return max(HEDGE_MIN_DELAY, self._percentile(90, 1.0))
+
+    def attempt_timeout(self):
+        """Timeout del singolo tentativo: un multiplo del p99, mai oltre RESOLVE_TIMEOUT."""
+        with self._lock:
+            return min(RESOLVE_TIMEOUT, max(1.0, self._percentile(99, RESOLVE_TIMEOUT / 3) * 3))
+
+    def is_open(self):
+        with self._lock:
+            return self._load()["open_until"] > time.time()
+
+    def record_success(self, latency):
+        import random
+
+        pending = self._pending
+
+        def update(state):
+            state["latencies"] = (state["latencies"] + pending)[-self.WINDOW:]
+            state["failures"] = 0
+            state["open_until"] = 0.0
+        with self._lock:
+            state = self._load()
+            pending.append(round(latency, 3))
+            breaker_changed = state["failures"] or state["open_until"]
+            if breaker_changed or len(pending) >= self.batch or random.random() < 1 / self.batch:
+                self._save(update)
+                self._pending = []
+            else:
+                state["latencies"] = (state["latencies"] + [pending[-1]])[-self.WINDOW:]
+
+    def record_failure(self):
+        def update(state):
+            state["failures"] += 1
+            if state["failures"] >= BREAKER_THRESHOLD:
+                # Semi-aperto allo scadere: il primo tentativo successivo decide
+                state["open_until"] = time.time() + BREAKER_COOLDOWN
+        with self._lock:
+            self._save(update)
+            if self._state["open_until"] > time.time():
+                print(f"[DEBUG] Circuit breaker aperto per {BREAKER_COOLDOWN:.0f}s dopo {self._state['failures']} errori", file=sys.stderr)
+
+upstream_monitor = UpstreamMonitor()
+
+def _is_upstream_failure(exc):
+    """Errori che indicano upstream in difficoltà (rete, timeout, 5xx), non richieste sbagliate."""
+    response = getattr(exc, "response", None)
+    if response is not None:
+        return response.status_code >= 500 or response.status_code == 429
+    return True
+
+def _post_hedged(url, data, headers, budget=None):
+    """
+    POST firmata con hedging: se il primo tentativo non risponde entro il p90 osservato
+    ne parte un secondo e vince il primo che risponde; tutto entro il budget.
+    Con il circuito aperto fallisce subito con UpstreamError.
+    """
+    import queue
+
+    monitor = upstream_monitor
+    if monitor.is_open():
+        raise UpstreamError("circuit breaker aperto")
+    budget = RESOLVE_BUDGET if budget is None else budget
+    deadline = time.monotonic() + budget
+    timeout = min(monitor.attempt_timeout(), budget)
+    results = queue.Queue()
+
+    def attempt(n):
+        start = time.monotonic()
+        try:
+            results.put((n, _post_signed(url, data, headers, timeout=timeout), None, time.monotonic() - start))
+        except Exception as e:
+            results.put((n, None, e, time.monotonic() - start))
+
+    # Thread daemon: il tentativo perdente non deve trattenere l'uscita del processo
+    threading.Thread(target=attempt, args=(1,), daemon=True).start()
+    launched, pending, last_error = 1, 1, None
+    wait = monitor.hedge_delay()
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            n, resp, error, latency = results.get(timeout=min(wait, remaining) if launched < 2 else remaining)
+        except queue.Empty:
+            # Nessuna risposta entro il p90: parte l'hedge
+            print("[DEBUG] Risoluzione lenta, invio richiesta di hedge", file=sys.stderr)
+            threading.Thread(target=attempt, args=(2,), daemon=True).start()
+            launched, pending = 2, pending + 1
+            continue
+        pending -= 1
+        if error is None:
+            if resp is not None:
+                monitor.record_success(latency)
+                if n == 2:
+                    print(f"[DEBUG] Risposta dall'hedge in {latency * 1000:.0f} ms", file=sys.stderr)
+            return resp
+        last_error = error
+        if not _is_upstream_failure(error):
+            raise error
+        if launched < 2:
+            # Primo tentativo fallito prima della scadenza dell'hedge: riprova subito
+            threading.Thread(target=attempt, args=(2,), daemon=True).start()
+            launched, pending = 2, pending + 1
+    monitor.record_failure()
+    if last_error is not None:
+        raise UpstreamError(str(last_error)) from last_error
+    raise UpstreamError(f"nessuna risposta entro {budget:.1f}s")
 
 def getAuthSignature():
     """Funzione che replica esattamente quella dell'addon utils.py"""
@@ -84,62 +488,181 @@ def getAuthSignature():
     }
     try:
         # Usa sempre il dominio ufficiale per la signature!
-        resp = requests.post("https://www.vavoo.tv/api/app/ping", json=data, headers=headers, timeout=10)
+        resp = get_http_session().post(get_ping_url(), json=data, headers=headers, timeout=10)
         resp.raise_for_status()
         return resp.json().get("addonSig")
     except Exception as e:
         print(f"Errore nel recupero della signature: {e}", file=sys.stderr)
         return None
 
-def get_channels():
-    signature = getAuthSignature()
-    if not signature:
-        print("[DEBUG] Failed to get signature for channels", file=sys.stderr)
-        return []
-    
-    headers = {
-        "user-agent": "okhttp/4.11.0",
-        "accept": "application/json",
-        "content-type": "application/json; charset=utf-8",
-        "accept-encoding": "gzip",
-        "mediahubmx-signature": signature
+CATALOG_HEADERS = {
+    "user-agent": "okhttp/4.11.0",
+    "accept": "application/json",
+    "content-type": "application/json; charset=utf-8",
+    "accept-encoding": "gzip"
+}
+
+def _fetch_catalog_page(group, cursor):
+    data = {
+        "language": VAVOO_LANGUAGE,
+        "region": VAVOO_REGION,
+        "catalogId": "iptv",
+        "id": "iptv",
+        "adult": False,
+        "search": "",
+        "sort": "name",
+        "filter": {"group": group},
+        "cursor": cursor,
+        "clientVersion": "3.0.2"
     }
+    resp = _post_signed(f"{get_vavoo_base_url()}/mediahubmx-catalog.json", data, CATALOG_HEADERS)
+    if resp is None:
+        raise RuntimeError("signature non disponibile")
+    r = resp.json()
+    return r.get("items", []), r.get("nextCursor")
+
+def _fetch_group(group, state, state_lock, on_page, on_items=None):
+    """Scorre le pagine (nextCursor) di un gruppo; restituisce False se interrotto."""
+    progress = state[group]
+    while not progress["done"]:
+        try:
+            items, cursor = _fetch_catalog_page(group, progress["cursor"])
+        except Exception as e:
+            print(f"[DEBUG] Error getting channels ({group}): {e}", file=sys.stderr)
+            return False
+        # Lo stato è condiviso tra i gruppi: aggiornamento e checkpoint sotto lock
+        with state_lock:
+            progress["items"].extend(items)
+            progress["cursor"] = cursor
+            progress["done"] = not cursor
+            if on_page:
+                on_page(group, items, progress)
+            if on_items:
+                on_items(group, items)
+    return True
+
+def fetch_catalog(state=None, on_page=None, groups=None, on_items=None):
+    """
+    Scarica il catalogo dei gruppi indicati (default VAVOO_GROUPS) in parallelo
+    sulla sessione condivisa; le pagine di ogni gruppo restano sequenziali.
+    state ({gruppo: {"cursor", "items", "done"}}) permette di riprendere un
+    download interrotto; on_page(gruppo, canali, progresso) viene chiamata dopo ogni
+    pagina per salvare il checkpoint, on_items(gruppo, canali) riceve ogni pagina appena arriva.
+    Restituisce (canali deduplicati per URL, completo).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not get_cached_signature():
+        print("[DEBUG] Failed to get signature for channels", file=sys.stderr)
+        return [], False
+
+    groups = groups or CATALOG_GROUPS
+    state = state if state is not None else {}
+    for group in groups:
+        state.setdefault(group, {"cursor": 0, "items": [], "done": False})
+    state_lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(groups), HOST_CONCURRENCY))) as pool:
+        results = list(pool.map(lambda g: _fetch_group(g, state, state_lock, on_page, on_items), groups))
+
     all_channels = []
-    # Lista dei gruppi da controllare per i canali TV
-    groups = ["Italy"]
+    seen_urls = set()
     for group in groups:
-        cursor = 0
-        while True:
-            data = {
-                "language": "de",
-                "region": "AT",
-                "catalogId": "iptv",
-                "id": "iptv",
-                "adult": False,
-                "search": "",
-                "sort": "name",
-                "filter": {"group": group},
-                "cursor": cursor,
-                "clientVersion": "3.0.2"
-            }
-            try:
-                resp = requests.post(f"https://{VAVOO_DOMAIN}/mediahubmx-catalog.json", json=data, headers=headers, timeout=10)
-                resp.raise_for_status()
-                r = resp.json()
-                items = r.get("items", [])
-                all_channels.extend(items)
-                cursor = r.get("nextCursor")
-                if not cursor:
-                    break
-            except Exception as e:
-                print(f"[DEBUG] Error getting channels: {e}", file=sys.stderr)
-                break
-    return all_channels
+        for item in state[group]["items"]:
+            url = item.get("url")
+            if url:
+                if url in seen_urls:
+                    continue
+                seen_urls.add(url)
+            all_channels.append(item)
+    return all_channels, all(results)
 
-def resolve_vavoo_link(link):
-    signature = getAuthSignature()
-    if not signature:
+def get_channels():
+    channels, _ = fetch_catalog()
+    return channels
+
+# Parametri che portano una scadenza (timestamp unix) o un token JWT con claim "exp"
+_EXPIRY_PARAMS = ("expires", "expire", "expiry", "exp", "e", "validto", "valid_to", "until")
+_TOKEN_PARAMS = ("token", "auth", "vavoo_auth", "t", "jwt")
+
+def parse_stream_expiry(url, now=None):
+    """Ricava la scadenza (epoch, secondi) dai parametri dell'URL risolto, se presente."""
+    from urllib.parse import urlsplit, parse_qsl
+    import base64
+
+    now = now or time.time()
+    params = {k.lower(): v for k, v in parse_qsl(urlsplit(url).query)}
+    candidates = []
+    for key in _EXPIRY_PARAMS:
+        if params.get(key, "").isdigit():
+            candidates.append(int(params[key]))
+    for key in _TOKEN_PARAMS:
+        parts = params.get(key, "").split(".")
+        if len(parts) != 3:
+            continue
+        try:
+            payload = parts[1] + "=" * (-len(parts[1]) % 4)
+            claims = json.loads(base64.urlsafe_b64decode(payload))
+            candidates.append(int(claims["exp"]))
+        except (ValueError, KeyError, TypeError):
+            continue
+    for value in candidates:
+        if value > 10 ** 12:  # millisecondi
+            value //= 1000
+        # Ignora valori che non sembrano timestamp plausibili (passati o oltre un giorno)
+        if now < value <= now + 24 * 60 * 60:
+            return value
+    return None
+
+class StreamCache(ExpiringCache):
+    """
+    Cache LRU dei link risolti, indicizzata per link /play/ originale.
+    Ogni voce scade alla scadenza dichiarata dall'URL (meno un margine) o dopo
+    default_ttl; il tier su disco opzionale è condiviso tra processi.
+    """
+    def __init__(self, max_size=STREAM_CACHE_SIZE, default_ttl=STREAM_CACHE_TTL,
+                 margin=STREAM_CACHE_MARGIN, disk_path=STREAM_CACHE_PATH if STREAM_CACHE_DISK else None):
+        super().__init__(max_size, disk_path)
+        self.default_ttl = default_ttl
+        self.margin = margin
+
+    def _expires_for(self, url, now):
+        expires = parse_stream_expiry(url, now)
+        if expires is None:
+            return now + self.default_ttl
+        return expires - self.margin
+
+    def get(self, link):
+        return self.lookup(link)
+
+    def put(self, link, url):
+        try:
+            self.store(link, url, self._expires_for(url, time.time()))
+        except OSError as e:
+            print(f"[DEBUG] Impossibile salvare la cache stream su disco: {e}", file=sys.stderr)
+
+    def invalidate(self, link):
+        try:
+            super().invalidate(link)
+        except OSError:
+            pass
+
+stream_cache = StreamCache()
+
+def resolve_vavoo_link(link, use_cache=True, budget=None, raise_upstream=False):
+    """
+    Risolve un link Vavoo nell'URL dello stream (None se non riesce).
+    Con raise_upstream i problemi di upstream (firma, circuito aperto, rete, 5xx)
+    escono come UpstreamError invece di None: il chiamante li distingue da un canale morto.
+    """
+    cached = stream_cache.get(link) if use_cache else None
+    if cached:
+        print(f"[DEBUG] Resolved URL from stream cache: {link}", file=sys.stderr)
+        return cached
+    if not get_cached_signature():
         print("[DEBUG] Failed to get signature for resolution", file=sys.stderr)
+        if raise_upstream:
+            raise UpstreamError("firma non disponibile")
         return None
         
     headers = {
@@ -147,26 +670,33 @@ def resolve_vavoo_link(link):
         "accept": "application/json",
         "content-type": "application/json; charset=utf-8",
         "content-length": "115",
-        "accept-encoding": "gzip",
-        "mediahubmx-signature": signature
+        "accept-encoding": "gzip"
     }
     data = {
-        "language": "de",
-        "region": "AT",
+        "language": VAVOO_LANGUAGE,
+        "region": VAVOO_REGION,
         "url": link,
         "clientVersion": "3.0.2"
     }
     try:
-        resp = requests.post(f"https://{VAVOO_DOMAIN}/mediahubmx-resolve.json", json=data, headers=headers, timeout=10)
-        resp.raise_for_status()
+        resp = _post_hedged(f"{get_vavoo_base_url()}/mediahubmx-resolve.json", data, headers, budget=budget)
+        if resp is None:
+            return None
         result = resp.json()
         if isinstance(result, list) and result and result[0].get("url"):
+            stream_cache.put(link, result[0]["url"])
             return result[0]["url"]
         elif isinstance(result, dict) and result.get("url"):
+            stream_cache.put(link, result["url"])
             return result["url"]
         else:
             print(f"[DEBUG] Unexpected response format: {result}", file=sys.stderr)
             return None
+    except UpstreamError as e:
+        print(f"[DEBUG] Error resolving link: {e}", file=sys.stderr)
+        if raise_upstream:
+            raise
+        return None
     except Exception as e:
         print(f"[DEBUG] Error resolving link: {e}", file=sys.stderr)
         return None
@@ -183,8 +713,11 @@ def resolve_direct_link(link):
         print("[DEBUG] Il link non sembra essere un link Vavoo", file=sys.stderr)
         return None
         
-    signature = getAuthSignature()
-    if not signature:
+    cached = stream_cache.get(link)
+    if cached:
+        print(f"[DEBUG] Resolved URL from stream cache: {link}", file=sys.stderr)
+        return cached
+    if not get_cached_signature():
         print("[DEBUG] Failed to get signature for direct resolution", file=sys.stderr)
         return None
         
@@ -193,25 +726,27 @@ def resolve_direct_link(link):
         "accept": "application/json",
         "content-type": "application/json; charset=utf-8",
         "content-length": "115",
-        "accept-encoding": "gzip",
-        "mediahubmx-signature": signature
+        "accept-encoding": "gzip"
     }
     data = {
-        "language": "de",
-        "region": "AT",
+        "language": VAVOO_LANGUAGE,
+        "region": VAVOO_REGION,
         "url": link,
         "clientVersion": "3.0.2"
     }
     try:
-        resp = requests.post(f"https://{VAVOO_DOMAIN}/mediahubmx-resolve.json", json=data, headers=headers, timeout=10)
-        resp.raise_for_status()
+        resp = _post_hedged(f"{get_vavoo_base_url()}/mediahubmx-resolve.json", data, headers)
+        if resp is None:
+            return None
         result = resp.json()
         
         print(f"[DEBUG] Direct resolution response: {result}", file=sys.stderr)
         
         if isinstance(result, list) and result and result[0].get("url"):
+            stream_cache.put(link, result[0]["url"])
             return result[0]["url"]
         elif isinstance(result, dict) and result.get("url"):
+            stream_cache.put(link, result["url"])
             return result["url"]
         else:
             print(f"[DEBUG] Unexpected response format in direct resolution: {result}", file=sys.stderr)
@@ -231,102 +766,1069 @@ def build_vavoo_cache(channels):
         cache[name] = url
     return cache
 
+def read_vavoo_cache():
+    """Legge vavoo_cache.json così com'è su disco, None se manca o è illeggibile."""
+    try:
+        with open(VAVOO_CACHE_PATH, encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except (OSError, ValueError):
+        return None
+
+def _links_hash(cache):
+    import hashlib
+
+    payload = json.dumps(cache, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+def variant_key(name):
+    """Nome base condiviso dalle varianti: senza suffisso .a/.b e senza HD/FHD/4K."""
+    return _QUALITY_RE.sub('', _SUFFIX_RE.sub('', name.strip().upper()))
+
+def save_vavoo_cache(cache, previous=None):
+    """
+    Scrive la cache nome -> link in modo atomico con timestamp (ms, come addon.ts),
+    hash del contenuto e numero di generazione; la generazione precedente resta
+    in vavoo_cache.json.prev.
+    """
+    import shutil
+
+    previous = previous if previous is not None else read_vavoo_cache()
+    version = int((previous or {}).get("version", 0)) + 1
+    data = {
+        "version": version,
+        "timestamp": int(time.time() * 1000),
+        "hash": _links_hash(cache),
+        "count": len(cache),
+        "links": cache
+    }
+    if previous is not None:
+        shutil.copy2(VAVOO_CACHE_PATH, VAVOO_CACHE_PATH + ".prev")
+    write_json_atomic(VAVOO_CACHE_PATH, data, durable=True, ensure_ascii=False, indent=2)
+    write_compact_cache(cache)
+    return version
+
+# Formato compatto: header, tabella di record a lunghezza fissa ordinati per nome
+# (UTF-8) e blob di stringhe. Si apre con mmap e si cerca per bisezione.
+COMPACT_MAGIC = b"VVIDX001"
+_COMPACT_HEADER = "<8sI"
+_COMPACT_RECORD = "<IIII"
+
+def write_compact_cache(cache, path=COMPACT_CACHE_PATH):
+    """Scrive la tabella nome -> link ordinata in formato binario (atomico)."""
+    import struct
+
+    entries = sorted((name.encode("utf-8"), url.encode("utf-8")) for name, url in cache.items() if url)
+    header_size = struct.calcsize(_COMPACT_HEADER)
+    record_size = struct.calcsize(_COMPACT_RECORD)
+    offset = header_size + record_size * len(entries)
+    records, blob = [], []
+    for name, url in entries:
+        records.append(struct.pack(_COMPACT_RECORD, offset, len(name), offset + len(name), len(url)))
+        blob.append(name + url)
+        offset += len(name) + len(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack(_COMPACT_HEADER, COMPACT_MAGIC, len(entries)))
+        f.write(b"".join(records))
+        f.write(b"".join(blob))
+    os.replace(tmp_path, path)
+
+class CompactCatalog:
+    """
+    Lettura della tabella compatta via mmap: get() costa O(log N) confronti
+    senza caricare né parsare il catalogo.
+    """
+    def __init__(self, path=COMPACT_CACHE_PATH):
+        import mmap
+        import struct
+
+        self._struct = struct
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = struct.unpack_from(_COMPACT_HEADER, self._mm, 0)
+        if magic != COMPACT_MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} non è una cache compatta Vavoo")
+        self._header_size = struct.calcsize(_COMPACT_HEADER)
+        self._record_size = struct.calcsize(_COMPACT_RECORD)
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, i):
+        return self._struct.unpack_from(_COMPACT_RECORD, self._mm, self._header_size + i * self._record_size)
+
+    def _name(self, record):
+        return self._mm[record[0]:record[0] + record[1]]
+
+    def get(self, name):
+        key = name.encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self._record(mid)
+            current = self._name(record)
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return self._mm[record[2]:record[2] + record[3]].decode("utf-8")
+        return None
+
+    def items(self):
+        for i in range(self.count):
+            record = self._record(i)
+            yield self._name(record).decode("utf-8"), self._mm[record[2]:record[2] + record[3]].decode("utf-8")
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _mark_cache_checked():
+    """
+    Segna vavoo_cache.json come verificato adesso senza riscriverlo: la data di verifica
+    è la mtime (addon.ts e load_cached_channels usano la più recente tra mtime e timestamp).
+    """
+    try:
+        os.utime(VAVOO_CACHE_PATH)
+    except OSError as e:
+        print(f"[DEBUG] Impossibile aggiornare la data di verifica della cache: {e}", file=sys.stderr)
+
+def update_vavoo_cache(channels, min_ratio=CACHE_MIN_RATIO, force=False):
+    """
+    Aggiorna vavoo_cache.json con un catalogo completo. Mantiene la generazione
+    precedente se il nuovo catalogo è vuoto o molto più piccolo, finché il calo non
+    si ripete per CACHE_MAX_REJECTS volte di fila (o con force), e non riscrive il
+    file se il contenuto non è cambiato (aggiorna solo la data di verifica).
+    Restituisce "updated", "unchanged" o "rejected".
+    """
+    cache = build_vavoo_cache(channels)
+    previous = read_vavoo_cache()
+    previous_count = len((previous or {}).get("links") or {})
+    if not cache:
+        print("[DEBUG] Nuovo catalogo vuoto, mantengo la cache precedente", file=sys.stderr)
+        _mark_cache_checked()
+        return "rejected"
+    if previous_count and len(cache) < previous_count * min_ratio and not force:
+        rejects = int(previous.get("rejects", 0)) + 1
+        if rejects < CACHE_MAX_REJECTS:
+            print(f"[DEBUG] Nuovo catalogo sospetto ({len(cache)} canali contro {previous_count}, "
+                  f"rifiuto {rejects}/{CACHE_MAX_REJECTS}), mantengo la cache precedente", file=sys.stderr)
+            # La riscrittura rinnova anche la data di verifica: addon.ts non rilancia subito il dump
+            write_json_atomic(VAVOO_CACHE_PATH, {**previous, "rejects": rejects},
+                              durable=True, ensure_ascii=False, indent=2)
+            return "rejected"
+        print(f"[DEBUG] Catalogo ridotto a {len(cache)} canali per {rejects} volte di fila, lo accetto", file=sys.stderr)
+    if previous and previous.get("hash") == _links_hash(cache):
+        if previous.get("rejects"):
+            previous.pop("rejects")
+            write_json_atomic(VAVOO_CACHE_PATH, previous, durable=True, ensure_ascii=False, indent=2)
+        else:
+            _mark_cache_checked()
+        if not os.path.exists(COMPACT_CACHE_PATH):
+            write_compact_cache(cache)
+        return "unchanged"
+    save_vavoo_cache(cache, previous)
+    return "updated"
+
+def _write_matches(channels):
+    """Rigenera l'abbinamento offline del palinsesto; un errore non invalida la cache."""
+    try:
+        matches = reconcile_lineup(channels)
+        save_matches(matches)
+        print(f"[DEBUG] Riconciliazione: {len(matches['channels'])} canali abbinati, "
+              f"{len(matches['review'])} da rivedere", file=sys.stderr)
+    except (OSError, ValueError) as e:
+        print(f"[DEBUG] Riconciliazione del palinsesto non riuscita: {e}", file=sys.stderr)
+
+def _read_build_checkpoint():
+    """
+    Ricostruisce lo stato di fetch_catalog dal checkpoint, None se manca o è scaduto.
+    Un'ultima riga troncata (processo interrotto durante la scrittura) viene tagliata via,
+    così le pagine successive si accodano a una riga valida.
+    """
+    try:
+        with open(BUILD_CHECKPOINT_PATH, "r+b") as f:
+            header = json.loads(f.readline())
+            if time.time() - header.get("started", 0) >= BUILD_CHECKPOINT_MAX_AGE:
+                return None
+            state = {}
+            valid = f.tell()
+            for line in iter(f.readline, b""):
+                try:
+                    page = json.loads(line)
+                except ValueError:
+                    break
+                progress = state.setdefault(page["group"], {"cursor": 0, "items": [], "done": False})
+                progress["items"].extend(page["items"])
+                progress["cursor"] = page["cursor"]
+                progress["done"] = page["done"]
+                valid = f.tell()
+            f.truncate(valid)
+            return state
+    except (OSError, ValueError, AttributeError, KeyError, TypeError):
+        return None
+
+def build_cache_file(force=False):
+    """
+    --build-cache: scarica il catalogo salvando i cursori di paginazione, così un
+    run interrotto riprende da dove si era fermato, poi aggiorna la cache.
+    Il checkpoint è in JSON Lines: un'intestazione e poi una riga aggiunta per pagina,
+    senza riscrivere ogni volta i canali già scaricati. Un solo run alla volta:
+    se un altro processo tiene il lock restituisce "running".
+    """
+    try:
+        with FileLock(BUILD_CHECKPOINT_PATH + ".lock", blocking=False):
+            return _build_cache_file(force)
+    except BlockingIOError:
+        print("[DEBUG] Generazione della cache già in corso in un altro processo", file=sys.stderr)
+        return "running"
+
+def _build_cache_file(force):
+    state = _read_build_checkpoint()
+    if state is not None:
+        print("[DEBUG] Riprendo la generazione della cache dal checkpoint", file=sys.stderr)
+    else:
+        os.makedirs(os.path.dirname(BUILD_CHECKPOINT_PATH), exist_ok=True)
+        with open(BUILD_CHECKPOINT_PATH, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"started": time.time()}) + "\n")
+    checkpoint = open(BUILD_CHECKPOINT_PATH, "a", encoding="utf-8")
+
+    def save_checkpoint(group, items, progress):
+        checkpoint.write(json.dumps({"group": group, "items": items, "cursor": progress["cursor"],
+                                     "done": progress["done"]}, ensure_ascii=False) + "\n")
+        checkpoint.flush()
+
+    try:
+        channels, complete = fetch_catalog(state=state, on_page=save_checkpoint)
+    finally:
+        checkpoint.close()
+    if not complete:
+        print("[DEBUG] Download del catalogo interrotto, checkpoint salvato: cache precedente mantenuta", file=sys.stderr)
+        return "incomplete"
+    try:
+        os.remove(BUILD_CHECKPOINT_PATH)
+    except OSError:
+        pass
+    outcome = update_vavoo_cache(channels, force=force)
+    if outcome != "rejected":
+        _write_matches(channels)
+    return outcome
+
+def load_cached_channels(max_age=CATALOG_MAX_AGE):
+    """
+    Legge i canali da vavoo_cache.json (cache/ o, per compatibilità, la directory corrente).
+    Restituisce None se il file manca o è più vecchio di max_age secondi.
+    """
+    for path in (VAVOO_CACHE_PATH, "vavoo_cache.json"):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            # Il file non viene riscritto se il catalogo non cambia: vale anche la data di verifica
+            checked = max((data.get("timestamp") or 0) / 1000, os.path.getmtime(path))
+            age = time.time() - checked
+        except (OSError, ValueError, TypeError, AttributeError):
+            continue
+        if age > max_age:
+            print(f"[DEBUG] Cache {path} obsoleta ({int(age)}s)", file=sys.stderr)
+            return None
+        return [{"name": name, "url": url} for name, url in (data.get("links") or {}).items()]
+    return None
+
+_SUFFIX_RE = re.compile(r'\s+\.[a-zA-Z]$')
+_QUALITY_RE = re.compile(r'\s+(HD|FHD|4K)$')
+_NON_ALNUM_RE = re.compile(r'[^A-Z0-9]')
+
+class ChannelIndex:
+    """
+    Indice dei nomi canale costruito una volta per catalogo.
+    Replica i tre passaggi del vecchio matcher (esatto, parziale, flessibile)
+    con mappe hash e un indice a trigrammi al posto delle scansioni lineari:
+    a parità di passaggio vince sempre il primo canale in ordine di catalogo.
+    """
+    def __init__(self, channels):
+        self.channels = channels
+        self.by_url = {}
+        self.exact = {}
+        self.clean = {}
+        self.simple = {}
+        self.clean_keys = []
+        self.simple_keys = []
+        for pos, ch in enumerate(channels):
+            name = ch.get('name', '')
+            upper = name.strip().upper()
+            # Rimuovi suffissi comuni come .a, .b, .c, HD, etc.
+            clean = _QUALITY_RE.sub('', _SUFFIX_RE.sub('', upper))
+            # Rimuovi spazi e caratteri speciali per matching più flessibile
+            simple = _NON_ALNUM_RE.sub('', upper)
+            self.by_url.setdefault(ch.get('url'), pos)
+            self.exact.setdefault(normalize_vavoo_name(name), pos)
+            self.clean.setdefault(clean, []).append(pos)
+            self.simple.setdefault(simple, []).append(pos)
+            self.clean_keys.append(clean)
+            self.simple_keys.append(simple)
+        self._clean_lengths = {len(k) for k in self.clean}
+        self._simple_lengths = {len(k) for k in self.simple}
+        self._grams = {}
+
+    def _trigrams(self, keys):
+        # Costruito al primo uso: molte ricerche si fermano al match esatto
+        grams = self._grams.get(id(keys))
+        if grams is None:
+            grams = {}
+            for pos, key in enumerate(keys):
+                for i in range(len(key) - 2):
+                    postings = grams.setdefault(key[i:i + 3], [])
+                    if not postings or postings[-1] != pos:
+                        postings.append(pos)
+            self._grams[id(keys)] = grams
+        return grams
+
+    def _first_containment(self, wanted, key_map, key_lengths, keys):
+        """Prima posizione con chiave contenuta in wanted o che contiene wanted."""
+        best = None
+        # Chiavi contenute in wanted: solo le sottostringhe di lunghezza presente nell'indice
+        n = len(wanted)
+        for length in key_lengths:
+            if length > n:
+                continue
+            for i in range(n - length + 1):
+                positions = key_map.get(wanted[i:i + length])
+                if positions and (best is None or positions[0] < best):
+                    best = positions[0]
+        # Chiavi che contengono wanted: candidati dal trigramma più raro
+        if n >= 3:
+            grams = self._trigrams(keys)
+            postings = [grams.get(wanted[i:i + 3], ()) for i in range(n - 2)]
+            candidates = min(postings, key=len)
+        else:
+            candidates = range(len(keys))
+        for pos in candidates:
+            if best is not None and pos >= best:
+                break
+            if wanted in keys[pos]:
+                best = pos
+                break
+        return best
+
+    def variants(self, channel):
+        """Varianti di qualità dello stesso canale (stesso nome base), il canale dato per primo."""
+        positions = self.clean.get(variant_key(channel.get('name', '')), [])
+        others = [self.channels[p] for p in positions if self.channels[p].get('url') != channel.get('url')]
+        return [channel] + others
+
+    def find(self, wanted):
+        """Cerca il canale: prima l'abbinamento offline, poi match esatto, parziale, flessibile."""
+        match = get_matches().get(wanted)
+        pos = self.by_url.get(match["url"]) if match else None
+        if pos is not None:
+            print(f"[DEBUG] Found reconciled match: {self.channels[pos].get('name')} (score {match['score']})", file=sys.stderr)
+            return self.channels[pos]
+        pos = self.exact.get(wanted)
+        if pos is not None:
+            print(f"[DEBUG] Found exact match: {self.channels[pos].get('name')}", file=sys.stderr)
+            return self.channels[pos]
+        pos = self._first_containment(wanted, self.clean, self._clean_lengths, self.clean_keys)
+        if pos is not None:
+            print(f"[DEBUG] Found partial match: {self.channels[pos].get('name')} (cleaned: {self.clean_keys[pos]})", file=sys.stderr)
+            return self.channels[pos]
+        wanted_simple = _NON_ALNUM_RE.sub('', wanted)
+        pos = self._first_containment(wanted_simple, self.simple, self._simple_lengths, self.simple_keys)
+        if pos is not None:
+            print(f"[DEBUG] Found flexible match: {self.channels[pos].get('name')} (simplified: {self.simple_keys[pos]})", file=sys.stderr)
+            return self.channels[pos]
+        return None
+
+_index_lock = threading.Lock()
+_index_cache = {"channels": None, "index": None}
+
+def get_channel_index(channels):
+    """Restituisce l'indice del catalogo, ricostruendolo solo se il catalogo è cambiato."""
+    with _index_lock:
+        if _index_cache["channels"] is not channels:
+            _index_cache.update(channels=channels, index=ChannelIndex(channels))
+        return _index_cache["index"]
+
+def find_channel(channels, wanted):
+    """Cerca il canale nel catalogo tramite l'indice precalcolato."""
+    return get_channel_index(channels).find(wanted)
+
+_TOKEN_RE = re.compile(r'[A-Z]+|[0-9]+')
+_QUALITY_TOKENS = frozenset(("HD", "FHD", "UHD", "4K", "SD"))
+
+def _match_tokens(name):
+    """Token di confronto: lettere e numeri separati ("LA7D" -> LA, 7, D), senza suffisso .a/.b."""
+    tokens = _TOKEN_RE.findall(normalize_vavoo_name(name))
+    # "4K" viene spezzato in 4 + K: lo ricompone per riconoscerlo come qualità
+    merged = []
+    for token in tokens:
+        if token == "K" and merged and merged[-1] == "4":
+            merged[-1] = "4K"
+        else:
+            merged.append(token)
+    return merged
+
+def match_score(wanted, candidate):
+    """
+    Somiglianza tra un vavooName e un nome del catalogo, tra 0 e 1: media tra F1 dei
+    token e rapporto di SequenceMatcher sui caratteri. I marcatori di qualità presenti
+    solo nel catalogo non penalizzano; numeri diversi dimezzano il punteggio, così
+    "RAI 1" non si confonde con "RAI 2" e preferisce "RAI 1 HD" a "RAI 1 SPORT".
+    """
+    from collections import Counter
+    from difflib import SequenceMatcher
+
+    wanted_tokens = _match_tokens(wanted)
+    candidate_tokens = [t for t in _match_tokens(candidate)
+                        if t not in _QUALITY_TOKENS or t in wanted_tokens]
+    if not wanted_tokens or not candidate_tokens:
+        return 0.0
+    common = sum((Counter(wanted_tokens) & Counter(candidate_tokens)).values())
+    if not common:
+        return 0.0
+    precision = common / len(candidate_tokens)
+    recall = common / len(wanted_tokens)
+    f1 = 2 * precision * recall / (precision + recall)
+    chars = SequenceMatcher(None, "".join(wanted_tokens), "".join(candidate_tokens)).ratio()
+    score = (f1 + chars) / 2
+    if {t for t in wanted_tokens if t.isdigit()} != {t for t in candidate_tokens if t.isdigit()}:
+        score /= 2
+    return round(score, 3)
+
+def reconcile_lineup(channels, lineup_path=TV_CHANNELS_PATH):
+    """
+    Abbina ogni vavooName di tv_channels.json al nome di catalogo più simile.
+    I candidati sono i nomi che condividono almeno un token; a parità di punteggio
+    vince il primo in ordine di catalogo. Restituisce il contenuto di vavoo_matches.json:
+    "names" (vavooName normalizzato -> abbinamento, usato a runtime), "channels"
+    (id -> abbinamento migliore tra i suoi vavooNames) e "review" (da controllare).
+    """
+    with open(lineup_path, encoding='utf-8') as f:
+        lineup = json.load(f)
+    # Un candidato per nome normalizzato (le varianti .a/.b si risolvono a runtime)
+    candidates = {}
+    for ch in channels:
+        name, url = ch.get("name", ""), ch.get("url")
+        if name and url:
+            candidates.setdefault(normalize_vavoo_name(name), {"name": name, "url": url})
+    postings = {}
+    for pos, key in enumerate(candidates):
+        for token in set(_match_tokens(key)):
+            postings.setdefault(token, []).append(pos)
+    keys = list(candidates)
+
+    names, by_id, review = {}, {}, []
+    for entry in lineup:
+        for vavoo_name in entry.get("vavooNames") or []:
+            wanted = normalize_vavoo_name(vavoo_name)
+            match = names.get(wanted)
+            if match is None:
+                positions = sorted({p for t in set(_match_tokens(wanted)) for p in postings.get(t, ())})
+                scored = sorted(((match_score(wanted, keys[p]), -p) for p in positions), reverse=True)
+                best = scored[0] if scored else (0.0, 0)
+                runner_up = next((s for s in scored[1:]
+                                  if variant_key(keys[-s[1]]) != variant_key(keys[-best[1]])), None)
+                match = {"catalog_name": candidates[keys[-best[1]]]["name"] if scored else None,
+                         "url": candidates[keys[-best[1]]]["url"] if scored else None,
+                         "score": best[0]}
+                if runner_up:
+                    match["runner_up"] = candidates[keys[-runner_up[1]]]["name"]
+                    match["runner_up_score"] = runner_up[0]
+                names[wanted] = match
+                reason = None
+                if best[0] < MATCH_MIN_SCORE:
+                    reason = "nessun abbinamento affidabile"
+                elif best[0] < MATCH_REVIEW_SCORE:
+                    reason = "punteggio basso"
+                elif runner_up and best[0] - runner_up[0] < 0.05:
+                    reason = "ambiguo"
+                if reason:
+                    review.append({"id": entry.get("id"), "vavooName": vavoo_name, "reason": reason, **match})
+            if match["score"] >= MATCH_MIN_SCORE and match["score"] > by_id.get(entry.get("id"), {}).get("score", -1):
+                by_id[entry.get("id")] = {"vavooName": vavoo_name, **match}
+    names = {k: v for k, v in names.items() if v["score"] >= MATCH_MIN_SCORE}
+    return {"version": 1, "timestamp": int(time.time() * 1000), "names": names,
+            "channels": by_id, "review": review}
+
+def save_matches(matches):
+    write_json_atomic(MATCHES_PATH, matches, ensure_ascii=False, indent=2)
+    _matches_cache["names"] = None
+
+_matches_cache = {"names": None}
+
+def get_matches():
+    """Mappa vavooName normalizzato -> abbinamento offline ({} se il file non c'è)."""
+    names = _matches_cache["names"]
+    if names is None:
+        try:
+            with open(MATCHES_PATH, encoding='utf-8') as f:
+                names = json.load(f).get("names") or {}
+        except (OSError, ValueError, AttributeError):
+            names = {}
+        _matches_cache["names"] = names
+    return names
+
+_catalog_lock = threading.Lock()
+_catalog = {"channels": None, "loaded": False, "fetched": False, "mtime": None}
+
+def _cache_mtime():
+    try:
+        return os.path.getmtime(VAVOO_CACHE_PATH)
+    except OSError:
+        return None
+
+def _recently_refetched():
+    """True se un processo ha riscaricato il catalogo negli ultimi MISS_REFETCH_INTERVAL secondi."""
+    try:
+        return time.time() - os.path.getmtime(MISS_REFETCH_PATH) < MISS_REFETCH_INTERVAL
+    except OSError:
+        return False
+
+def _mark_refetched():
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(MISS_REFETCH_PATH, "a"):
+            pass
+        os.utime(MISS_REFETCH_PATH)
+    except OSError as e:
+        print(f"[DEBUG] Impossibile registrare il download del catalogo: {e}", file=sys.stderr)
+
+def _refetch_catalog():
+    """Riscarica il catalogo una sola volta per processo e aggiorna la cache su disco."""
+    with _catalog_lock:
+        if not _catalog["fetched"]:
+            _mark_refetched()
+            channels, complete = fetch_catalog()
+            print(f"[DEBUG] Found {len(channels)} total channels", file=sys.stderr)
+            if complete:
+                try:
+                    update_vavoo_cache(channels)
+                except OSError as e:
+                    print(f"[DEBUG] Impossibile aggiornare la cache: {e}", file=sys.stderr)
+            # Se il download fallisce si continua con la cache locale, se presente.
+            # La cache appena scritta è già quella in memoria: non va ricaricata
+            _catalog.update(channels=channels or _catalog["channels"] or [], fetched=True, mtime=_cache_mtime())
+        return _catalog["channels"]
+
+def lookup_channel(wanted):
+    """
+    Trova il canale partendo dalla cache locale; il catalogo viene riscaricato
+    solo se la cache manca, è obsoleta o non contiene il canale, e in quest'ultimo
+    caso non più di una volta ogni MISS_REFETCH_INTERVAL secondi: ogni processo CLI
+    parte da zero e un nome inesistente riscaricherebbe sempre il catalogo. Se un altro processo
+    riscrive vavoo_cache.json (mtime cambiato) la cache viene ricaricata: un processo
+    di lunga durata come --refresh-lineup vede sempre il catalogo aggiornato.
+    Restituisce (canale o None, lista canali consultata).
+    """
+    with _catalog_lock:
+        mtime = _cache_mtime()
+        if not _catalog["loaded"] or (mtime is not None and mtime != _catalog["mtime"]):
+            channels = load_cached_channels()
+            if channels:
+                print(f"[DEBUG] Loaded {len(channels)} channels from local cache", file=sys.stderr)
+            if _catalog["loaded"]:
+                # Catalogo nuovo: un canale mancante giustifica di nuovo un download
+                _catalog["fetched"] = False
+            _catalog.update(channels=channels or _catalog["channels"], loaded=True, mtime=mtime)
+        channels = _catalog["channels"]
+        fetched = _catalog["fetched"]
+    if channels:
+        found = find_channel(channels, wanted)
+        if found or fetched:
+            return found, channels
+        if _recently_refetched():
+            print(f"[DEBUG] Channel '{wanted}' not in local cache, catalog refreshed less than "
+                  f"{MISS_REFETCH_INTERVAL}s ago", file=sys.stderr)
+            return None, channels
+        print(f"[DEBUG] Channel '{wanted}' not in local cache, refreshing catalog", file=sys.stderr)
+    channels = _refetch_catalog()
+    return find_channel(channels, wanted), channels
+
+_health_lock = threading.Lock()
+
+def load_health():
+    try:
+        with open(HEALTH_PATH, encoding='utf-8') as f:
+            health = json.load(f)
+        return health if isinstance(health, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def record_health(results):
+    """Salva gli esiti delle sonde: {link: {"ok", "ttfb_ms", "checked"}}."""
+    with _health_lock:
+        try:
+            with FileLock(HEALTH_PATH + ".lock"):
+                health = load_health()
+                now = time.time()
+                health = {k: v for k, v in health.items() if now - v.get("checked", 0) < HEALTH_MAX_AGE * 4}
+                health.update(results)
+                write_json_atomic(HEALTH_PATH, health)
+        except OSError as e:
+            print(f"[DEBUG] Impossibile salvare lo stato delle varianti: {e}", file=sys.stderr)
+
+def rank_variants(candidates, health=None):
+    """
+    Ordina le varianti: prima quelle sane per tempo al primo byte (le sonde di
+    --probe-variants lo misurano; le risoluzioni normali segnano solo sana/morta e
+    vengono dopo quelle misurate), poi quelle mai viste (o con esito scaduto)
+    nell'ordine dato, infine quelle risultate morte.
+    """
+    health = load_health() if health is None else health
+    now = time.time()
+
+    def rank(item):
+        pos, ch = item
+        entry = health.get(ch.get("url"))
+        if not entry or now - entry.get("checked", 0) > HEALTH_MAX_AGE:
+            return (1, 0.0, pos)
+        if entry.get("ok"):
+            ttfb = entry.get("ttfb_ms")
+            return (0, ttfb if ttfb is not None else float("inf"), pos)
+        return (2, 0.0, pos)
+
+    return [ch for _, ch in sorted(enumerate(candidates), key=rank)]
+
+def probe_stream(link, timeout=PROBE_TIMEOUT):
+    """Risolve il link e misura il tempo al primo byte della playlist. Restituisce l'esito salvabile."""
+    result = {"ok": False, "ttfb_ms": None, "checked": time.time()}
+    resolved = resolve_vavoo_link(link)
+    if not resolved:
+        return result
+    start = time.perf_counter()
+    try:
+        resp = get_http_session().get(resolved, headers={"user-agent": "MediaHubMX/2"}, timeout=timeout, stream=True)
+        try:
+            first_chunk = next(resp.iter_content(512), b"")
+            result["ttfb_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            result["ok"] = resp.status_code == 200 and bool(first_chunk)
+        finally:
+            resp.close()
+    except Exception as e:
+        print(f"[DEBUG] Sonda fallita per {link}: {e}", file=sys.stderr)
+    if not result["ok"]:
+        stream_cache.invalidate(link)
+    return result
+
+def probe_variants(names=None, workers=PROBE_WORKERS):
+    """Sonda in parallelo tutte le varianti dei canali indicati (default: il palinsesto)."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    names = names if names is not None else load_lineup_names()
+    links = []
+    for name in names:
+        found, channels = lookup_channel(normalize_vavoo_name(name))
+        if found:
+            links.extend(ch["url"] for ch in get_channel_index(channels).variants(found)
+                         if ch.get("url") and ch["url"] not in links)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = dict(zip(links, pool.map(probe_stream, links)))
+    record_health(results)
+    return results
+
+def resolve_best_variant(found, channels, return_original_link=False, use_cache=True):
+    """
+    Prova le varianti del canale dalla più sana alla meno sana e restituisce
+    (variante, url risolto) della prima che si risolve. Gli esiti alimentano lo stato
+    delle varianti anche senza --probe-variants, ma il file si riscrive solo quando
+    un esito cambia o è scaduto (una sonda recente che la trovava morta resta).
+    Con return_original_link restituisce il link non risolto del canale trovato.
+    Tutte le varianti condividono un'unica scadenza (RESOLVE_BUDGET), così il failover
+    resta nel timeout di addon.ts; con upstream in difficoltà ci si ferma senza
+    segnare le varianti come morte.
+    """
+    if return_original_link:
+        # Il chiamante ha chiesto il link del canale trovato, non quello di un'altra variante
+        return found, found["url"]
+    health = load_health()
+    candidates = rank_variants([ch for ch in get_channel_index(channels).variants(found) if ch.get("url")], health)
+    deadline = time.monotonic() + RESOLVE_BUDGET
+    # Esiti da salvare: solo quelli che cambiano lo stato su disco o lo rinnovano scaduto
+    outcomes = {}
+
+    def note(url, ok):
+        entry = health.get(url)
+        if (not entry or time.time() - entry.get("checked", 0) > HEALTH_MAX_AGE
+                or (not ok and entry.get("ok"))
+                or (ok and not entry.get("ok") and entry.get("source") == "resolve")):
+            outcomes[url] = {"ok": ok, "ttfb_ms": None, "checked": time.time(), "source": "resolve"}
+
+    for attempt, ch in enumerate(candidates):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print("[DEBUG] Tempo esaurito per il failover tra le varianti", file=sys.stderr)
+            break
+        try:
+            resolved = resolve_vavoo_link(ch["url"], use_cache=use_cache, budget=remaining, raise_upstream=True)
+        except UpstreamError as e:
+            print(f"[DEBUG] Upstream non disponibile, interrompo il failover: {e}", file=sys.stderr)
+            break
+        if resolved:
+            if attempt:
+                print(f"[DEBUG] Failover sulla variante {ch.get('name')}", file=sys.stderr)
+            # Una sonda recente che la trovava morta resta: dice di più di una risoluzione riuscita
+            note(ch["url"], True)
+            if outcomes:
+                record_health(outcomes)
+            return ch, resolved
+        note(ch["url"], False)
+    if outcomes:
+        record_health(outcomes)
+    return candidates[0], None
+
+def add_channel_aliases(ch):
+    """Aggiunge al canale gli alias usati da --dump-channels per un miglior matching."""
+    if "name" in ch:
+        ch["aliases"] = [
+            ch["name"].replace(" HD", "").replace(" FHD", "").replace(" 4K", ""),  # Versione senza qualità
+            re.sub(r'\.[a-zA-Z]$', '', ch["name"]),  # Senza suffisso .a, .b, ecc
+        ]
+    return ch
+
+def is_direct_link(value):
+    return "vavoo.to" in value and "/play/" in value
+
+# Stati per elemento in --batch, allineati agli exit code della modalità singola
+BATCH_STATUS_CODES = {"OK": 0, "NOT_FOUND": 2, "NO_URL": 3, "RESOLVE_FAIL": 4, "ERROR": 5}
+
+def resolve_batch_item(item, return_original_link=False):
+    """
+    Risolve un elemento della modalità --batch: stringa (nome canale o link /play/)
+    oppure oggetto con "name" o "link" ed eventuale "id" da restituire invariato.
+    """
+    if isinstance(item, dict):
+        value = item.get("link") or item.get("name") or ""
+        result = {"input": value}
+        if "id" in item:
+            result["id"] = item["id"]
+    else:
+        value = str(item)
+        result = {"input": value}
+    try:
+        if is_direct_link(value):
+            link = value
+            resolved = resolve_direct_link(link)
+        else:
+            found, channels = lookup_channel(normalize_vavoo_name(value))
+            if not found:
+                return {**result, "status": "NOT_FOUND", "code": BATCH_STATUS_CODES["NOT_FOUND"]}
+            if not found.get("url"):
+                return {**result, "status": "NO_URL", "code": BATCH_STATUS_CODES["NO_URL"]}
+            variant, resolved = resolve_best_variant(found, channels, return_original_link)
+            link = variant["url"]
+            result["name"] = variant.get("name")
+        result["original_link"] = link
+        if not resolved:
+            return {**result, "status": "RESOLVE_FAIL", "code": BATCH_STATUS_CODES["RESOLVE_FAIL"]}
+        return {**result, "status": "OK", "code": BATCH_STATUS_CODES["OK"], "url": resolved}
+    except Exception as e:
+        print(f"[DEBUG] Exception in batch item {value}: {e}", file=sys.stderr)
+        return {**result, "status": "ERROR", "code": BATCH_STATUS_CODES["ERROR"], "error": str(e)}
+
+def run_batch(lines, out=sys.stdout, workers=BATCH_WORKERS, return_original_link=False):
+    """
+    Legge elementi JSON (uno per riga), li risolve con un pool limitato di worker
+    che condividono sessione, signature e catalogo, e scrive un risultato JSON per
+    riga in ordine di completamento. Restituisce il numero di elementi falliti.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    write_lock = threading.Lock()
+    # Limita gli elementi in volo per non leggere tutto stdin in memoria
+    slots = threading.BoundedSemaphore(workers * 2)
+    failures = [0]
+
+    def emit(result):
+        with write_lock:
+            if result["code"]:
+                failures[0] += 1
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+
+    def work(item):
+        try:
+            emit(resolve_batch_item(item, return_original_link))
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                emit({"input": line, "status": "ERROR", "code": BATCH_STATUS_CODES["ERROR"], "error": "invalid JSON"})
+                continue
+            slots.acquire()
+            pool.submit(work, item)
+    return failures[0]
+
 def mostra_debug_cache():
     import json
     try:
-        with open('vavoo_cache.json', encoding='utf-8') as f:
+        with open(VAVOO_CACHE_PATH, encoding='utf-8') as f:
             cache = json.load(f)
         return json.dumps(cache, indent=2, ensure_ascii=False)
     except Exception as e:
         return f"Errore nella lettura della cache: {e}"
 
-# Esegui con: python3 vavoo_resolver.py --build-cache
-if "--build-cache" in sys.argv:
+def record_request(name):
+    """
+    Conta le richieste per nome canale (serve al refresher per dare priorità ai più visti).
+    Accoda una riga al file senza lock né riscritture: una write breve in append è atomica.
+    """
+    if not TRACK_POPULARITY:
+        return
+    try:
+        os.makedirs(os.path.dirname(POPULARITY_PATH), exist_ok=True)
+        line = (json.dumps({"name": name, "count": 1}, ensure_ascii=False) + "\n").encode("utf-8")
+        fd = os.open(POPULARITY_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"[DEBUG] Impossibile aggiornare i contatori di richieste: {e}", file=sys.stderr)
+
+def _read_popularity():
+    counts = {}
+    lines = 0
+    try:
+        with open(POPULARITY_PATH, encoding='utf-8') as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                    counts[entry["name"]] = counts.get(entry["name"], 0) + int(entry["count"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except OSError:
+        pass
+    return counts, lines
+
+def load_popularity():
+    """
+    Somma i contatori; oltre POPULARITY_COMPACT_LINES righe riscrive il file con una
+    riga per nome. Una richiesta accodata proprio durante la compattazione può andare persa.
+    """
+    counts, lines = _read_popularity()
+    if lines > POPULARITY_COMPACT_LINES:
+        try:
+            with FileLock(POPULARITY_PATH + ".lock"):
+                counts, lines = _read_popularity()
+                tmp_path = f"{POPULARITY_PATH}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for name, count in counts.items():
+                        f.write(json.dumps({"name": name, "count": count}, ensure_ascii=False) + "\n")
+                os.replace(tmp_path, POPULARITY_PATH)
+        except OSError as e:
+            print(f"[DEBUG] Impossibile compattare i contatori di richieste: {e}", file=sys.stderr)
+    return counts
+
+def load_lineup_names(path=TV_CHANNELS_PATH):
+    """Tutti i vavooNames configurati in tv_channels.json, senza duplicati, in ordine di file."""
+    with open(path, encoding='utf-8') as f:
+        channels = json.load(f)
+    names = []
+    seen = set()
+    for channel in channels:
+        for name in channel.get("vavooNames") or []:
+            key = normalize_vavoo_name(name)
+            if key and key not in seen:
+                seen.add(key)
+                names.append(name)
+    return names
+
+def refresh_lineup(names=None, once=False, workers=REFRESH_WORKERS, lead=REFRESH_LEAD, jitter=REFRESH_JITTER):
+    """
+    Tiene caldi nella cache stream i link risolti di tutti i vavooNames del palinsesto.
+    Ogni canale viene risolto di nuovo poco prima della scadenza del suo link (con jitter
+    per non sincronizzare le richieste); tra i canali in scadenza insieme hanno
+    precedenza quelli più richiesti. Si scalda la variante che resolve_best_variant
+    servirebbe all'utente; un canale che fallisce viene riprovato con backoff esponenziale
+    (fino a REFRESH_MAX_BACKOFF). Con once=True fa un solo giro e restituisce gli esiti.
+    """
+    import heapq
+    import random
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    names = names if names is not None else load_lineup_names()
+    popularity = load_popularity()
+    # (scadenza del refresh, nome): all'avvio tutti subito
+    schedule = [(0.0, name) for name in names]
+    heapq.heapify(schedule)
+    outcomes = {}
+    failures = {}
+
+    def refresh(name):
+        found, channels = lookup_channel(normalize_vavoo_name(name))
+        if not found or not found.get("url"):
+            return None
+        variant, resolved = resolve_best_variant(found, channels, use_cache=False)
+        return stream_cache.expires_at(variant["url"]) if resolved else None
+
+    def reschedule(name, expires):
+        if expires:
+            failures.pop(name, None)
+            next_run = expires - lead - random.uniform(0, jitter)
+        else:
+            failures[name] = failures.get(name, 0) + 1
+            backoff = min(REFRESH_RETRY * 2 ** (failures[name] - 1), REFRESH_MAX_BACKOFF)
+            next_run = time.time() + backoff + random.uniform(0, jitter)
+        heapq.heappush(schedule, (max(next_run, time.time() + 1), name))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while schedule:
+            now = time.time()
+            due = []
+            while schedule and schedule[0][0] <= now:
+                due.append(heapq.heappop(schedule)[1])
+            if not due:
+                time.sleep(min(schedule[0][0] - now, 30))
+                popularity = load_popularity()
+                continue
+            due.sort(key=lambda n: popularity.get(normalize_vavoo_name(n), 0), reverse=True)
+            futures = {pool.submit(refresh, name): name for name in due}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    expires = future.result()
+                except Exception as e:
+                    print(f"[DEBUG] Errore nel refresh di {name}: {e}", file=sys.stderr)
+                    expires = None
+                outcomes[name] = expires
+                if not once:
+                    reschedule(name, expires)
+            if once:
+                break
+            print(f"[DEBUG] Refresh di {len(due)} canali, prossimo tra {max(0, schedule[0][0] - time.time()):.0f}s", file=sys.stderr)
+    return outcomes
+
+USAGE = """Usage: python3 vavoo_resolver.py <channel_name_or_vavoo_link> [--original-link] [--dump-channels [--ndjson]]
+       python3 vavoo_resolver.py --build-cache [--force]
+       python3 vavoo_resolver.py --compact-lookup <exact_channel_name>
+       python3 vavoo_resolver.py --batch [--workers N] [--original-link] < items.jsonl
+       python3 vavoo_resolver.py --refresh-lineup [--once] [--workers N]
+       python3 vavoo_resolver.py --probe-variants [--workers N]
+       python3 vavoo_resolver.py --reconcile"""
+
+def cli_build_cache(force):
+    outcome = build_cache_file(force)
+    if outcome == "updated":
+        print("Cache Vavoo generata con successo!")
+    elif outcome == "unchanged":
+        print("Cache Vavoo già aggiornata, nessuna modifica")
+    elif outcome == "running":
+        print("Generazione cache Vavoo già in corso")
+    else:
+        print("Generazione cache Vavoo non completata, mantenuta la versione precedente", file=sys.stderr)
+        return 1
+    return 0
+
+def cli_batch(workers, return_original_link):
+    failures = run_batch(sys.stdin, workers=workers, return_original_link=return_original_link)
+    print(f"[DEBUG] Batch completato, {failures} elementi non risolti, cache stream: {stream_cache.stats}", file=sys.stderr)
+    return 0
+
+def cli_refresh_lineup(once, workers):
+    outcomes = refresh_lineup(once=once, workers=workers)
+    failed = [name for name, expires in outcomes.items() if not expires]
+    print(f"[DEBUG] Refresh palinsesto: {len(outcomes) - len(failed)} canali risolti, non risolti: {failed}", file=sys.stderr)
+    return 0
+
+def cli_reconcile():
+    """Rigenera vavoo_matches.json dal catalogo in cache e stampa gli abbinamenti da rivedere."""
+    channels = load_cached_channels(max_age=float("inf")) or get_channels()
+    matches = reconcile_lineup(channels)
+    save_matches(matches)
+    print(f"{len(matches['channels'])} canali abbinati, {len(matches['review'])} da rivedere")
+    for item in matches["review"]:
+        runner_up = f" (poi {item['runner_up']} {item['runner_up_score']})" if item.get("runner_up") else ""
+        print(f"  [{item['reason']}] {item['vavooName']} -> {item['catalog_name']} {item['score']}{runner_up}")
+    return 0
+
+def cli_probe_variants(workers):
+    results = probe_variants(workers=workers)
+    for link, entry in sorted(results.items(), key=lambda kv: (not kv[1]["ok"], kv[1]["ttfb_ms"] or 0)):
+        status = f"{entry['ttfb_ms']:.0f} ms" if entry["ok"] else "KO"
+        print(f"{status:>8}  {link}")
+    return 0
+
+def cli_dump_channels(ndjson):
+    if ndjson:
+        # Un canale per riga, emesso appena arriva la pagina del catalogo
+        seen_urls = set()
+
+        def emit_page(group, items):
+            for ch in items:
+                url = ch.get("url")
+                if url:
+                    if url in seen_urls:
+                        continue
+                    seen_urls.add(url)
+                sys.stdout.write(json.dumps(add_channel_aliases(ch)) + "\n")
+            sys.stdout.flush()
+
+        channels, complete = fetch_catalog(on_items=emit_page)
+        if not complete:
+            return 1
+        # Lo script è l'unico a scrivere vavoo_cache.json: addon.ts la rilegge a fine dump
+        try:
+            update_vavoo_cache(channels)
+        except OSError as e:
+            print(f"[DEBUG] Impossibile aggiornare la cache: {e}", file=sys.stderr)
+        return 0
     channels = get_channels()
-    cache = build_vavoo_cache(channels)
-    with open("vavoo_cache.json", "w", encoding="utf-8") as f:
-        json.dump({"links": cache}, f, ensure_ascii=False, indent=2)
-    print("Cache Vavoo generata con successo!")
-    # RIMOSSO: stampa debug dettagliata
-    sys.exit(0)
+    # Aggiungi alias ai canali per un miglior matching
+    for ch in channels:
+        add_channel_aliases(ch)
+    print(json.dumps(channels))
+    return 0
 
-if __name__ == "__main__":
-    import sys
-    if len(sys.argv) < 2:
-        print("Usage: python3 vavoo_resolver.py <channel_name_or_vavoo_link> [--original-link] [--dump-channels]", file=sys.stderr)
-        sys.exit(1)
-    
-    # Controllo se l'opzione per dump dei canali è presente
-    if "--dump-channels" in sys.argv:
-        channels = get_channels()
-        # Aggiungi alias ai canali per un miglior matching
-        for ch in channels:
-            if "name" in ch:
-                ch["aliases"] = [
-                    ch["name"].replace(" HD", "").replace(" FHD", "").replace(" 4K", ""),  # Versione senza qualità
-                    re.sub(r'\.[a-zA-Z]$', '', ch["name"]),  # Senza suffisso .a, .b, ecc
-                ]
-        print(json.dumps(channels))
-        sys.exit(0)
-        
-    input_arg = sys.argv[1]
-    return_original_link = "--original-link" in sys.argv
-    
+def cli_compact_lookup(name):
+    """Ricerca esatta nella cache compatta, senza caricare il catalogo."""
+    try:
+        with CompactCatalog() as compact:
+            url = compact.get(name)
+    except (OSError, ValueError) as e:
+        print(f"[DEBUG] Cache compatta non disponibile: {e}", file=sys.stderr)
+        return 5
+    if not url:
+        print("NOT_FOUND", file=sys.stderr)
+        return 2
+    print(url)
+    return 0
+
+def cli_resolve(input_arg, return_original_link):
+    """Risolve un link /play/ o un nome canale; l'exit code segnala l'esito al chiamante."""
     # Controlla se l'input è un link Vavoo diretto
-    if "vavoo.to" in input_arg and "/play/" in input_arg:
+    if is_direct_link(input_arg):
         print(f"[DEBUG] Direct Vavoo link detected: {input_arg}", file=sys.stderr)
         resolved = resolve_direct_link(input_arg)
         if resolved:
             print(resolved)  # Output per il caller
-            sys.exit(0)
-        else:
-            print("[DEBUG] Failed to resolve direct link", file=sys.stderr)
-            print("RESOLVE_FAIL", file=sys.stderr)
-            sys.exit(4)
+            return 0
+        print("[DEBUG] Failed to resolve direct link", file=sys.stderr)
+        print("RESOLVE_FAIL", file=sys.stderr)
+        return 4
     
     # Altrimenti tratta come nome di canale
     wanted = normalize_vavoo_name(input_arg)
     print(f"[DEBUG] Looking for channel: {wanted}", file=sys.stderr)
+    record_request(wanted)
     
     try:
-        channels = get_channels()
-        print(f"[DEBUG] Found {len(channels)} total channels", file=sys.stderr)
-        
-        found = None
-        # Prima prova matching esatto
-        for ch in channels:
-            chname = normalize_vavoo_name(ch.get('name', ''))
-            if chname == wanted:
-                found = ch
-                print(f"[DEBUG] Found exact match: {ch.get('name')}", file=sys.stderr)
-                break
-        
-        # Se non trova matching esatto, prova matching parziale/fuzzy
-        if not found:
-            for ch in channels:
-                original_name = ch.get('name', '').strip().upper()
-                # Rimuovi suffissi comuni come .a, .b, .c, HD, etc.
-                clean_name = re.sub(r'\s+\.[a-zA-Z]$', '', original_name)
-                clean_name = re.sub(r'\s+(HD|FHD|4K)$', '', clean_name)
-                
-                # Controlla se il nome pulito contiene il nome cercato o viceversa
-                if wanted in clean_name or clean_name in wanted:
-                    found = ch
-                    print(f"[DEBUG] Found partial match: {ch.get('name')} (cleaned: {clean_name})", file=sys.stderr)
-                    break
-        
-        # Se ancora non trova, prova una ricerca ancora più flessibile
-        if not found:
-            for ch in channels:
-                original_name = ch.get('name', '').strip().upper()
-                # Rimuovi spazi e caratteri speciali per matching più flessibile
-                name_simple = re.sub(r'[^A-Z0-9]', '', original_name)
-                wanted_simple = re.sub(r'[^A-Z0-9]', '', wanted)
-                
-                if wanted_simple in name_simple or name_simple in wanted_simple:
-                    found = ch
-                    print(f"[DEBUG] Found flexible match: {ch.get('name')} (simplified: {name_simple})", file=sys.stderr)
-                    break
+        found, channels = lookup_channel(wanted)
         
         if not found:
             print(f"[DEBUG] Channel '{wanted}' not found in {len(channels)} channels", file=sys.stderr)
@@ -334,33 +1836,75 @@ if __name__ == "__main__":
             sample_names = [normalize_vavoo_name(ch.get('name', '')) for ch in channels[:10]]
             print(f"[DEBUG] Sample channel names: {sample_names}", file=sys.stderr)
             print("NOT_FOUND", file=sys.stderr)
-            sys.exit(2)
+            return 2
             
         url = found.get('url')
         if not url:
             print("[DEBUG] No URL found for channel", file=sys.stderr)
             print("NO_URL", file=sys.stderr)
-            sys.exit(3)
+            return 3
             
         print(f"[DEBUG] Found Vavoo URL: {url}", file=sys.stderr)
         
-        # Se richiesto, restituisci solo il link originale Vavoo
-        if return_original_link:
-            print(url)  # Restituisce il link Vavoo originale non risolto
-            sys.exit(0)
-        
-        # Altrimenti risolvi il link
-        print(f"[DEBUG] Resolving URL: {url}", file=sys.stderr)
-        resolved = resolve_vavoo_link(url)
+        # Tra le varianti (.a/.b, HD/FHD) sceglie la più sana; con --original-link
+        # restituisce il link Vavoo originale non risolto del canale trovato
+        variant, resolved = resolve_best_variant(found, channels, return_original_link)
         if resolved:
+            if variant is not found:
+                print(f"[DEBUG] Using variant {variant.get('name')}: {variant['url']}", file=sys.stderr)
             print(resolved)  # Questo è l'output che viene letto
-            sys.exit(0)
-        else:
-            print("[DEBUG] Failed to resolve URL", file=sys.stderr)
-            print("RESOLVE_FAIL", file=sys.stderr)
-            sys.exit(4)
+            return 0
+        print("[DEBUG] Failed to resolve URL", file=sys.stderr)
+        print("RESOLVE_FAIL", file=sys.stderr)
+        return 4
             
     except Exception as e:
         print(f"[DEBUG] Exception: {str(e)}", file=sys.stderr)
         print("ERROR", file=sys.stderr)
-        sys.exit(5) 
+        return 5
+
+def main(argv=None):
+    """Entry point da riga di comando; restituisce l'exit code."""
+    argv = sys.argv[1:] if argv is None else argv
+    # Esegui con: python3 vavoo_resolver.py --build-cache
+    if "--build-cache" in argv:
+        return cli_build_cache("--force" in argv)
+    if not argv:
+        print(USAGE, file=sys.stderr)
+        return 1
+    return_original_link = "--original-link" in argv
+    workers = None
+    if "--workers" in argv:
+        position = argv.index("--workers") + 1
+        try:
+            workers = int(argv[position])
+        except (IndexError, ValueError):
+            workers = 0
+        if workers < 1:
+            print("--workers richiede un intero positivo", file=sys.stderr)
+            print(USAGE, file=sys.stderr)
+            return 1
+    # Modalità batch: JSON lines su stdin, un risultato JSON per riga su stdout
+    if "--batch" in argv:
+        return cli_batch(workers or BATCH_WORKERS, return_original_link)
+    # Refresher: mantiene risolti i link del palinsesto di tv_channels.json
+    if "--refresh-lineup" in argv:
+        return cli_refresh_lineup("--once" in argv, workers or REFRESH_WORKERS)
+    if "--reconcile" in argv:
+        return cli_reconcile()
+    # Sonda le varianti di qualità del palinsesto e ne salva lo stato
+    if "--probe-variants" in argv:
+        return cli_probe_variants(workers or PROBE_WORKERS)
+    # Controllo se l'opzione per dump dei canali è presente
+    if "--dump-channels" in argv:
+        return cli_dump_channels("--ndjson" in argv)
+    if "--compact-lookup" in argv:
+        position = argv.index("--compact-lookup") + 1
+        if position >= len(argv):
+            print(USAGE, file=sys.stderr)
+            return 1
+        return cli_compact_lookup(argv[position])
+    return cli_resolve(argv[0], return_original_link)
+
+if __name__ == "__main__":
+    sys.exit(main())